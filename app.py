@@ -1,19 +1,165 @@
 import os
+import re
+import time
+import uuid
 import shutil
+import tarfile
+import zipfile
+import json
+import queue
+import hashlib
+import mimetypes
+import threading
+import subprocess
 import patoolib
-import tempfile
+from urllib.parse import quote
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
-from flask import Flask, request, send_file, jsonify, render_template_string, abort
+from flask import Flask, Response, request, send_file, jsonify, render_template_string, abort, stream_with_context
+from file_index import FileIndex
+from job_registry import JobRegistry
+from hash_index import HashIndex, file_sha256, link_file
+from shared_state import SharedState, FileLock
+from metrics import Metrics, MetricsMiddleware, ROUTE_KEY, UNKNOWN_ROUTE, merge as merge_metrics, render as render_metrics
+
+# 画像のサムネイルは Pillow があれば使う (無ければ ffmpeg で作る)
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
 
 # --- 設定 ---
 BASE_DIR = os.getcwd()
 DOWNLOAD_DIR = os.path.join(BASE_DIR, "downloads")
 EXTRACT_DIR = os.path.join(BASE_DIR, "extracted")
+STATE_DIR = os.path.join(BASE_DIR, ".state")
+INDEX_DB = os.path.join(STATE_DIR, "index.db")
+REGISTRY_DB = os.path.join(STATE_DIR, "downloads.db")  # downloader.py が書き込むジョブの状態
+HASH_DB = os.path.join(STATE_DIR, "hashes.db")  # downloads の内容ハッシュ (downloader.py と共有)
+SHARED_DB = os.path.join(STATE_DIR, "shared.db")  # ワーカー間で共有する解凍ジョブ・イベント
+INDEXER_LOCK = os.path.join(STATE_DIR, "indexer.lock")  # 索引を更新するプロセスが持つロック
+ROOTS = {"downloads": DOWNLOAD_DIR, "extracted": EXTRACT_DIR}
+
+# ZIPダウンロードの設定
+ZIP_CHUNK_SIZE = 1024 * 1024
+# 圧縮済みのため、ZIP内で再圧縮せずにそのまま格納する拡張子
+ZIP_STORE_EXTENSIONS = {
+    '.zip', '.rar', '.7z', '.gz', '.bz2', '.xz', '.zst',
+    '.mp4', '.mkv', '.avi', '.mov', '.webm',
+    '.mp3', '.flac', '.aac', '.ogg', '.m4a',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp',
+}
+
+# ファイルダウンロードの設定
+RANGE_CHUNK_SIZE = 256 * 1024
+MAX_RANGES = 16  # これより多い範囲を一度に要求された場合は、範囲指定を無視して全体を返す
+# inline=1 でブラウザ内で再生・表示してよい種類 (スクリプトを含み得るSVGは除く)
+INLINE_MIME_PREFIXES = ('video/', 'audio/', 'image/')
+INLINE_MIME_EXCLUDE = {'image/svg+xml'}
+
+# serve.py で複数のワーカーを起動したときのワーカー数 (解凍の同時実行数を分け合う)
+WORKER_COUNT = max(int(os.environ.get('FILE_MANAGER_WORKERS', 1)), 1)
+INDEXER_RETRY = 10  # 索引を更新しているワーカーが終了していないか確認する間隔 (秒)
+METRICS_SHARE_INTERVAL = 5  # 複数ワーカーのとき、計測値を共有状態に書き出す間隔 (秒)
+
+# 解凍ジョブの設定
+# 同時に実行する解凍の数 (FILE_MANAGER_EXTRACT_WORKERS で指定しなければ、CPU数とディスクの種類から決める)
+EXTRACT_WORKERS = int(os.environ.get('FILE_MANAGER_EXTRACT_WORKERS', 0))
+EXTRACT_TEMP_PREFIX = '.extracting-'  # 解凍中の一時フォルダ (終わってから本来の場所へ移す)
+EXTRACT_CHUNK_SIZE = 1024 * 1024
+JOB_HISTORY = 100  # 終了したジョブを覚えておく件数
+
+# アーカイブの中身の一覧をキャッシュする数
+ARCHIVE_CACHE_SIZE = 32
+
+# サムネイルの設定 (画像は Pillow か ffmpeg、動画は ffmpeg で作る。どちらも無ければ作らない)
+THUMB_DIR = os.path.join(STATE_DIR, "thumbs")
+THUMB_SIZE = 128  # 長辺のピクセル数
+THUMB_QUALITY = 80
+THUMB_CACHE_BYTES = int(os.environ.get('FILE_MANAGER_THUMB_CACHE_MB', 256)) * 1024 * 1024  # これを超えたら古いものから消す
+THUMB_WORKERS = 2  # 同時に作成する数
+THUMB_TIMEOUT = 30  # 1件の作成を待つ最大時間 (秒)
+THUMB_VIDEO_SEEK = 5  # 動画はこの位置 (秒) のコマを使う (短い動画は先頭)
+THUMB_FAILED_SIZE = 10000  # 作れなかったファイルを覚えておく件数
+THUMB_RESCAN_INTERVAL = 300  # 他のワーカーが作った分も含めて合計サイズを数え直す間隔 (秒)
+THUMB_IMAGE_EXTS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+THUMB_VIDEO_EXTS = {'.mp4', '.mkv', '.avi', '.mov', '.webm', '.m4v'}
+FFMPEG = shutil.which('ffmpeg')
+
+# イベント (Server-Sent Events) の設定
+EVENT_QUEUE_SIZE = 1000  # 送りきれないイベントがこれ以上たまった接続は切る (再接続で最新の状態を送り直す)
+EVENT_INTERVAL = 1.0  # ジョブの進捗を送る間隔 (秒)
+DISK_EVENT_INTERVAL = 5.0  # ディスク容量を確認する間隔 (秒)
+EVENT_KEEPALIVE = 15  # 何も送るものが無いときに、接続確認のコメントを送る間隔 (秒)
+
+# 分割アップロードの設定
+UPLOAD_STATE_DIR = os.path.join(STATE_DIR, "uploads")  # 受信途中のファイル (.part) と進捗 (.json)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 1回のリクエストで送る大きさ (クライアントが指定しなければこれ)
+UPLOAD_MIN_CHUNK = 1024 * 1024
+UPLOAD_MAX_CHUNK = 64 * 1024 * 1024
+UPLOAD_WRITE_SIZE = 1024 * 1024
+UPLOAD_EXPIRE = 24 * 3600  # この時間 更新の無いアップロードは破棄する (秒)
+# 同じ内容のファイルが既にあるときの動作 (off: そのまま保存, skip: 保存しない, link: ハードリンクにする)
+DEDUP_MODES = ('off', 'skip', 'link')
+UPLOAD_DEDUP = os.environ.get('FILE_MANAGER_UPLOAD_DEDUP', 'off')
+
+# 一覧キャッシュの設定
+LIST_CACHE_SIZE = 256  # キャッシュするフォルダ数
+# フォルダのmtimeはファイルの追加・削除・名前変更でしか変わらないため、
+# 書き込み中のファイルのサイズ変化もいずれ反映されるよう一定時間で読み直す
+LIST_CACHE_TTL = 30
 
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 os.makedirs(EXTRACT_DIR, exist_ok=True)
+os.makedirs(UPLOAD_STATE_DIR, exist_ok=True)
+os.makedirs(THUMB_DIR, exist_ok=True)
 
 app = Flask(__name__)
+# nginx / Apache の前段でファイルを送らせる場合は FILE_MANAGER_X_SENDFILE=1
+app.config['USE_X_SENDFILE'] = os.environ.get('FILE_MANAGER_X_SENDFILE') == '1'
+
+# ルートごとの処理時間・送信バイト数 (/metrics)
+request_metrics = Metrics()
+app.wsgi_app = MetricsMiddleware(app.wsgi_app, request_metrics)
+
+@app.before_request
+def record_route():
+    # 計測はパスではなくルート単位でまとめる (/api/list/<root_name> など)
+    request.environ[ROUTE_KEY] = request.url_rule.rule if request.url_rule else UNKNOWN_ROUTE
+
+# downloader.py のジョブの登録簿 (読むだけ)
+download_registry = JobRegistry(REGISTRY_DB)
+
+# 全ファイルの索引 (バックグラウンドで作成・更新)
+file_index = FileIndex(INDEX_DB, ROOTS, ignore_prefixes=(EXTRACT_TEMP_PREFIX,))
+
+# downloads の内容ハッシュの索引 (重複の表示・アップロードの重複排除に使う)
+hash_index = HashIndex(HASH_DB, DOWNLOAD_DIR)
+
+# ワーカー間で共有する解凍ジョブ・イベント
+shared = SharedState(SHARED_DB)
+
+# 索引の作成・更新は1つのプロセスだけが行い、他のワーカーは読むだけにする
+indexer_lock = FileLock(INDEXER_LOCK)
+is_indexer = False
+
+def try_become_indexer():
+    """索引を更新しているプロセスがいなければ引き受ける (ロックはプロセスが終わるまで持ち続ける)"""
+    global is_indexer
+    if is_indexer or not indexer_lock.acquire(blocking=False):
+        return
+    is_indexer = True
+    shared.set_flag("index_ready", 0)
+    shared.set_flag("hash_ready", 0)
+    file_index.start()
+    hash_index.start()
+
+def index_ready():
+    return file_index.ready if is_indexer else shared.get_flag("index_ready") == "1"
+
+def hashes_ready():
+    return hash_index.ready if is_indexer else shared.get_flag("hash_ready") == "1"
 
 # --- ヘルパー関数 ---
 def get_size_format(b, factor=1024, suffix="B"):
@@ -27,18 +173,43 @@ def safe_join(base, path):
     """ディレクトリトラバーサル対策を行ったパス結合"""
     if not path:
         return base
+    base = os.path.abspath(base)
     full_path = os.path.abspath(os.path.join(base, path))
-    if not full_path.startswith(base):
+    # '/base' と '/base-other' を区別するため、区切り文字まで含めて比べる
+    if full_path != base and not full_path.startswith(base + os.sep):
         raise ValueError("Access denied")
     return full_path
 
-def get_file_info(root_base, subpath):
-    target_dir = safe_join(root_base, subpath)
+def member_path(dst, name, is_dir=False):
+    """アーカイブのエントリ名 (信用できない) から展開先のパスを求める
+
+    絶対パス・'..' を含む名前や、展開済みのシンボリックリンクをたどって dst の外に出る場合は ValueError。
+    '.' や './' のように dst そのものを指すエントリは、ディレクトリのときだけ認める (dst を返す)"""
+    parts = name.replace('\\', '/').split('/')
+    if name.startswith(('/', '\\')) or '..' in parts:
+        raise ValueError(f"Unsafe entry name: {name}")
+    path = safe_join(dst, name)
+    real_dst = os.path.realpath(dst)
+    real_path = os.path.realpath(path)
+    if real_path == real_dst:
+        if not is_dir:
+            raise ValueError(f"Unsafe entry name: {name}")
+        return path
+    if not real_path.startswith(real_dst + os.sep):
+        raise ValueError(f"Unsafe entry name: {name}")
+    return path
+
+def is_inline_type(mimetype):
+    return bool(mimetype) and mimetype.startswith(INLINE_MIME_PREFIXES) and mimetype not in INLINE_MIME_EXCLUDE
+
+def scan_dir(target_dir, subpath):
     files = []
     
     try:
         with os.scandir(target_dir) as entries:
             for entry in entries:
+                if entry.name.startswith(EXTRACT_TEMP_PREFIX):
+                    continue
                 stat = entry.stat()
                 is_dir = entry.is_dir()
                 ext = os.path.splitext(entry.name)[1].lower()
@@ -57,9 +228,12 @@ def get_file_info(root_base, subpath):
                     "size": get_size_format(stat.st_size) if not is_dir else "-",
                     "mtime": datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M'),
                     "icon": icon,
-                    "is_archive": ext in ['.zip', '.rar', '.7z', '.tar', '.gz'],
+                    "is_archive": ext in ['.zip', '.rar', '.7z', '.tar', '.gz'] or bool(NUMBERED_VOLUME_RE.match(entry.name)),
+                    "is_media": not is_dir and is_inline_type(mimetypes.guess_type(entry.name)[0]),
+                    "has_thumb": not is_dir and can_thumbnail(ext),
                     "type": "dir" if is_dir else "file",
-                    "raw_mtime": stat.st_mtime
+                    "raw_mtime": stat.st_mtime,
+                    "raw_size": stat.st_size if not is_dir else 0
                 })
     except Exception as e:
         print(f"Error scanning dir: {e}")
@@ -67,6 +241,1147 @@ def get_file_info(root_base, subpath):
         
     return sorted(files, key=lambda x: (x["type"] != "dir", -x["raw_mtime"]))
 
+# --- 一覧キャッシュ ---
+list_cache = OrderedDict()  # フォルダの絶対パス -> {"mtime_ns", "scanned", "files", "etag"}
+list_cache_lock = threading.Lock()
+
+def listing_etag(subpath, mtime_ns, files):
+    """一覧の内容から作る ETag (読み直しても・別のワーカーが読んでも、内容が同じなら同じ値)"""
+    digest = hashlib.sha1(f"{subpath}:{mtime_ns}".encode('utf-8', 'surrogateescape'))
+    for f in sorted(files, key=lambda f: f["name"]):
+        digest.update(f"\0{f['name']}\0{f['type']}\0{f['raw_size']}\0{f['raw_mtime']!r}".encode('utf-8', 'surrogateescape'))
+    return digest.hexdigest()[:16]
+
+def get_listing(root_base, subpath):
+    """フォルダの一覧をキャッシュから返す (フォルダのmtimeが変わっていれば読み直す)"""
+    target_dir = safe_join(root_base, subpath)
+    try:
+        st = os.stat(target_dir)
+    except OSError as e:
+        print(f"Error scanning dir: {e}")
+        return {"files": [], "etag": None}
+
+    now = time.time()
+    with list_cache_lock:
+        entry = list_cache.get(target_dir)
+        # mtimeの精度が粗いファイルシステムでも変更を見逃さないよう、
+        # 読み込み時刻がmtimeの直後だった場合はキャッシュを信用しない
+        if (entry and entry["mtime_ns"] == st.st_mtime_ns
+                and entry["scanned"] > st.st_mtime + 1
+                and now - entry["scanned"] < LIST_CACHE_TTL):
+            list_cache.move_to_end(target_dir)
+            return entry
+
+    files = scan_dir(target_dir, subpath)
+    entry = {
+        "mtime_ns": st.st_mtime_ns,
+        "scanned": now,
+        "files": files,
+        "etag": listing_etag(subpath, st.st_mtime_ns, files),
+    }
+    with list_cache_lock:
+        list_cache[target_dir] = entry
+        list_cache.move_to_end(target_dir)
+        while len(list_cache) > LIST_CACHE_SIZE:
+            list_cache.popitem(last=False)
+    return entry
+
+def invalidate_listing(path, recursive=False):
+    """書き込みを行ったフォルダ (と、recursive なら配下) のキャッシュを捨てる"""
+    path = os.path.abspath(path)
+    with list_cache_lock:
+        list_cache.pop(path, None)
+        if recursive:
+            prefix = path + os.sep
+            for key in [k for k in list_cache if k.startswith(prefix)]:
+                del list_cache[key]
+
+def get_file_info(root_base, subpath):
+    return get_listing(root_base, subpath)["files"]
+
+def notify_change(path, recursive=False):
+    """アプリ自身が書き込んだ場所を、一覧キャッシュと索引に反映する"""
+    invalidate_listing(path, recursive)
+    target = path if os.path.isdir(path) else os.path.dirname(path)
+    if is_indexer:
+        file_index.mark_dirty(target, recursive)
+    else:
+        # 索引を更新しているワーカーに頼む
+        shared.publish("index", {"path": target, "recursive": recursive})
+
+LIST_SORT_KEYS = {
+    "name": lambda f: f["name"].lower(),
+    "size": lambda f: f["raw_size"],
+    "mtime": lambda f: f["raw_mtime"],
+}
+
+def query_listing(listing, sort="mtime", order="desc", q="", dir_sizes=None):
+    """一覧を並べ替え (フォルダが先) て名前で絞り込む。並べ替えた結果はキャッシュに残す"""
+    views = listing.setdefault("views", {})
+    key = (sort, order)
+    if sort == "size" and dir_sizes:
+        # フォルダの合計サイズは一覧とは別に変わるので、この並べ替えはキャッシュしない
+        files = sorted(
+            listing["files"],
+            key=lambda f: dir_sizes.get(f["name"], 0) if f["type"] == "dir" else f["raw_size"],
+            reverse=(order == "desc"))
+        files.sort(key=lambda f: f["type"] != "dir")
+    else:
+        if key not in views:
+            files = sorted(listing["files"], key=LIST_SORT_KEYS[sort], reverse=(order == "desc"))
+            files.sort(key=lambda f: f["type"] != "dir")
+            views[key] = files
+        files = views[key]
+    if q:
+        q = q.lower()
+        files = [f for f in files if q in f["name"].lower()]
+    return files
+
+def with_dir_sizes(files, dir_sizes):
+    """フォルダの行に索引で集計した合計サイズを入れる (集計前のフォルダは "-" のまま)"""
+    return [
+        dict(f, size=get_size_format(dir_sizes[f["name"]]), raw_size=dir_sizes[f["name"]])
+        if f["type"] == "dir" and f["name"] in dir_sizes else f
+        for f in files
+    ]
+
+def with_duplicates(files, duplicates):
+    """同じ内容の別のファイルがあるファイルに、その数を入れる"""
+    return [dict(f, duplicates=duplicates[f["name"]]) if f["name"] in duplicates else f for f in files]
+
+def content_disposition(filename, disposition='attachment'):
+    """日本語などを含むファイル名でも使えるContent-Dispositionヘッダー"""
+    try:
+        filename.encode('ascii')
+        return f'{disposition}; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"{disposition}; filename*=UTF-8''{quote(filename)}"
+
+# --- サムネイル ---
+# 作成したサムネイルは元ファイルのパス・更新日時・サイズから決めた名前で THUMB_DIR に保存し、
+# 合計サイズが THUMB_CACHE_BYTES を超えたら使われていない順に消す。
+thumb_lock = threading.Lock()
+thumb_cache = OrderedDict()  # キー -> サイズ (使われていない順)
+thumb_cache_bytes = 0
+thumb_pending = {}  # 作成中のキー -> Future (同じファイルを同時に作らない)
+thumb_failed = OrderedDict()  # 作れなかったキー (何度も試さない)
+thumb_pool = ThreadPoolExecutor(max_workers=THUMB_WORKERS, thread_name_prefix="thumb")
+
+def can_thumbnail(ext):
+    if ext in THUMB_IMAGE_EXTS:
+        return bool(Image or FFMPEG)
+    return ext in THUMB_VIDEO_EXTS and bool(FFMPEG)
+
+def thumb_key(path, st):
+    key = f"{path}:{st.st_mtime_ns}:{st.st_size}:{THUMB_SIZE}"
+    return hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+
+def thumb_path(key):
+    return os.path.join(THUMB_DIR, key + '.jpg')
+
+def evict_thumbs():
+    """合計サイズが上限を超えていれば古いものから消す (thumb_lock を持って呼ぶ)"""
+    global thumb_cache_bytes
+    while thumb_cache_bytes > THUMB_CACHE_BYTES and thumb_cache:
+        key, size = thumb_cache.popitem(last=False)
+        thumb_cache_bytes -= size
+        try:
+            os.remove(thumb_path(key))
+        except OSError:
+            pass
+
+def load_thumb_cache():
+    """保存済みのサムネイルを、最後に使われた順 (更新日時) に読み直す
+
+    他のワーカーが作った・消した分も反映するため、一定間隔で呼び直す。"""
+    global thumb_cache_bytes
+    entries = []
+    now = time.time()
+    for entry in os.scandir(THUMB_DIR):
+        try:
+            st = entry.stat()
+            if entry.name.endswith('.jpg'):
+                entries.append((st.st_mtime, entry.name[:-4], st.st_size))
+            elif entry.name.endswith('.tmp') and now - st.st_mtime > THUMB_TIMEOUT * 2:
+                os.remove(entry.path)  # 作成途中で終了した分
+        except OSError:
+            pass
+    with thumb_lock:
+        thumb_cache.clear()
+        thumb_cache_bytes = 0
+        for _, key, size in sorted(entries):
+            thumb_cache[key] = size
+            thumb_cache_bytes += size
+        evict_thumbs()
+
+def make_image_thumb(src, dst):
+    with Image.open(src) as im:
+        im.draft('RGB', (THUMB_SIZE, THUMB_SIZE))  # JPEGは縮小しながら読み込む
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((THUMB_SIZE, THUMB_SIZE))
+        im.convert('RGB').save(dst, 'JPEG', quality=THUMB_QUALITY)
+
+def make_ffmpeg_thumb(src, dst, seek=0):
+    cmd = [FFMPEG, '-nostdin', '-v', 'error', '-y']
+    if seek:
+        cmd += ['-ss', str(seek)]  # -i の前に置くと、近くのキーフレームまで読み飛ばす
+    cmd += ['-i', src, '-frames:v', '1',
+            '-vf', f'scale={THUMB_SIZE}:{THUMB_SIZE}:force_original_aspect_ratio=decrease',
+            '-q:v', '5', '-f', 'mjpeg', dst]
+    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=THUMB_TIMEOUT)
+    return os.path.exists(dst) and os.path.getsize(dst) > 0
+
+def generate_thumb(src, ext, key):
+    """サムネイルを作ってキャッシュに加える (thumb_pool で実行)"""
+    global thumb_cache_bytes
+    tmp_path = f"{thumb_path(key)}.{threading.get_ident()}.tmp"
+    try:
+        if ext in THUMB_IMAGE_EXTS and Image:
+            make_image_thumb(src, tmp_path)
+        elif ext in THUMB_VIDEO_EXTS:
+            if not make_ffmpeg_thumb(src, tmp_path, THUMB_VIDEO_SEEK) and not make_ffmpeg_thumb(src, tmp_path):
+                raise ValueError("Cannot read video frame")
+        elif not make_ffmpeg_thumb(src, tmp_path):
+            raise ValueError("Cannot read image")
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, thumb_path(key))
+        with thumb_lock:
+            thumb_cache[key] = size
+            thumb_cache_bytes += size
+            evict_thumbs()
+    except Exception:
+        with thumb_lock:
+            thumb_failed[key] = True
+            while len(thumb_failed) > THUMB_FAILED_SIZE:
+                thumb_failed.popitem(last=False)
+        raise
+    finally:
+        with thumb_lock:
+            thumb_pending.pop(key, None)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def get_thumb(src):
+    """サムネイルのパス (無ければバックグラウンドで作り、THUMB_TIMEOUT まで待つ)"""
+    global thumb_cache_bytes
+    st = os.stat(src)
+    ext = os.path.splitext(src)[1].lower()
+    if not can_thumbnail(ext):
+        raise ValueError("Thumbnail is not available for this file")
+    key = thumb_key(src, st)
+    with thumb_lock:
+        if key in thumb_cache:
+            thumb_cache.move_to_end(key)
+            path = thumb_path(key)
+            try:
+                os.utime(path)  # 再起動後も使われた順が分かるように
+                return path
+            except OSError:
+                thumb_cache_bytes -= thumb_cache.pop(key)  # 外から消されていたら作り直す
+        if key in thumb_failed:
+            raise ValueError("Cannot create thumbnail")
+        future = thumb_pending.get(key)
+        if future is None:
+            future = thumb_pending[key] = thumb_pool.submit(generate_thumb, src, ext, key)
+    future.result(timeout=THUMB_TIMEOUT)
+    return thumb_path(key)
+
+# --- 範囲指定ダウンロード ---
+def file_etag(path, st):
+    key = f"{path}:{st.st_mtime_ns}:{st.st_size}"
+    return hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+
+def if_range_matches(etag, st):
+    """If-Range が無いか、ファイルが変わっていなければ True"""
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return int(st.st_mtime) <= if_range.date.timestamp()
+    return True
+
+def parse_ranges(header):
+    """'bytes=0-99,200-,-50' を [(start, stop)] にする (stopは含まない。末尾からの指定は start が負, stop が None)
+
+    werkzeug は重なった範囲や順番が前後した範囲を受け付けないため自前で読む"""
+    if not header or not header.startswith('bytes='):
+        return None
+    ranges = []
+    for spec in header[6:].split(','):
+        first, sep, last = spec.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if not first:
+                ranges.append((-int(last), None))
+            else:
+                start = int(first)
+                stop = int(last) + 1 if last else None
+                if stop is not None and stop <= start:
+                    return None
+                ranges.append((start, stop))
+        except ValueError:
+            return None
+    return ranges
+
+def resolve_ranges(ranges, length):
+    """Rangeヘッダーの範囲を [start, stop) に直し、重なり・隣接をまとめる (満たせない範囲は捨てる)"""
+    result = []
+    for start, stop in ranges:
+        if start < 0:
+            start, stop = max(length + start, 0), length
+        elif stop is None or stop > length:
+            stop = length
+        if start < stop:
+            result.append([start, stop])
+    merged = []
+    for start, stop in sorted(result):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return merged
+
+def range_response(path, length, ranges, mimetype):
+    """範囲の要求に 206 で応える (範囲が複数なら multipart/byteranges)"""
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        heads, sep, tail = [b""], b"", b""
+    else:
+        boundary = uuid.uuid4().hex
+        heads = [
+            (f"--{boundary}\r\nContent-Type: {mimetype}\r\n"
+             f"Content-Range: bytes {start}-{stop - 1}/{length}\r\n\r\n").encode('latin-1')
+            for start, stop in ranges
+        ]
+        sep, tail = b"\r\n", f"--{boundary}--\r\n".encode('latin-1')
+
+    def generate():
+        with open(path, 'rb') as f:
+            for head, (start, stop) in zip(heads, ranges):
+                if head:
+                    yield head
+                f.seek(start)
+                remaining = stop - start
+                while remaining > 0:
+                    data = f.read(min(RANGE_CHUNK_SIZE, remaining))
+                    if not data:
+                        return  # 送信中にファイルが短くなった
+                    remaining -= len(data)
+                    yield data
+                if sep:
+                    yield sep
+        if tail:
+            yield tail
+
+    if len(ranges) == 1:
+        response = Response(generate(), status=206, mimetype=mimetype)
+        response.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{length}"
+    else:
+        response = Response(generate(), status=206, content_type=f"multipart/byteranges; boundary={boundary}")
+    response.content_length = sum(len(h) + stop - start + len(sep) for h, (start, stop) in zip(heads, ranges)) + len(tail)
+    return response
+
+class ZipStream:
+    """ZipFileの書き込み先。書き込まれたデータを溜めておき、レスポンスとして順に取り出す"""
+
+    def __init__(self):
+        self.chunks = []
+        self.pos = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def generate_zip(target, store_media=True):
+    """フォルダを走査しながらZIPを生成し、少しずつ返すジェネレーター (一時ファイルなし)"""
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for dirpath, dirnames, filenames in os.walk(target):
+            dirnames.sort()
+            rel_dir = os.path.relpath(dirpath, target).replace("\\", "/")
+            if not dirnames and not filenames and rel_dir != '.':
+                # 空のフォルダもZIPに含める
+                zf.writestr(zipfile.ZipInfo(rel_dir + '/'), b'')
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                arcname = os.path.relpath(path, target).replace("\\", "/")
+                zinfo = zipfile.ZipInfo.from_file(path, arcname)
+                ext = os.path.splitext(name)[1].lower()
+                if store_media and ext in ZIP_STORE_EXTENSIONS:
+                    zinfo.compress_type = zipfile.ZIP_STORED
+                else:
+                    zinfo.compress_type = zipfile.ZIP_DEFLATED
+                with open(path, 'rb') as src, zf.open(zinfo, 'w', force_zip64=True) as dst:
+                    while True:
+                        chunk = src.read(ZIP_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        data = stream.pop()
+                        if data:
+                            yield data
+                yield stream.pop()
+    # 最後にセントラルディレクトリを送る
+    yield stream.pop()
+
+# --- 解凍ジョブ ---
+def is_rotational(path):
+    """path のあるディスクがHDDなら True (分からなければ False)"""
+    try:
+        dev = os.stat(path).st_dev
+        block = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+        # パーティションの場合は親のデバイスに queue がある
+        for queue_dir in (os.path.join(block, 'queue'), os.path.join(block, '..', 'queue')):
+            try:
+                with open(os.path.join(queue_dir, 'rotational')) as f:
+                    return f.read().strip() == '1'
+            except OSError:
+                continue
+    except (OSError, AttributeError):
+        pass
+    return False
+
+def default_extract_workers():
+    """CPU数に合わせる。ただしHDDでは同時に書き込むとシークが増えて遅くなるため2つまで"""
+    cores = os.cpu_count() or 1
+    if is_rotational(EXTRACT_DIR):
+        return min(cores, 2)
+    return min(cores, 8)
+
+# 複数のワーカーで動かす場合は、同時に実行する解凍の数を分け合う
+extract_pool = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS or max(1, default_extract_workers() // WORKER_COUNT))
+jobs = {}  # job_id -> ジョブの状態
+jobs_lock = threading.Lock()
+
+class JobCancelled(Exception):
+    pass
+
+def create_job(kind, name):
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "kind": kind,
+        "name": name,
+        "state": "queued",  # queued / running / done / error / cancelled
+        "done_bytes": 0,
+        "total_bytes": None,
+        "done_entries": 0,
+        "total_entries": None,
+        "error": None,
+        "created": time.time(),
+        "started": None,
+        "finished": None,
+        "cancel": False,
+        "future": None,
+    }
+    with jobs_lock:
+        jobs[job["id"]] = job
+        # 古い終了済みジョブを削除
+        finished = [j for j in jobs.values() if j["finished"]]
+        for old in sorted(finished, key=lambda j: j["finished"])[:max(0, len(finished) - JOB_HISTORY)]:
+            del jobs[old["id"]]
+    share_jobs()  # すぐに他のワーカーからも見えるように
+    return job
+
+# --- ワーカー間でのジョブの共有 ---
+shared_jobs = {}  # job_id -> 最後に共有した状態
+shared_jobs_lock = threading.Lock()
+
+def share_jobs():
+    """このプロセスのジョブのうち、変わったものを共有状態に書き込む"""
+    with jobs_lock:
+        current = list(jobs.values())
+    with shared_jobs_lock:
+        records = []
+        for job in current:
+            key = (job["state"], job["done_bytes"], job["done_entries"], job["cancel"])
+            if shared_jobs.get(job["id"]) != key:
+                shared_jobs[job["id"]] = key
+                records.append(job_to_dict(job))
+        for job_id in set(shared_jobs) - {job["id"] for job in current}:
+            del shared_jobs[job_id]
+        if records:
+            shared.save_jobs(records)
+
+def cancel_local_job(job):
+    job["cancel"] = True
+    # まだ始まっていなければその場で取り消す
+    if job["future"] is not None and job["future"].cancel():
+        job["state"] = "cancelled"
+        job["finished"] = time.time()
+
+def apply_cancel_requests():
+    """他のワーカーに来た中止の依頼を、このプロセスのジョブに反映する"""
+    with jobs_lock:
+        active = {j["id"]: j for j in jobs.values() if not j["finished"] and not j["cancel"]}
+    for job_id in shared.cancel_requests(active):
+        cancel_local_job(active[job_id])
+
+def job_to_dict(job):
+    """APIで返すジョブの状態 (経過時間とスループットを含む)"""
+    end = job["finished"] or time.time()
+    elapsed = end - job["started"] if job["started"] else 0
+    return {
+        "id": job["id"],
+        "kind": job["kind"],
+        "name": job["name"],
+        "state": job["state"],
+        "done_bytes": job["done_bytes"],
+        "total_bytes": job["total_bytes"],
+        "done_entries": job["done_entries"],
+        "total_entries": job["total_entries"],
+        "percent": round(job["done_bytes"] / job["total_bytes"] * 100, 1) if job["total_bytes"] else None,
+        "elapsed": round(elapsed, 1),
+        "rate": get_size_format(job["done_bytes"] / elapsed) + "/s" if elapsed > 0 else None,
+        "error": job["error"],
+        "cancel_requested": job["cancel"],
+        "created": job["created"],
+    }
+
+def check_cancel(job):
+    if job["cancel"]:
+        raise JobCancelled()
+
+def copy_entry(job, src, dst_path):
+    """アーカイブ内のファイルを少しずつ書き出し、進捗を更新する"""
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    with open(dst_path, 'wb') as f:
+        while True:
+            check_cancel(job)
+            chunk = src.read(EXTRACT_CHUNK_SIZE)
+            if not chunk:
+                break
+            f.write(chunk)
+            job["done_bytes"] += len(chunk)
+
+def zip_member_name(member):
+    """UTF-8フラグの無いZIPのファイル名を UTF-8 または Shift_JIS として読み直す"""
+    if member.flag_bits & 0x800:
+        return member.filename
+    raw = member.filename.encode('cp437')
+    for encoding in ('utf-8', 'cp932'):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return member.filename
+
+def extract_zip(job, src, dst, names=None):
+    with zipfile.ZipFile(src) as zf:
+        members = zf.infolist()
+        if names is not None:
+            members = [m for m in members if zip_member_name(m) in names]
+        job["total_entries"] = len(members)
+        job["total_bytes"] = sum(m.file_size for m in members)
+        for member in members:
+            check_cancel(job)
+            path = member_path(dst, zip_member_name(member), member.is_dir())
+            if member.is_dir():
+                os.makedirs(path, exist_ok=True)
+            else:
+                with zf.open(member) as f:
+                    copy_entry(job, f, path)
+            job["done_entries"] += 1
+
+def extract_tar(job, src, dst, names=None):
+    with tarfile.open(src) as tar:
+        for member in tar:
+            check_cancel(job)
+            if names is not None and member.name not in names:
+                continue
+            path = member_path(dst, member.name, member.isdir())
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+            elif member.isfile():
+                copy_entry(job, tar.extractfile(member), path)
+            elif hasattr(tarfile, 'data_filter'):
+                # リンクなどは安全なもの (展開先の中を指すもの) だけ展開する
+                try:
+                    tar.extract(member, dst, filter='data')
+                except tarfile.FilterError:
+                    pass
+            job["done_entries"] += 1
+
+def extract_cli(job, src, dst, names=None):
+    """7z / rar (分割されたものも含む) を外部コマンドで展開する (中止は可能だが途中経過は分からない)
+
+    names を指定すると、そのファイルだけを展開する"""
+    names = sorted(names or [])
+    if archive_kind(src) == 'rar':
+        cmd = ['unrar', 'x', '-o+', '-inul', '--', src, *names, dst + os.sep]
+    else:
+        cmd = ['7z', 'x', '-y', '-spd', f'-o{dst}', '--', src, *names]
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while proc.poll() is None:
+            if job["cancel"]:
+                proc.terminate()
+                proc.wait()
+                raise JobCancelled()
+            time.sleep(0.5)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.read().decode('utf-8', 'replace').strip() or f"exit code {proc.returncode}")
+    job["done_bytes"] = job["total_bytes"] or 0
+    job["done_entries"] = job["total_entries"] or 0
+
+def move_into_place(src, dst):
+    """解凍し終えた一時フォルダを dst に移す。dst が既にあれば中身を上書きでまとめる"""
+    if not os.path.exists(dst):
+        os.rename(src, dst)
+        return
+    for name in os.listdir(src):
+        s, d = os.path.join(src, name), os.path.join(dst, name)
+        if os.path.isdir(s) and os.path.isdir(d) and not os.path.islink(d):
+            move_into_place(s, d)
+        else:
+            if os.path.isdir(d) and not os.path.islink(d):
+                shutil.rmtree(d)
+            os.replace(s, d)
+
+def run_extract_job(job, src, dst, names=None, volumes=None):
+    """解凍ジョブ本体 (zip/tarは自前で展開して進捗を報告し、それ以外はpatoolに任せる)
+
+    names を指定すると、そのエントリだけを展開する。
+    展開は同じフォルダ内の一時フォルダに行い、終わってから dst に移すので、
+    Extractedタブに書きかけのフォルダが見えることはない。"""
+    if job["cancel"]:
+        job["state"] = "cancelled"
+        job["finished"] = time.time()
+        return
+    job["state"] = "running"
+    job["started"] = time.time()
+    share_jobs()
+    tmp = os.path.join(os.path.dirname(dst), f"{EXTRACT_TEMP_PREFIX}{job['id']}-{os.path.basename(dst)}")
+    try:
+        os.makedirs(tmp)
+        if volumes and len(volumes) > 1:
+            # 分割アーカイブは最初のボリュームを渡せば残りも読まれる
+            extract_cli(job, src, tmp, names)
+        elif zipfile.is_zipfile(src):
+            extract_zip(job, src, tmp, names)
+        elif tarfile.is_tarfile(src):
+            extract_tar(job, src, tmp, names)
+        elif names is not None:
+            extract_cli(job, src, tmp, names)
+        else:
+            # patoolは途中経過が分からず、途中で止めることもできない
+            patoolib.extract_archive(src, outdir=tmp, verbosity=-1)
+            job["done_bytes"] = os.path.getsize(src)
+        check_cancel(job)
+        move_into_place(tmp, dst)
+        job["state"] = "done"
+        notify_change(dst, recursive=True)
+    except JobCancelled:
+        job["state"] = "cancelled"
+    except Exception as e:
+        job["state"] = "error"
+        job["error"] = str(e)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+        job["finished"] = time.time()
+        share_jobs()
+        notify_change(os.path.dirname(dst))
+
+# 分割アーカイブのボリューム名 (name.part1.rar / name.7z.001 / name.rar + name.r00)
+PART_RAR_RE = re.compile(r'^(?P<base>.+)\.part(?P<num>\d+)\.rar$', re.I)
+NUMBERED_VOLUME_RE = re.compile(r'^(?P<base>.+\.(?:7z|zip|rar|tar|tgz|gz|bz2|xz))\.(?P<num>\d{3})$', re.I)
+OLD_RAR_RE = re.compile(r'^(?P<base>.+)\.r(?P<num>\d{2})$', re.I)
+
+def archive_volumes(path):
+    """path を含む分割アーカイブの全ボリューム (先頭が最初のボリューム)。分割されていなければ [path]"""
+    dirname, name = os.path.split(path)
+    try:
+        siblings = os.listdir(dirname)
+    except OSError:
+        return [path]
+    for pattern in (PART_RAR_RE, NUMBERED_VOLUME_RE):
+        m = pattern.match(name)
+        if m:
+            volumes = []
+            for sibling in siblings:
+                s = pattern.match(sibling)
+                if s and s['base'] == m['base']:
+                    volumes.append((int(s['num']), sibling))
+            return [os.path.join(dirname, n) for _, n in sorted(volumes)]
+    # 古い形式: name.rar が最初で、続きが name.r00, name.r01, ...
+    m = OLD_RAR_RE.match(name)
+    base = m['base'] if m else (name[:-4] if name.lower().endswith('.rar') else None)
+    if base is not None and base + '.rar' in siblings:
+        rest = sorted((int(s['num']), n) for n in siblings if (s := OLD_RAR_RE.match(n)) and s['base'] == base)
+        if rest:
+            return [os.path.join(dirname, base + '.rar')] + [os.path.join(dirname, n) for _, n in rest]
+    return [path]
+
+def archive_folder_name(path):
+    """解凍先のフォルダ名 (分割アーカイブはボリューム番号などを除く)"""
+    name = os.path.basename(path)
+    for pattern in (PART_RAR_RE, NUMBERED_VOLUME_RE):
+        m = pattern.match(name)
+        if m:
+            name = m['base'] if pattern is PART_RAR_RE else os.path.splitext(m['base'])[0]
+            return name
+    return os.path.splitext(name)[0]
+
+def submit_extract(src, names=None):
+    """解凍ジョブをバックグラウンドのプールに登録する (names を指定するとそのエントリだけ)
+
+    分割アーカイブはどのボリュームが渡されても、最初のボリュームから1回だけ解凍する"""
+    volumes = archive_volumes(src)
+    src = volumes[0]
+    dst = os.path.join(EXTRACT_DIR, archive_folder_name(src))
+    job = create_job("extract", os.path.basename(src))
+    if len(volumes) > 1:
+        job["name"] += f" (+{len(volumes) - 1} ボリューム)"
+        job["total_bytes"] = sum(os.path.getsize(v) for v in volumes)
+    if names is not None:
+        entries = select_archive_entries(src, names)
+        names = {e["name"] for e in entries}
+        job["name"] += f" ({len(names)} 件)"
+        job["total_entries"] = len(names)
+        job["total_bytes"] = sum(e["size"] for e in entries)
+    job["future"] = extract_pool.submit(run_extract_job, job, src, dst, names, volumes)
+    return job
+
+def submit_extract_batch(paths):
+    """複数の圧縮ファイルをまとめて登録する。同じ分割アーカイブのボリュームは1つのジョブにまとめる"""
+    submitted, skipped, errors = [], [], []
+    seen = set()
+    for path in paths:
+        try:
+            src = safe_join(DOWNLOAD_DIR, path)
+            if not os.path.isfile(src):
+                raise FileNotFoundError("File not found")
+            first = archive_volumes(src)[0]
+            if first in seen:
+                skipped.append(path)
+                continue
+            seen.add(first)
+            submitted.append({"path": path, "job_id": submit_extract(src)["id"]})
+        except Exception as e:
+            errors.append({"path": path, "message": str(e)})
+    return submitted, skipped, errors
+
+# --- アーカイブの中身 ---
+# 解凍せずに一覧を見たり、1ファイルだけ取り出したりする。
+# zip/tarはPythonで直接読み (無圧縮tarは目的の位置へシークする)、7z/rarは外部コマンドを使う。
+archive_cache = OrderedDict()  # アーカイブの絶対パス -> {"mtime_ns", "size", "kind", "entries"}
+archive_cache_lock = threading.Lock()
+
+def archive_kind(path):
+    if zipfile.is_zipfile(path):
+        return 'zip'
+    if tarfile.is_tarfile(path):
+        return 'tar'
+    lower = path.lower()
+    if lower.endswith('.rar') or OLD_RAR_RE.match(os.path.basename(lower)):
+        return 'rar'
+    if lower.endswith('.7z') or NUMBERED_VOLUME_RE.match(os.path.basename(lower)):
+        return '7z'
+    raise ValueError("Unsupported archive")
+
+def parse_cli_listing(output, sep):
+    """`7z l -slt` / `unrar lt` の「キー = 値」形式の出力を、エントリごとの辞書にする"""
+    blocks, current = [], {}
+    for line in output.splitlines():
+        key, found, value = line.strip().partition(sep)
+        if found and key:
+            current[key.strip()] = value.strip()
+        elif not line.strip() and current:
+            blocks.append(current)
+            current = {}
+    if current:
+        blocks.append(current)
+    return blocks
+
+def run_cli(cmd):
+    proc = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.decode('utf-8', 'replace').strip() or f"exit code {proc.returncode}")
+    return proc.stdout.decode('utf-8', 'replace')
+
+def read_archive_entries(path, kind):
+    entries = []
+    if kind == 'zip':
+        with zipfile.ZipFile(path) as zf:
+            for m in zf.infolist():
+                entries.append({
+                    "name": zip_member_name(m).rstrip('/'),
+                    "size": m.file_size,
+                    "is_dir": m.is_dir(),
+                    "mtime": "%04d-%02d-%02d %02d:%02d" % m.date_time[:5],
+                })
+    elif kind == 'tar':
+        try:
+            # 無圧縮なら各ファイルの位置を覚えておき、取り出すときはそこへシークする
+            tar, plain = tarfile.open(path, 'r:'), True
+        except tarfile.ReadError:
+            tar, plain = tarfile.open(path), False
+        with tar:
+            for m in tar:
+                if not (m.isfile() or m.isdir()):
+                    continue
+                entries.append({
+                    "name": m.name.rstrip('/'),
+                    "size": m.size if m.isfile() else 0,
+                    "is_dir": m.isdir(),
+                    "mtime": datetime.fromtimestamp(m.mtime).strftime('%Y-%m-%d %H:%M'),
+                    "offset": m.offset_data if plain else None,
+                })
+    elif kind == '7z':
+        output = run_cli(['7z', 'l', '-slt', '--', path])
+        # 区切り線より後がエントリ (前はアーカイブ自体の情報)
+        for block in parse_cli_listing(output.split('\n----------\n', 1)[-1], ' = '):
+            if 'Path' not in block:
+                continue
+            entries.append({
+                "name": block['Path'],
+                "size": int(block.get('Size') or 0),
+                "is_dir": block.get('Folder') == '+' or block.get('Attributes', '').startswith('D'),
+                "mtime": block.get('Modified', '')[:16],
+            })
+    else:
+        output = run_cli(['unrar', 'lt', '-c-', '--', path])
+        for block in parse_cli_listing(output, ': '):
+            if 'Name' not in block or 'Type' not in block:
+                continue
+            entries.append({
+                "name": block['Name'],
+                "size": int(block.get('Size') or 0),
+                "is_dir": block['Type'] == 'Directory',
+                "mtime": block.get('mtime', '')[:16],
+            })
+    return entries
+
+def list_archive(path):
+    """アーカイブの中身の一覧 (アーカイブのパス・mtime・サイズが同じ間はキャッシュを返す)"""
+    path = archive_volumes(path)[0]
+    st = os.stat(path)
+    with archive_cache_lock:
+        cached = archive_cache.get(path)
+        if cached and cached["mtime_ns"] == st.st_mtime_ns and cached["size"] == st.st_size:
+            archive_cache.move_to_end(path)
+            return cached
+    kind = archive_kind(path)
+    listing = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "kind": kind, "entries": read_archive_entries(path, kind)}
+    with archive_cache_lock:
+        archive_cache[path] = listing
+        while len(archive_cache) > ARCHIVE_CACHE_SIZE:
+            archive_cache.popitem(last=False)
+    return listing
+
+def select_archive_entries(path, names):
+    """選ばれたエントリ (フォルダなら配下も) のうち、ファイルの一覧"""
+    names = [n.rstrip('/') for n in names if n]
+    prefixes = tuple(n + '/' for n in names)
+    selected = set(names)
+    entries = [e for e in list_archive(path)["entries"]
+               if not e["is_dir"] and (e["name"] in selected or e["name"].startswith(prefixes))]
+    if not entries:
+        raise FileNotFoundError("No matching entries")
+    return entries
+
+def stream_archive_entry(path, name):
+    """アーカイブ内の1ファイルを (エントリ, データのジェネレーター) で返す"""
+    path = archive_volumes(path)[0]
+    listing = list_archive(path)
+    entry = next((e for e in listing["entries"] if e["name"] == name and not e["is_dir"]), None)
+    if entry is None:
+        raise FileNotFoundError("Entry not found")
+
+    def read_all(f, remaining=None):
+        while remaining is None or remaining > 0:
+            data = f.read(RANGE_CHUNK_SIZE if remaining is None else min(RANGE_CHUNK_SIZE, remaining))
+            if not data:
+                return
+            if remaining is not None:
+                remaining -= len(data)
+            yield data
+
+    def generate():
+        kind = listing["kind"]
+        if kind == 'zip':
+            with zipfile.ZipFile(path) as zf:
+                member = next(m for m in zf.infolist() if zip_member_name(m).rstrip('/') == name)
+                with zf.open(member) as f:
+                    yield from read_all(f)
+        elif kind == 'tar' and entry["offset"] is not None:
+            with open(path, 'rb') as f:
+                f.seek(entry["offset"])
+                yield from read_all(f, entry["size"])
+        elif kind == 'tar':
+            with tarfile.open(path) as tar:
+                member = next(m for m in tar if m.name.rstrip('/') == name)
+                yield from read_all(tar.extractfile(member))
+        else:
+            if kind == 'rar':
+                cmd = ['unrar', 'p', '-inul', '--', path, name]
+            else:
+                cmd = ['7z', 'e', '-so', '-spd', '--', path, name]
+            proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            try:
+                yield from read_all(proc.stdout)
+            finally:
+                proc.kill()
+                proc.wait()
+
+    return entry, generate()
+
+# --- 分割アップロード ---
+# ファイルをチャンクに分けて送ってもらい、あらかじめ確保した .part の該当位置に書き込む。
+# 受信済みのチャンクは .json に記録するので、接続が切れても残りだけを送れば再開できる。
+uploads_lock = FileLock(os.path.join(UPLOAD_STATE_DIR, '.lock'))  # 同じアップロードのチャンクが別のワーカーに届いても良いように
+
+def upload_paths(upload_id):
+    if not upload_id or not all(c in '0123456789abcdef' for c in upload_id):
+        raise ValueError("Invalid upload id")
+    base = os.path.join(UPLOAD_STATE_DIR, upload_id)
+    return base + '.part', base + '.json'
+
+def load_upload(upload_id):
+    _, meta_path = upload_paths(upload_id)
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise FileNotFoundError("Upload not found")
+
+def save_upload(upload):
+    _, meta_path = upload_paths(upload["id"])
+    upload["updated"] = time.time()
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(upload, f)
+    os.replace(tmp_path, meta_path)
+
+def remove_upload(upload_id):
+    for path in upload_paths(upload_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def upload_chunk_count(upload):
+    return max(1, -(-upload["size"] // upload["chunk_size"]))
+
+def upload_to_dict(upload):
+    return {
+        "upload_id": upload["id"],
+        "name": upload["name"],
+        "size": upload["size"],
+        "chunk_size": upload["chunk_size"],
+        "chunks": upload_chunk_count(upload),
+        "received": upload["received"],
+    }
+
+def cleanup_uploads():
+    """長い間 続きが送られてこないアップロードを消す"""
+    now = time.time()
+    for entry in os.scandir(UPLOAD_STATE_DIR):
+        if entry.name.endswith('.json'):
+            upload_id = entry.name[:-5]
+            try:
+                if now - load_upload(upload_id)["updated"] > UPLOAD_EXPIRE:
+                    remove_upload(upload_id)
+            except Exception:
+                pass
+
+def find_upload(fingerprint):
+    """同じファイルの受信途中のアップロードを探す (再開用)"""
+    for entry in os.scandir(UPLOAD_STATE_DIR):
+        if entry.name.endswith('.json'):
+            try:
+                upload = load_upload(entry.name[:-5])
+            except Exception:
+                continue
+            if upload.get("fingerprint") == fingerprint:
+                return upload
+    return None
+
+def upload_target(name, target_path):
+    """アップロードするファイルの名前と保存先のフォルダ"""
+    name = os.path.basename(name.replace('\\', '/'))
+    if not name or name in ('.', '..'):
+        raise ValueError("Invalid file name")
+    save_dir = safe_join(DOWNLOAD_DIR, target_path)
+    if not os.path.isdir(save_dir):
+        raise FileNotFoundError("Folder not found")
+    return name, save_dir
+
+def place_duplicate(existing, dst, sha256, dedup):
+    """同じ内容の既存ファイルを使う (skip: 既存ファイルのパス, link: ハードリンクにしたパスを返す)"""
+    if dedup == 'link' and os.path.abspath(existing) != os.path.abspath(dst):
+        link_file(existing, dst)
+        hash_index.record(dst, sha256)
+        notify_change(os.path.dirname(dst))
+        return dst
+    return existing
+
+def find_duplicate_upload(name, target_path, sha256, dedup):
+    """SHA-256 が分かっていて同じ内容のファイルが既にあれば、送ってもらわずに済ませる (無ければ None)"""
+    if dedup == 'off' or not sha256:
+        return None
+    name, save_dir = upload_target(name, target_path)
+    existing = hash_index.lookup(sha256.lower())
+    if not existing:
+        return None
+    dst = os.path.join(save_dir, name)
+    if any(os.path.abspath(p) == os.path.abspath(dst) for p in existing):
+        return dst
+    return place_duplicate(existing[0], dst, sha256.lower(), dedup)
+
+def create_upload(name, size, target_path, chunk_size=None, fingerprint=None, dedup='off'):
+    name, save_dir = upload_target(name, target_path)
+    if size < 0:
+        raise ValueError("Invalid size")
+    chunk_size = min(max(chunk_size or UPLOAD_CHUNK_SIZE, UPLOAD_MIN_CHUNK), UPLOAD_MAX_CHUNK)
+
+    with uploads_lock:
+        cleanup_uploads()
+        if fingerprint:
+            upload = find_upload(fingerprint)
+            if (upload and upload["name"] == name and upload["size"] == size
+                    and upload["target_path"] == target_path):
+                return upload
+
+        upload = {
+            "id": uuid.uuid4().hex,
+            "name": name,
+            "size": size,
+            "target_path": target_path,
+            "chunk_size": chunk_size,
+            "fingerprint": fingerprint,
+            "dedup": dedup,
+            "received": [],
+            "created": time.time(),
+        }
+        part_path, _ = upload_paths(upload["id"])
+        # 先にファイル全体の領域を確保しておき、各チャンクは自分の位置に書き込む
+        with open(part_path, 'wb') as f:
+            if size and hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, size)
+                except OSError:
+                    f.truncate(size)
+            else:
+                f.truncate(size)
+        save_upload(upload)
+    return upload
+
+def write_chunk(upload_id, index, stream, length, expected_hash=None):
+    """チャンクを .part の該当位置に書き込む。expected_hash (SHA-256) が合わなければ受け付けない"""
+    upload = load_upload(upload_id)
+    chunks = upload_chunk_count(upload)
+    if not 0 <= index < chunks:
+        raise ValueError("Invalid chunk index")
+    offset = index * upload["chunk_size"]
+    expected_length = min(upload["chunk_size"], upload["size"] - offset)
+    if length is not None and length != expected_length:
+        raise ValueError(f"Chunk size mismatch: expected {expected_length} bytes")
+
+    part_path, _ = upload_paths(upload_id)
+    digest = hashlib.sha256()
+    written = 0
+    fd = os.open(part_path, os.O_WRONLY)
+    try:
+        while written < expected_length:
+            data = stream.read(min(UPLOAD_WRITE_SIZE, expected_length - written))
+            if not data:
+                break
+            digest.update(data)
+            os.pwrite(fd, data, offset + written)
+            written += len(data)
+    finally:
+        os.close(fd)
+    if written != expected_length:
+        raise ValueError(f"Incomplete chunk: received {written} of {expected_length} bytes")
+    if expected_hash and digest.hexdigest() != expected_hash.lower():
+        raise ValueError("Checksum mismatch")
+
+    with uploads_lock:
+        upload = load_upload(upload_id)
+        if index not in upload["received"]:
+            upload["received"].append(index)
+            upload["received"].sort()
+            save_upload(upload)
+    return upload
+
+def complete_upload(upload_id):
+    """全てのチャンクが揃っていれば、保存先のフォルダへ移す
+
+    (保存したパス, 同じ内容の既存ファイル) を返す。重複を調べる設定なら、移す前に
+    ハッシュを計算し、既存ファイルがあれば保存しない・ハードリンクにする。
+    """
+    def check(upload):
+        missing = [i for i in range(upload_chunk_count(upload)) if i not in set(upload["received"])]
+        if missing:
+            raise ValueError(f"{len(missing)} chunks are missing")
+
+    upload = load_upload(upload_id)
+    check(upload)
+    part_path, _ = upload_paths(upload_id)
+    sha256 = existing = None
+    if upload.get("dedup", "off") != 'off':
+        # 大きいファイルは時間がかかるので、ロックの外で計算する
+        sha256 = file_sha256(part_path)
+        found = hash_index.lookup(sha256)
+        existing = found[0] if found else None
+
+    with uploads_lock:
+        upload = load_upload(upload_id)
+        check(upload)
+        save_dir = safe_join(DOWNLOAD_DIR, upload["target_path"])
+        dst = os.path.join(save_dir, upload["name"])
+        if existing:
+            dst = place_duplicate(existing, dst, sha256, upload["dedup"])
+        else:
+            shutil.move(part_path, dst)
+            if sha256:
+                hash_index.record(dst, sha256)
+        remove_upload(upload_id)
+    notify_change(save_dir)
+    return dst, existing
+
+# --- downloader.py のジョブ ---
+DOWNLOAD_HISTORY = 10  # 表示する終了済みのダウンロードの件数
+
+def get_downloads():
+    """downloader.py の実行中のジョブと最近終わったジョブ、全体の速度"""
+    try:
+        records = download_registry.jobs()
+    except Exception as e:
+        print(f"Error reading download registry: {e}")
+        records = []
+    active = [j for j in records if j["state"] in ('queued', 'running', 'retrying')]
+    recent = [j for j in records if j not in active][:DOWNLOAD_HISTORY]
+    for j in active + recent:
+        j["percent"] = round(j["done"] / j["total"] * 100, 1) if j["total"] else None
+        j["size_text"] = get_size_format(j["total"]) if j["total"] else "-"
+        j["done_text"] = get_size_format(j["done"])
+        j["rate_text"] = get_size_format(j["rate"]) + "/s"
+        j["eta_text"] = time.strftime('%H:%M:%S', time.gmtime(j["eta"])) if j["eta"] and j["eta"] < 86400 * 100 else None
+    rate = sum(j["rate"] for j in active)
+    return {
+        "jobs": active + recent,
+        "active": len(active),
+        "rate": rate,
+        "rate_text": get_size_format(rate) + "/s",
+    }
+
 def get_disk_usage():
     total, used, free = shutil.disk_usage(DOWNLOAD_DIR)
     percent = (used / total) * 100
@@ -76,6 +1391,133 @@ def get_disk_usage():
         "percent": round(percent, 1)
     }
 
+# --- イベント (Server-Sent Events) ---
+# フォルダの変更 (索引の変更通知から)、ディスク容量、ジョブの進捗をブラウザへ送る。
+subscribers = set()  # 接続中のブラウザごとの送信待ちキュー
+subscribers_lock = threading.Lock()
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def publish(event, data):
+    message = format_event(event, data)
+    with subscribers_lock:
+        for q in list(subscribers):
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                subscribers.discard(q)
+
+def on_dir_changed(root, rel):
+    """索引がフォルダの変更を見つけたとき (索引スレッドから呼ばれる)"""
+    if not file_index.ready:
+        return  # 最初の走査中は全てのフォルダが「変更」になるので送らない
+    shared.publish("dir", {"root": root, "path": rel})
+
+def forward_events(last_id):
+    """共有されたイベントを受け取り、このプロセスのキャッシュと接続中のブラウザに反映する"""
+    for event_id, event, data in shared.events_since(last_id):
+        last_id = event_id
+        if event == "index":
+            if is_indexer:
+                file_index.mark_dirty(data["path"], data["recursive"])
+        elif event == "dir":
+            base = ROOTS[data["root"]]
+            invalidate_listing(os.path.join(base, data["path"]) if data["path"] else base)
+            publish("dir", data)
+    return last_id
+
+def event_pump():
+    """ジョブの状態とイベントをワーカー間で共有し、ジョブの進捗とディスク容量が変わっていれば送る"""
+    sent_jobs = {}
+    last_disk, last_disk_check = None, 0
+    last_downloads = None
+    last_event = shared.last_event_id()
+    last_indexer_check = last_thumb_scan = last_metrics_share = time.monotonic()
+    flagged = set()
+    while True:
+        time.sleep(EVENT_INTERVAL)
+        try:
+            share_jobs()
+            apply_cancel_requests()
+            last_event = forward_events(last_event)
+
+            now = time.monotonic()
+            if now - last_indexer_check >= INDEXER_RETRY:
+                last_indexer_check = now
+                try_become_indexer()
+            if is_indexer:
+                for name, ready in (("index_ready", file_index.ready), ("hash_ready", hash_index.ready)):
+                    if ready and name not in flagged:
+                        shared.set_flag(name, 1)
+                        flagged.add(name)
+            if now - last_thumb_scan >= THUMB_RESCAN_INTERVAL:
+                last_thumb_scan = now
+                load_thumb_cache()
+            if WORKER_COUNT > 1 and now - last_metrics_share >= METRICS_SHARE_INTERVAL:
+                last_metrics_share = now
+                shared.save_metrics(request_metrics.snapshot())
+
+            if not subscribers:
+                continue
+            current = shared.jobs()
+            for data in current:
+                key = (data["state"], data["done_bytes"], data["done_entries"], data["cancel_requested"])
+                if sent_jobs.get(data["id"]) != key:
+                    sent_jobs[data["id"]] = key
+                    publish("job", data)
+            for job_id in set(sent_jobs) - {data["id"] for data in current}:
+                del sent_jobs[job_id]
+
+            downloads = get_downloads()
+            if downloads != last_downloads:
+                last_downloads = downloads
+                publish("downloads", downloads)
+
+            if now - last_disk_check >= DISK_EVENT_INTERVAL:
+                last_disk_check = now
+                disk = get_disk_usage()
+                if disk != last_disk:
+                    last_disk = disk
+                    publish("disk", disk)
+        except Exception as e:
+            # ここで止まると SSE・ジョブの共有・中止の転送・索引の引き継ぎが全て止まるので、記録して続ける
+            print(f"Error in event pump: {e}")
+
+def event_stream():
+    q = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+    with subscribers_lock:
+        subscribers.add(q)
+    try:
+        # 接続 (再接続) したときは現在の状態を送る
+        yield "retry: 3000\n\n"
+        yield format_event("disk", get_disk_usage())
+        yield format_event("jobs", shared.jobs())
+        yield format_event("downloads", get_downloads())
+        while True:
+            try:
+                message = q.get(timeout=EVENT_KEEPALIVE)
+            except queue.Empty:
+                message = ": keepalive\n\n"
+            if q not in subscribers:
+                return  # 読むのが遅すぎて切られた
+            yield message
+    finally:
+        with subscribers_lock:
+            subscribers.discard(q)
+
+def on_hashes_changed(rel):
+    """downloads のフォルダのハッシュを計算し終えたとき (重複の表示が変わるかもしれない)"""
+    shared.publish("dir", {"root": "downloads", "path": rel})
+
+load_thumb_cache()
+file_index.listeners.append(on_dir_changed)
+# 変更されたフォルダのファイルだけハッシュを計算し直す
+file_index.listeners.append(lambda root, rel: hash_index.mark_dirty(rel) if root == "downloads" else None)
+hash_index.listeners.append(on_hashes_changed)
+try_become_indexer()
+threading.Thread(target=event_pump, name="event-pump", daemon=True).start()
+
 # --- HTML Template ---
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -93,6 +1535,12 @@ HTML_TEMPLATE = """
         .table-hover tbody tr:hover { background-color: #2c2c2c; }
         .folder-link:hover { text-decoration: underline; color: #fff; cursor: pointer; }
         .breadcrumb-item a { text-decoration: none; color: #0d6efd; }
+        #fileScroll { max-height: 70vh; overflow-y: auto; }
+        #fileScroll thead th { position: sticky; top: 0; z-index: 1; }
+        #fileListBody tr.vrow { height: 42px; }
+        #fileListBody tr.vrow td { white-space: nowrap; overflow: hidden; text-overflow: ellipsis; max-width: 0; }
+        #goUpRow:hover { background-color: #2c2c2c; }
+        img.thumb { width: 32px; height: 32px; object-fit: cover; border-radius: 3px; vertical-align: middle; }
     </style>
 </head>
 <body>
@@ -101,7 +1549,7 @@ HTML_TEMPLATE = """
     <!-- Header -->
     <div class="d-flex justify-content-between align-items-center mb-4">
         <h3 class="m-0"><i class="fa-solid fa-server text-primary"></i> File Manager</h3>
-        <div class="text-end small text-muted">
+        <div class="text-end small text-muted" onclick="showUsage()" style="cursor:pointer;" title="フォルダごとの使用量">
             <span id="diskText">Loading...</span>
             <div class="progress mt-1" style="width: 150px; height: 6px;">
                 <div id="diskBar" class="progress-bar bg-success" role="progressbar" style="width: 0%"></div>
@@ -109,6 +1557,22 @@ HTML_TEMPLATE = """
         </div>
     </div>
 
+    <!-- Usage -->
+    <div class="card mb-4 d-none" id="usageCard">
+        <div class="card-header bg-dark d-flex justify-content-between align-items-center">
+            <span id="usageTitle" class="small"></span>
+            <div>
+                <button class="btn btn-sm btn-outline-secondary me-2" onclick="showDuplicates()" title="同じ内容のファイル"><i class="fa-solid fa-clone"></i> 重複</button>
+                <button class="btn-close btn-close-white" onclick="document.getElementById('usageCard').classList.add('d-none')"></button>
+            </div>
+        </div>
+        <div class="card-body p-0" style="max-height: 50vh; overflow-y: auto;">
+            <table class="table table-hover table-sm align-middle mb-0">
+                <tbody id="usageBody"></tbody>
+            </table>
+        </div>
+    </div>
+
     <!-- Upload -->
     <div class="card mb-4">
         <div class="card-body">
@@ -125,30 +1589,95 @@ HTML_TEMPLATE = """
         </div>
     </div>
 
+    <!-- Downloads (downloader.py) -->
+    <div class="card mb-4 d-none" id="downloadsCard">
+        <div class="card-body">
+            <h5 class="card-title mb-3 d-flex justify-content-between">
+                <span><i class="fa-solid fa-cloud-arrow-down"></i> Downloads</span>
+                <span class="small text-muted" id="downloadsRate"></span>
+            </h5>
+            <div id="downloadList"></div>
+        </div>
+    </div>
+
+    <!-- Jobs -->
+    <div class="card mb-4 d-none" id="jobsCard">
+        <div class="card-body">
+            <h5 class="card-title mb-3"><i class="fa-solid fa-gears"></i> Jobs</h5>
+            <div id="jobList"></div>
+        </div>
+    </div>
+
+    <!-- Search -->
+    <div class="input-group input-group-sm mb-3">
+        <span class="input-group-text bg-dark text-light border-secondary"><i class="fa-solid fa-magnifying-glass"></i></span>
+        <input type="search" id="searchInput" class="form-control bg-dark text-light border-secondary" placeholder="全体から検索 (名前の一部, または .mp4 のような拡張子)" onkeydown="if (event.key === 'Enter') runSearch()">
+        <button class="btn btn-outline-secondary" onclick="runSearch()">検索</button>
+    </div>
+    <div class="card mb-4 d-none" id="searchCard">
+        <div class="card-header bg-dark d-flex justify-content-between align-items-center">
+            <span id="searchTitle" class="small"></span>
+            <button class="btn-close btn-close-white" onclick="closeSearch()"></button>
+        </div>
+        <div class="card-body p-0" style="max-height: 50vh; overflow-y: auto;">
+            <table class="table table-hover table-sm align-middle mb-0">
+                <tbody id="searchBody"></tbody>
+            </table>
+        </div>
+    </div>
+
+    <!-- Archive -->
+    <div class="card mb-4 d-none" id="archiveCard">
+        <div class="card-header bg-dark d-flex justify-content-between align-items-center gap-2">
+            <span id="archiveTitle" class="small text-truncate"></span>
+            <div class="d-flex gap-2 align-items-center">
+                <button class="btn btn-sm btn-warning text-dark fw-bold text-nowrap" onclick="extractSelected()"><i class="fa-solid fa-box-open"></i> 選択を解凍</button>
+                <button class="btn-close btn-close-white" onclick="closeArchive()"></button>
+            </div>
+        </div>
+        <div class="card-body p-0" style="max-height: 50vh; overflow-y: auto;">
+            <table class="table table-hover table-sm align-middle mb-0">
+                <tbody id="archiveBody"></tbody>
+            </table>
+        </div>
+    </div>
+
     <!-- Browser -->
     <div class="card">
         <div class="card-header bg-dark border-bottom border-secondary">
             <div class="d-flex justify-content-between align-items-center mb-2">
                 <ul class="nav nav-pills card-header-pills">
-                    <li class="nav-item"><a class="nav-link active" href="#" onclick="switchRoot('downloads', this)">Downloads</a></li>
-                    <li class="nav-item"><a class="nav-link" href="#" onclick="switchRoot('extracted', this)">Extracted</a></li>
+                    <li class="nav-item"><a class="nav-link active" href="#" data-root="downloads" onclick="switchRoot('downloads', this)">Downloads</a></li>
+                    <li class="nav-item"><a class="nav-link" href="#" data-root="extracted" onclick="switchRoot('extracted', this)">Extracted</a></li>
                 </ul>
                 <button class="btn btn-sm btn-outline-secondary" onclick="loadFiles()">🔄 Refresh</button>
             </div>
             <nav aria-label="breadcrumb">
-                <ol class="breadcrumb mb-0" id="breadcrumbList"></ol>
+                <ol class="breadcrumb mb-2" id="breadcrumbList"></ol>
             </nav>
+            <div class="d-flex gap-2 align-items-center">
+                <input type="search" id="filterInput" class="form-control form-control-sm bg-dark text-light border-secondary" placeholder="名前で絞り込み" oninput="onFilterInput()">
+                <select id="sortSelect" class="form-select form-select-sm bg-dark text-light border-secondary w-auto" onchange="resetAndLoad()">
+                    <option value="mtime">日付</option>
+                    <option value="name">名前</option>
+                    <option value="size">サイズ</option>
+                </select>
+                <button id="orderButton" class="btn btn-sm btn-outline-secondary" onclick="toggleOrder()" title="並び順">↓</button>
+                <button id="batchButton" class="btn btn-sm btn-warning text-dark fw-bold text-nowrap d-none" onclick="extractBatch()"><i class="fa-solid fa-box-open"></i> 選択を一括解凍</button>
+                <span id="fileCount" class="small text-muted text-nowrap"></span>
+            </div>
         </div>
         
         <div class="card-body p-0">
-            <div class="table-responsive">
-                <table class="table table-hover align-middle mb-0">
+            <div id="goUpRow" class="px-2 py-2 border-bottom border-secondary d-none" onclick="goUp()" style="cursor:pointer;"><i class="fa-solid fa-level-up-alt"></i> .. (Go Up)</div>
+            <div class="table-responsive" id="fileScroll">
+                <table class="table table-hover align-middle mb-0" style="table-layout: fixed;">
                     <thead class="table-dark">
                         <tr>
-                            <th style="width: 50%">Name</th>
-                            <th style="width: 15%">Size</th>
-                            <th style="width: 20%">Date</th>
-                            <th style="width: 15%" class="text-end">Actions</th>
+                            <th style="width: 45%">Name</th>
+                            <th style="width: 12%">Size</th>
+                            <th style="width: 18%">Date</th>
+                            <th style="width: 25%" class="text-end">Actions</th>
                         </tr>
                     </thead>
                     <tbody id="fileListBody"></tbody>
@@ -172,20 +1701,104 @@ HTML_TEMPLATE = """
 <script>
     let currentRoot = 'downloads';
     let currentPath = '';
+    let sortOrder = 'desc';
+    let filterTimer = null;
+
+    // --- 仮想スクロール: 見えている範囲の行だけを描画し、ページ単位で取得する ---
+    const PAGE_SIZE = 200;
+    const ROW_HEIGHT = 42;
+    const OVERSCAN = 20;
+    let listing = {token: 0, total: 0, rows: [], pages: {}};
+    let renderQueued = false;
+    let dirTimer = null;
+    let jobsById = {};
+    const jobStates = {};
+    const selectedArchives = new Set();  // 一括解凍するファイル (Downloads内のパス)
 
-    document.addEventListener('DOMContentLoaded', () => { loadFiles(); updateDisk(); });
+    // サムネイル: スクロールが止まってから、見えている行の分だけ少しずつ読み込む
+    const THUMB_DELAY = 200;
+    const THUMB_CONCURRENCY = 3;  // 他のAPIの接続を塞がないように
+    const thumbLoaded = new Set();
+    const thumbFailed = new Set();
+    let thumbTimer = null;
+    let thumbQueue = [];
+    let thumbActive = 0;
+
+    document.addEventListener('DOMContentLoaded', () => {
+        document.getElementById('fileScroll').addEventListener('scroll', scheduleRender);
+        window.addEventListener('resize', scheduleRender);
+        loadFiles(); updateDisk(); pollJobs();
+        connectEvents();
+    });
+
+    // --- サーバーからのイベント (フォルダの変更・ディスク容量・ジョブの進捗) ---
+    function connectEvents() {
+        if (!window.EventSource) return;
+        const events = new EventSource('/api/events');
+        events.addEventListener('disk', e => renderDisk(JSON.parse(e.data)));
+        events.addEventListener('jobs', e => {
+            jobsById = {};
+            JSON.parse(e.data).forEach(j => { jobsById[j.id] = j; });
+            renderJobs(sortedJobs());
+        });
+        events.addEventListener('job', e => {
+            const j = JSON.parse(e.data);
+            jobsById[j.id] = j;
+            renderJobs(sortedJobs());
+        });
+        events.addEventListener('downloads', e => renderDownloads(JSON.parse(e.data)));
+        events.addEventListener('dir', e => {
+            const d = JSON.parse(e.data);
+            // 表示中のフォルダか、その中のフォルダ (合計サイズが変わる) が変わったら読み直す
+            if (d.root !== currentRoot) return;
+            if (currentPath && d.path !== currentPath && !d.path.startsWith(currentPath + '/')) return;
+            clearTimeout(dirTimer);
+            dirTimer = setTimeout(loadFiles, 500);
+        });
+    }
+
+    function sortedJobs() {
+        return Object.values(jobsById).sort((a, b) => b.created - a.created);
+    }
 
     function switchRoot(root, el) {
         currentRoot = root;
         currentPath = '';
         document.querySelectorAll('.nav-link').forEach(e => e.classList.remove('active'));
         el.classList.add('active');
-        loadFiles();
+        resetAndLoad();
     }
 
     function navigate(path) {
         currentPath = path;
-        loadFiles();
+        resetAndLoad();
+    }
+
+    function toggleArchive(path, checked) {
+        if (checked) selectedArchives.add(path);
+        else selectedArchives.delete(path);
+        document.getElementById('batchButton').classList.toggle('d-none', selectedArchives.size === 0);
+    }
+
+    function extractBatch() {
+        fetch('/api/extract/batch', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({paths: Array.from(selectedArchives)}),
+        })
+            .then(r => r.json())
+            .then(d => {
+                if (d.status !== 'ok') { showToast("❌ 解凍エラー: " + d.message, "bg-danger"); return; }
+                d.jobs.forEach(j => { jobStates[j.job_id] = 'queued'; });
+                let msg = `${d.jobs.length} 件の解凍を開始しました...`;
+                if (d.skipped.length) msg += ` (同じ分割アーカイブの ${d.skipped.length} 件はまとめて解凍)`;
+                showToast(msg, "bg-info");
+                d.errors.forEach(e => showToast(`❌ ${e.path}: ${e.message}`, "bg-danger"));
+                selectedArchives.clear();
+                document.getElementById('batchButton').classList.add('d-none');
+                renderFiles();
+                pollJobs();
+            });
     }
 
     function goUp() {
@@ -193,88 +1806,414 @@ HTML_TEMPLATE = """
         const parts = currentPath.split('/');
         parts.pop();
         currentPath = parts.join('/');
+        resetAndLoad();
+    }
+
+    function toggleOrder() {
+        sortOrder = sortOrder === 'desc' ? 'asc' : 'desc';
+        document.getElementById('orderButton').innerText = sortOrder === 'desc' ? '↓' : '↑';
+        resetAndLoad();
+    }
+
+    function onFilterInput() {
+        clearTimeout(filterTimer);
+        filterTimer = setTimeout(resetAndLoad, 300);
+    }
+
+    // 別のフォルダ・並び順に切り替えたときは先頭から表示
+    function resetAndLoad() {
+        document.getElementById('fileScroll').scrollTop = 0;
         loadFiles();
     }
 
+    // 一覧を取り直す (スクロール位置はそのまま)
     function loadFiles() {
-        fetch(`/api/list/${currentRoot}?path=${encodeURIComponent(currentPath)}`)
+        listing = {token: listing.token + 1, total: 0, rows: [], pages: {}};
+        document.getElementById('goUpRow').classList.toggle('d-none', !currentPath);
+        updateBreadcrumb();
+        fetchPage(firstVisibleRow() / PAGE_SIZE | 0);
+    }
+
+    function fetchPage(page) {
+        if (listing.pages[page]) return;
+        listing.pages[page] = 'loading';
+        const token = listing.token;
+        const params = new URLSearchParams({
+            path: currentPath,
+            offset: page * PAGE_SIZE,
+            limit: PAGE_SIZE,
+            sort: document.getElementById('sortSelect').value,
+            order: sortOrder,
+            q: document.getElementById('filterInput').value.trim(),
+        });
+        fetch(`/api/list/${currentRoot}?${params}`)
             .then(r => r.json())
             .then(data => {
-                renderFiles(data.files);
-                updateBreadcrumb();
+                if (token !== listing.token) return;  // 古いリクエストの結果は捨てる
+                listing.pages[page] = 'done';
+                listing.total = data.total || 0;
+                (data.files || []).forEach((f, i) => { listing.rows[data.offset + i] = f; });
+                document.getElementById('fileCount').innerText = `${listing.total} 件`;
+                renderFiles();
             });
     }
 
-    function renderFiles(files) {
+    function firstVisibleRow() {
+        const scroll = document.getElementById('fileScroll');
+        return Math.max(0, Math.floor(scroll.scrollTop / ROW_HEIGHT) - OVERSCAN);
+    }
+
+    function scheduleRender() {
+        if (renderQueued) return;
+        renderQueued = true;
+        requestAnimationFrame(() => { renderQueued = false; renderFiles(); });
+    }
+
+    function renderFiles() {
         const tbody = document.getElementById('fileListBody');
-        tbody.innerHTML = '';
+        const scroll = document.getElementById('fileScroll');
 
-        if (currentPath) {
-            tbody.innerHTML += `<tr class="bg-dark" onclick="goUp()" style="cursor:pointer;"><td colspan="4"><i class="fa-solid fa-level-up-alt"></i> .. (Go Up)</td></tr>`;
+        if (listing.total === 0) {
+            const loading = Object.values(listing.pages).includes('loading');
+            tbody.innerHTML = `<tr><td colspan="4" class="text-center text-muted">${loading ? 'Loading...' : 'No files found.'}</td></tr>`;
+            return;
         }
 
-        if (!files || files.length === 0) {
-            tbody.innerHTML += '<tr><td colspan="4" class="text-center text-muted">No files found.</td></tr>';
-            return;
+        const first = firstVisibleRow();
+        const last = Math.min(listing.total, first + Math.ceil(scroll.clientHeight / ROW_HEIGHT) + OVERSCAN * 2);
+        for (let p = first / PAGE_SIZE | 0; p <= (last - 1) / PAGE_SIZE; p++) fetchPage(p);
+
+        let html = `<tr style="height: ${first * ROW_HEIGHT}px"></tr>`;
+        for (let i = first; i < last; i++) {
+            const f = listing.rows[i];
+            html += f ? fileRowHtml(f) : '<tr class="vrow"><td colspan="4" class="text-muted">...</td></tr>';
         }
+        html += `<tr style="height: ${(listing.total - last) * ROW_HEIGHT}px"></tr>`;
+        tbody.innerHTML = html;
+        clearTimeout(thumbTimer);
+        thumbTimer = setTimeout(loadVisibleThumbs, THUMB_DELAY);
+    }
 
-        files.forEach(f => {
-            let actions = '';
-            let nameHtml = '';
-
-            if (f.type === 'dir') {
-                nameHtml = `<span class="folder-link fw-bold text-info" onclick="navigate('${f.path}')">${f.icon} ${f.name}</span>`;
-                // フォルダZIPダウンロード
-                actions += `<a href="/api/zip/${currentRoot}?path=${encodeURIComponent(f.path)}" class="btn btn-sm btn-outline-info me-1" title="Download ZIP"><i class="fa-solid fa-file-zipper"></i> ZIP</a>`;
-                actions += `<button class="btn btn-sm btn-outline-danger" onclick="deleteItem('${f.path}')"><i class="fa-solid fa-trash"></i></button>`;
-            } else {
-                nameHtml = `<span>${f.icon} ${f.name}</span>`;
-                
-                // ★ 解凍ボタン (Archiveのみ表示) ★
-                if (f.is_archive && currentRoot === 'downloads') {
-                    actions += `<button class="btn btn-sm btn-warning text-dark fw-bold me-2" onclick="extractItem('${f.path}')"><i class="fa-solid fa-box-open"></i> 解凍</button>`;
-                }
+    function thumbHtml(f) {
+        if (!f.has_thumb) return f.icon;
+        const url = `/api/thumb/${currentRoot}?path=${encodeURIComponent(f.path)}&v=${f.raw_mtime}-${f.raw_size}`;
+        if (thumbFailed.has(url)) return f.icon;
+        if (thumbLoaded.has(url)) return `<img class="thumb" src="${url}" alt="">`;
+        return `<img class="thumb d-none" data-src="${url}" alt=""><span>${f.icon}</span>`;
+    }
+
+    function loadVisibleThumbs() {
+        const view = document.getElementById('fileScroll').getBoundingClientRect();
+        thumbQueue = Array.from(document.querySelectorAll('#fileListBody img[data-src]')).filter(img => {
+            const r = img.getBoundingClientRect();
+            return r.bottom >= view.top && r.top <= view.bottom;
+        });
+        for (let i = thumbActive; i < THUMB_CONCURRENCY; i++) nextThumb();
+    }
+
+    function nextThumb() {
+        const img = thumbQueue.shift();
+        if (!img) return;
+        if (!img.isConnected) { nextThumb(); return; }  // 描画し直されて消えた行
+        const url = img.dataset.src;
+        img.removeAttribute('data-src');
+        thumbActive++;
+        img.onload = () => {
+            thumbLoaded.add(url);
+            img.classList.remove('d-none');
+            if (img.nextElementSibling) img.nextElementSibling.remove();
+            thumbActive--; nextThumb();
+        };
+        img.onerror = () => { thumbFailed.add(url); thumbActive--; nextThumb(); };
+        img.src = url;
+    }
+
+    function fileRowHtml(f) {
+        let actions = '';
+        let nameHtml = '';
 
-                // ダウンロードボタン
-                actions += `<a href="/api/download/${currentRoot}?path=${encodeURIComponent(f.path)}" class="btn btn-sm btn-outline-primary me-1"><i class="fa-solid fa-download"></i> DL</a>`;
-                // 削除ボタン
-                actions += `<button class="btn btn-sm btn-outline-danger" onclick="deleteItem('${f.path}')"><i class="fa-solid fa-trash"></i></button>`;
+        if (f.type === 'dir') {
+            nameHtml = `<span class="folder-link fw-bold text-info" data-action="navigate" data-path="${escapeHtml(f.path)}">${f.icon} ${escapeHtml(f.name)}</span>`;
+            // フォルダZIPダウンロード
+            actions += `<a href="/api/zip/${currentRoot}?path=${encodeURIComponent(f.path)}" class="btn btn-sm btn-outline-info me-1" title="Download ZIP"><i class="fa-solid fa-file-zipper"></i> ZIP</a>`;
+            actions += `<button class="btn btn-sm btn-outline-danger" data-action="delete" data-path="${escapeHtml(f.path)}"><i class="fa-solid fa-trash"></i></button>`;
+        } else {
+            nameHtml = `<span>${thumbHtml(f)} ${escapeHtml(f.name)}</span>`;
+            if (f.duplicates) {
+                nameHtml += ` <span class="badge bg-secondary" style="cursor:pointer;" onclick="showDuplicates()" title="同じ内容のファイルが他に ${f.duplicates} 個あります">重複 ×${f.duplicates}</span>`;
+            }
+            if (f.is_archive && currentRoot === 'downloads') {
+                const checked = selectedArchives.has(f.path) ? 'checked' : '';
+                nameHtml = `<input type="checkbox" class="form-check-input me-2" ${checked} data-action="toggle-archive" data-path="${escapeHtml(f.path)}">` + nameHtml;
+            }
+            
+            // ★ 解凍ボタン (Archiveのみ表示) ★
+            if (f.is_archive && currentRoot === 'downloads') {
+                actions += `<button class="btn btn-sm btn-outline-warning me-1" data-action="open-archive" data-path="${escapeHtml(f.path)}" title="中身を見る"><i class="fa-solid fa-list"></i></button>`;
+                actions += `<button class="btn btn-sm btn-warning text-dark fw-bold me-2" data-action="extract" data-path="${escapeHtml(f.path)}"><i class="fa-solid fa-box-open"></i> 解凍</button>`;
             }
 
-            tbody.innerHTML += `
-                <tr>
-                    <td>${nameHtml}</td>
-                    <td class="small text-muted">${f.size}</td>
-                    <td class="small text-muted">${f.mtime}</td>
-                    <td class="text-end">${actions}</td>
-                </tr>
-            `;
-        });
+            // 再生・表示ボタン (動画・音声・画像)
+            if (f.is_media) {
+                actions += `<a href="/api/download/${currentRoot}?path=${encodeURIComponent(f.path)}&inline=1" target="_blank" class="btn btn-sm btn-outline-success me-1" title="ブラウザで開く"><i class="fa-solid fa-play"></i></a>`;
+            }
+
+            // ダウンロードボタン
+            actions += `<a href="/api/download/${currentRoot}?path=${encodeURIComponent(f.path)}" class="btn btn-sm btn-outline-primary me-1"><i class="fa-solid fa-download"></i> DL</a>`;
+            // 削除ボタン
+            actions += `<button class="btn btn-sm btn-outline-danger" data-action="delete" data-path="${escapeHtml(f.path)}"><i class="fa-solid fa-trash"></i></button>`;
+        }
+
+        return `
+            <tr class="vrow">
+                <td>${nameHtml}</td>
+                <td class="small text-muted">${f.size}</td>
+                <td class="small text-muted">${f.mtime}</td>
+                <td class="text-end">${actions}</td>
+            </tr>
+        `;
     }
 
     function updateBreadcrumb() {
         const ol = document.getElementById('breadcrumbList');
-        ol.innerHTML = `<li class="breadcrumb-item"><a href="#" onclick="navigate('')">Root</a></li>`;
+        ol.innerHTML = `<li class="breadcrumb-item"><a href="#" data-action="navigate" data-path="">Root</a></li>`;
         if (currentPath) {
             let acc = '';
             currentPath.split('/').forEach((p, i, arr) => {
                 acc += (acc ? '/' : '') + p;
-                if (i === arr.length - 1) ol.innerHTML += `<li class="breadcrumb-item active text-light">${p}</li>`;
-                else ol.innerHTML += `<li class="breadcrumb-item"><a href="#" onclick="navigate('${acc}')">${p}</a></li>`;
+                if (i === arr.length - 1) ol.innerHTML += `<li class="breadcrumb-item active text-light">${escapeHtml(p)}</li>`;
+                else ol.innerHTML += `<li class="breadcrumb-item"><a href="#" data-action="navigate" data-path="${escapeHtml(acc)}">${escapeHtml(p)}</a></li>`;
             });
         }
     }
 
+    // --- 全体検索 ---
+    function runSearch() {
+        const q = document.getElementById('searchInput').value.trim();
+        if (!q) { closeSearch(); return; }
+        // ".mp4" のように入力された場合は拡張子で検索
+        const params = (q.startsWith('.') && !q.includes(' ')) ? {ext: q, limit: 200} : {q, limit: 200};
+        fetch(`/api/search?${new URLSearchParams(params)}`)
+            .then(r => r.json())
+            .then(d => {
+                if (d.status !== 'ok') { showToast("❌ 検索エラー: " + d.message, "bg-danger"); return; }
+                document.getElementById('searchCard').classList.remove('d-none');
+                document.getElementById('searchTitle').innerText =
+                    `「${q}」の検索結果: ${d.results.length} 件` + (d.indexing ? ' (索引を作成中のため一部のみ)' : '');
+                document.getElementById('searchBody').innerHTML = d.results.map(r => {
+                    const icon = r.type === 'dir' ? '📁' : '📄';
+                    const parent = r.path.includes('/') ? r.path.slice(0, r.path.lastIndexOf('/')) : '';
+                    const dl = r.type === 'file'
+                        ? `<a href="/api/download/${r.root}?path=${encodeURIComponent(r.path)}" class="btn btn-sm btn-outline-primary"><i class="fa-solid fa-download"></i></a>` : '';
+                    return `
+                        <tr>
+                            <td>${icon} ${escapeHtml(r.name)}<div class="small text-muted">${escapeHtml(r.root)}/${escapeHtml(r.path)}</div></td>
+                            <td class="small text-muted">${r.size_text}</td>
+                            <td class="small text-muted">${r.mtime_text}</td>
+                            <td class="text-end text-nowrap">
+                                <button class="btn btn-sm btn-outline-secondary me-1" data-action="open-location" data-root="${escapeHtml(r.root)}" data-path="${escapeHtml(parent)}"><i class="fa-solid fa-folder-open"></i></button>${dl}
+                            </td>
+                        </tr>`;
+                }).join('') || '<tr><td class="text-center text-muted">見つかりませんでした。</td></tr>';
+            });
+    }
+
+    function closeSearch() {
+        document.getElementById('searchCard').classList.add('d-none');
+    }
+
+    function openLocation(root, path) {
+        currentRoot = root;
+        currentPath = path;
+        document.querySelectorAll('.nav-link').forEach(e => e.classList.toggle('active', e.dataset.root === root));
+        resetAndLoad();
+    }
+
+    // 名前・パスなど (ファイル名やアーカイブから来る、信用できない文字列) を HTML に埋め込むときは必ず通す
+    function escapeHtml(text) {
+        return String(text).replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'})[c]);
+    }
+
+    // 一覧のボタン・リンクは onclick に文字列でパスを埋め込まず、data-action / data-path に入れてここでまとめて受け取る
+    const clickActions = {
+        'navigate': el => navigate(el.dataset.path),
+        'delete': el => deleteItem(el.dataset.path),
+        'open-archive': el => openArchive(el.dataset.path),
+        'extract': el => extractItem(el.dataset.path),
+        'open-location': el => openLocation(el.dataset.root, el.dataset.path),
+        'cancel-job': el => cancelJob(el.dataset.id),
+    };
+    document.addEventListener('click', e => {
+        const el = e.target.closest('[data-action]');
+        if (!el || !clickActions[el.dataset.action]) return;
+        e.preventDefault();
+        clickActions[el.dataset.action](el);
+    });
+    document.addEventListener('change', e => {
+        if (e.target.dataset.action === 'toggle-archive') toggleArchive(e.target.dataset.path, e.target.checked);
+    });
+
+    // --- アーカイブの中身 (解凍せずに一覧・1ファイルだけ取り出し・選んだものだけ解凍) ---
+    let archivePath = null;
+
+    function openArchive(path) {
+        archivePath = path;
+        document.getElementById('archiveCard').classList.remove('d-none');
+        document.getElementById('archiveTitle').innerText = `📦 ${path} (読み込み中...)`;
+        document.getElementById('archiveBody').innerHTML = '';
+        fetch(`/api/archive/${currentRoot}?${new URLSearchParams({path, limit: 1000})}`)
+            .then(r => r.json())
+            .then(d => {
+                if (archivePath !== path) return;
+                if (d.status !== 'ok') { closeArchive(); showToast("❌ エラー: " + d.message, "bg-danger"); return; }
+                document.getElementById('archiveTitle').innerText =
+                    `📦 ${path}: ${d.total} 件` + (d.total > d.entries.length ? ` (先頭 ${d.entries.length} 件を表示)` : '');
+                document.getElementById('archiveBody').innerHTML = d.entries.map(e => {
+                    const url = `/api/archive/${currentRoot}/entry?${new URLSearchParams({path, name: e.name})}`;
+                    const dl = e.type === 'file'
+                        ? `<a href="${escapeHtml(url)}" class="btn btn-sm btn-outline-primary"><i class="fa-solid fa-download"></i></a>` : '';
+                    return `
+                        <tr>
+                            <td style="width: 2em"><input type="checkbox" class="form-check-input archive-check" data-name="${encodeURIComponent(e.name)}"></td>
+                            <td class="text-break">${e.type === 'dir' ? '📁' : '📄'} ${escapeHtml(e.name)}</td>
+                            <td class="small text-muted text-nowrap">${escapeHtml(e.size_text)}</td>
+                            <td class="small text-muted text-nowrap">${escapeHtml(e.mtime)}</td>
+                            <td class="text-end">${dl}</td>
+                        </tr>`;
+                }).join('') || '<tr><td class="text-center text-muted">空のアーカイブです。</td></tr>';
+            });
+    }
+
+    function closeArchive() {
+        archivePath = null;
+        document.getElementById('archiveCard').classList.add('d-none');
+    }
+
+    function extractSelected() {
+        const names = Array.from(document.querySelectorAll('.archive-check:checked'), el => decodeURIComponent(el.dataset.name));
+        if (!names.length) { showToast("解凍するファイルを選んでください", "bg-secondary"); return; }
+        fetch(`/api/archive/${currentRoot}/extract?path=${encodeURIComponent(archivePath)}`, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({names}),
+        })
+            .then(r => r.json())
+            .then(d => {
+                if (d.status === 'ok') {
+                    showToast(`${names.length} 件の解凍を開始しました...`, "bg-info");
+                    jobStates[d.job_id] = 'queued';
+                    pollJobs();
+                }
+                else showToast("❌ 解凍エラー: " + d.message, "bg-danger");
+            });
+    }
+
     function extractItem(path) {
-        showToast("解凍を開始しました...", "bg-info");
         fetch(`/api/extract?path=${encodeURIComponent(path)}`, {method: 'POST'})
             .then(r => r.json())
             .then(d => {
-                if(d.status === 'ok') showToast("✅ 解凍完了！ (Extractedタブを確認)", "bg-success");
+                if(d.status === 'ok') {
+                    showToast("解凍を開始しました...", "bg-info");
+                    jobStates[d.job_id] = 'queued';
+                    pollJobs();
+                }
                 else showToast("❌ 解凍エラー: " + d.message, "bg-danger");
             });
     }
 
+    // --- ジョブ (解凍) の進捗 ---
+    // 進捗はイベントで届くので、ここでは今の状態を1回だけ取得する
+    function pollJobs() {
+        fetch('/api/jobs')
+            .then(r => r.json())
+            .then(d => {
+                jobsById = {};
+                d.jobs.forEach(j => { jobsById[j.id] = j; });
+                renderJobs(sortedJobs());
+            });
+    }
+
+    function renderJobs(list) {
+        list.forEach(j => {
+            const prev = jobStates[j.id];
+            if (prev && prev !== j.state) {
+                if (j.state === 'done') {
+                    showToast(`✅ 解凍完了！ ${j.name} (Extractedタブを確認)`, "bg-success");
+                    if (currentRoot === 'extracted') loadFiles();
+                    updateDisk();
+                }
+                else if (j.state === 'error') showToast("❌ 解凍エラー: " + j.error, "bg-danger");
+            }
+            jobStates[j.id] = j.state;
+        });
+
+        // 実行中のジョブと、最近終わったジョブを表示
+        const active = list.filter(j => j.state === 'queued' || j.state === 'running');
+        const recent = list.filter(j => !active.includes(j)).slice(0, 5);
+        const shown = active.concat(recent);
+        document.getElementById('jobsCard').classList.toggle('d-none', shown.length === 0);
+
+        const badges = {queued: 'secondary', running: 'primary', done: 'success', error: 'danger', cancelled: 'warning'};
+        document.getElementById('jobList').innerHTML = shown.map(j => {
+            const running = j.state === 'queued' || j.state === 'running';
+            const width = j.percent !== null ? j.percent : (running ? 100 : 0);
+            const barCls = j.percent === null && running ? 'progress-bar-striped progress-bar-animated' : '';
+            let detail = `${j.done_entries}${j.total_entries !== null ? ' / ' + j.total_entries : ''} 件, ${formatSize(j.done_bytes)}`;
+            if (j.rate) detail += ` (${j.rate})`;
+            if (j.error) detail += ` - ${escapeHtml(j.error)}`;
+            const cancel = running && !j.cancel_requested
+                ? `<button class="btn btn-sm btn-outline-warning ms-2" data-action="cancel-job" data-id="${escapeHtml(j.id)}">中止</button>` : '';
+            return `
+                <div class="mb-2">
+                    <div class="d-flex justify-content-between align-items-center small">
+                        <span><span class="badge bg-${badges[j.state]} me-2">${j.state}</span>${escapeHtml(j.name)}</span>
+                        <span class="text-muted">${detail}${cancel}</span>
+                    </div>
+                    <div class="progress mt-1" style="height: 6px;">
+                        <div class="progress-bar ${barCls}" style="width: ${width}%"></div>
+                    </div>
+                </div>`;
+        }).join('');
+    }
+
+    // --- downloader.py のダウンロード ---
+    function renderDownloads(d) {
+        document.getElementById('downloadsCard').classList.toggle('d-none', d.jobs.length === 0);
+        document.getElementById('downloadsRate').innerText = d.active ? `${d.active} 件実行中 ↓${d.rate_text}` : '';
+        const badges = {queued: 'secondary', running: 'primary', retrying: 'warning', done: 'success', failed: 'danger', lost: 'dark'};
+        document.getElementById('downloadList').innerHTML = d.jobs.map(j => {
+            const running = j.state === 'running';
+            let detail = `${j.done_text} / ${j.size_text}`;
+            if (running) detail += ` ↓${j.rate_text}`;
+            if (running && j.kind === 'torrent') detail += `, Peers: ${j.peers}`;
+            if (running && j.eta_text) detail += `, 残り ${j.eta_text}`;
+            if (j.error && j.state !== 'done') detail += ` - ${escapeHtml(j.error)}`;
+            const barCls = j.percent === null && running ? 'progress-bar-striped progress-bar-animated' : '';
+            const width = j.percent !== null ? j.percent : (running ? 100 : 0);
+            return `
+                <div class="mb-2">
+                    <div class="d-flex justify-content-between align-items-center small">
+                        <span class="text-truncate"><span class="badge bg-${badges[j.state] || 'secondary'} me-2">${j.state}</span>${j.kind === 'torrent' ? '🧲' : '🔗'} ${escapeHtml(j.name)}</span>
+                        <span class="text-muted text-nowrap ms-2">${detail}</span>
+                    </div>
+                    <div class="progress mt-1" style="height: 6px;">
+                        <div class="progress-bar ${barCls}" style="width: ${width}%"></div>
+                    </div>
+                </div>`;
+        }).join('');
+    }
+
+    function cancelJob(id) {
+        fetch(`/api/jobs/${id}/cancel`, {method: 'POST'}).then(() => pollJobs());
+    }
+
+    function formatSize(b) {
+        const units = ['B', 'KB', 'MB', 'GB', 'TB'];
+        let i = 0;
+        while (b >= 1024 && i < units.length - 1) { b /= 1024; i++; }
+        return `${b.toFixed(2)}${units[i]}`;
+    }
+
     function deleteItem(path) {
         if(!confirm(`削除しますか？\n${path}`)) return;
         fetch(`/api/delete/${currentRoot}?path=${encodeURIComponent(path)}`, {method: 'POST'})
@@ -285,38 +2224,150 @@ HTML_TEMPLATE = """
             });
     }
 
-    function uploadFiles() {
+    // --- 分割アップロード: チャンクを並列に送り、失敗しても受信済みの続きから再開する ---
+    const UPLOAD_CONCURRENCY = 4;
+    const UPLOAD_RETRIES = 5;
+
+    async function uploadFiles() {
         const input = document.getElementById('fileInput');
         if (input.files.length === 0) return;
-        
-        const formData = new FormData();
-        for (let f of input.files) formData.append('files', f);
-        formData.append('target_path', currentPath);
 
-        const xhr = new XMLHttpRequest();
+        const files = Array.from(input.files);
+        const targetPath = currentPath;
+        const totalBytes = files.reduce((sum, f) => sum + f.size, 0) || 1;
+        let doneBytes = 0;
         document.getElementById('uploadProgressContainer').classList.remove('d-none');
         const pBar = document.getElementById('uploadProgressBar');
+        const setProgress = () => { pBar.style.width = Math.round(doneBytes / totalBytes * 100) + "%"; };
 
-        xhr.upload.onprogress = (e) => {
-            if(e.lengthComputable) pBar.style.width = Math.round((e.loaded / e.total) * 100) + "%";
-        };
-        xhr.onload = () => {
+        try {
+            let duplicates = 0;
+            for (const file of files) {
+                const result = await uploadFile(file, targetPath, bytes => { doneBytes += bytes; setProgress(); });
+                if (result.duplicate) duplicates++;
+            }
+            showToast(duplicates ? `アップロード完了！ (${duplicates} 件は同じ内容のファイルがありました)` : "アップロード完了！", "bg-success");
+            input.value = '';
+        } catch (e) {
+            showToast(`❌ アップロードが中断しました: ${e.message} (もう一度アップロードすると続きから再開します)`, "bg-danger");
+        } finally {
             document.getElementById('uploadProgressContainer').classList.add('d-none');
             pBar.style.width = "0%";
-            showToast("アップロード完了！", "bg-success");
-            input.value = '';
             loadFiles();
             updateDisk();
+        }
+    }
+
+    async function uploadFile(file, targetPath, onProgress) {
+        // 同じファイルなら受信途中のアップロードを引き継ぐ
+        const init = await postJson('/api/upload/init', {
+            name: file.name,
+            size: file.size,
+            target_path: targetPath,
+            fingerprint: `${targetPath}/${file.name}:${file.size}:${file.lastModified}`,
+        });
+        if (init.duplicate) {
+            onProgress(file.size);
+            return init;
+        }
+        const received = new Set(init.received);
+        const queue = [];
+        for (let i = 0; i < init.chunks; i++) {
+            const bytes = Math.min(init.chunk_size, file.size - i * init.chunk_size);
+            if (received.has(i)) onProgress(bytes);
+            else queue.push(i);
+        }
+
+        const worker = async () => {
+            while (queue.length) {
+                const index = queue.shift();
+                const blob = file.slice(index * init.chunk_size, (index + 1) * init.chunk_size);
+                await sendChunk(init.upload_id, index, blob);
+                onProgress(blob.size);
+            }
         };
-        xhr.open("POST", "/api/upload");
-        xhr.send(formData);
+        await Promise.all(Array.from({length: Math.min(UPLOAD_CONCURRENCY, queue.length)}, worker));
+        return await postJson(`/api/upload/${init.upload_id}/complete`, {});
+    }
+
+    async function sendChunk(uploadId, index, blob) {
+        const body = await blob.arrayBuffer();
+        const headers = {'Content-Type': 'application/octet-stream'};
+        // HTTPS (または localhost) ならチャンクごとにハッシュを付けて、壊れたデータを検出する
+        if (window.crypto && crypto.subtle) {
+            const digest = await crypto.subtle.digest('SHA-256', body);
+            headers['X-Chunk-SHA256'] = Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+        }
+        for (let attempt = 1; ; attempt++) {
+            try {
+                const r = await fetch(`/api/upload/${uploadId}/chunk?index=${index}`, {method: 'PUT', headers, body});
+                const d = await r.json();
+                if (d.status === 'ok') return;
+                throw new Error(d.message);
+            } catch (e) {
+                if (attempt >= UPLOAD_RETRIES) throw e;
+                await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+            }
+        }
+    }
+
+    async function postJson(url, data) {
+        const r = await fetch(url, {method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify(data)});
+        const d = await r.json();
+        if (d.status !== 'ok') throw new Error(d.message);
+        return d;
     }
 
     function updateDisk() {
-        fetch('/api/disk').then(r => r.json()).then(d => {
-            document.getElementById('diskText').innerText = `Free: ${d.free} / ${d.total}`;
-            document.getElementById('diskBar').style.width = d.percent + "%";
-        });
+        fetch('/api/disk').then(r => r.json()).then(renderDisk);
+    }
+
+    function renderDisk(d) {
+        document.getElementById('diskText').innerText = `Free: ${d.free} / ${d.total}`;
+        document.getElementById('diskBar').style.width = d.percent + "%";
+    }
+
+    // --- フォルダごとの使用量 (大きい順) ---
+    function showUsage() {
+        fetch(`/api/usage?${new URLSearchParams({root: currentRoot, limit: 20})}`)
+            .then(r => r.json())
+            .then(d => {
+                if (d.status !== 'ok') { showToast("❌ エラー: " + d.message, "bg-danger"); return; }
+                document.getElementById('usageCard').classList.remove('d-none');
+                document.getElementById('usageTitle').innerText =
+                    `📊 ${currentRoot}: ${d.total_text}` + (d.indexing ? ' (集計中)' : '');
+                document.getElementById('usageBody').innerHTML = d.items.map(item => {
+                    const percent = d.total ? (item.size / d.total * 100) : 0;
+                    return `
+                        <tr class="folder-link" data-action="open-location" data-root="${escapeHtml(item.root)}" data-path="${escapeHtml(item.path)}">
+                            <td>📁 ${escapeHtml(item.path)}</td>
+                            <td style="width: 30%">
+                                <div class="progress" style="height: 6px;"><div class="progress-bar" style="width: ${percent}%"></div></div>
+                            </td>
+                            <td class="small text-muted text-end text-nowrap">${item.size_text}</td>
+                        </tr>`;
+                }).join('') || '<tr><td class="text-center text-muted">フォルダがありません。</td></tr>';
+            });
+    }
+
+    // --- 同じ内容のファイル (無駄になっている容量の大きい順) ---
+    function showDuplicates() {
+        fetch('/api/duplicates?limit=50')
+            .then(r => r.json())
+            .then(d => {
+                if (d.status !== 'ok') { showToast("❌ エラー: " + d.message, "bg-danger"); return; }
+                document.getElementById('usageCard').classList.remove('d-none');
+                document.getElementById('usageTitle').innerText =
+                    `🧬 重複: ${d.groups.length} 組, ${d.wasted_text} を削減できます` + (d.indexing ? ' (計算中)' : '');
+                document.getElementById('usageBody').innerHTML = d.groups.map(g => `
+                    <tr>
+                        <td>${g.paths.map(p => {
+                            const dir = p.includes('/') ? p.slice(0, p.lastIndexOf('/')) : '';
+                            return `<div class="folder-link" data-action="open-location" data-root="downloads" data-path="${escapeHtml(dir)}">📄 ${escapeHtml(p)}</div>`;
+                        }).join('')}</td>
+                        <td class="small text-muted text-end text-nowrap">${g.size_text} × ${g.copies}</td>
+                    </tr>`).join('') || '<tr><td class="text-center text-muted">同じ内容のファイルはありません。</td></tr>';
+            });
     }
 
     function showToast(msg, cls) {
@@ -338,28 +2389,127 @@ def index(): return render_template_string(HTML_TEMPLATE)
 def list_files(root_name):
     base = DOWNLOAD_DIR if root_name == 'downloads' else EXTRACT_DIR
     try:
-        files = get_file_info(base, request.args.get('path', ''))
-        return jsonify({"status": "ok", "files": files})
+        listing = get_listing(base, request.args.get('path', ''))
+        located = file_index.locate(safe_join(base, request.args.get('path', '')))
+        dir_sizes = file_index.child_dir_sizes(*located) if located else {}
+        duplicates = hash_index.duplicates_in(located[1]) if located and root_name == 'downloads' else {}
+        etag = listing["etag"]
+        if etag and (dir_sizes or duplicates):
+            # 配下のファイルが変わってフォルダの合計サイズや重複が変わったときも送り直す
+            key = etag + repr(sorted(dir_sizes.items())) + repr(sorted(duplicates.items()))
+            etag = hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+        # 変わっていなければ一覧を送らずに 304 を返す
+        if etag and etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            sort = request.args.get('sort', 'mtime')
+            if sort not in LIST_SORT_KEYS:
+                sort = 'mtime'
+            order = 'asc' if request.args.get('order') == 'asc' else 'desc'
+            files = query_listing(listing, sort, order, request.args.get('q', '').strip(), dir_sizes)
+            offset = max(request.args.get('offset', 0, type=int), 0)
+            limit = request.args.get('limit', type=int)
+            page = files[offset:offset + limit] if limit is not None else files[offset:]
+            response = jsonify({
+                "status": "ok",
+                "files": with_duplicates(with_dir_sizes(page, dir_sizes), duplicates),
+                "total": len(files),
+                "offset": offset,
+            })
+        if etag:
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
+@app.route('/api/thumb/<root_name>')
+def thumbnail(root_name):
+    """画像のサムネイル・動画の1コマ (JPEG, 長辺 THUMB_SIZE px)"""
+    base = DOWNLOAD_DIR if root_name == 'downloads' else EXTRACT_DIR
+    try:
+        src = safe_join(base, request.args.get('path', ''))
+        if not os.path.isfile(src):
+            return jsonify({"status": "error", "message": "File not found"}), 404
+        path = get_thumb(src)
+        response = send_file(path, mimetype='image/jpeg', conditional=True)
+    except FutureTimeoutError:
+        response = jsonify({"status": "error", "message": "Thumbnail is not ready"})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    except FileNotFoundError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 415
+    # 画面は URL に v=更新日時-サイズ を付けて呼ぶので、ファイルが変わらない間はブラウザのキャッシュを使う
+    if request.args.get('v'):
+        response.headers['Cache-Control'] = 'private, max-age=604800, immutable'
+    return response
+
 @app.route('/api/download/<root_name>')
 def download_file(root_name):
+    """ファイルを送る。Range (複数範囲も) / If-Range / If-None-Match に対応し、
+    inline=1 なら動画・音声・画像をダウンロードせずにブラウザ内で再生・表示する"""
     base = DOWNLOAD_DIR if root_name == 'downloads' else EXTRACT_DIR
     try:
-        return send_file(safe_join(base, request.args.get('path', '')), as_attachment=True)
-    except Exception as e:
+        path = safe_join(base, request.args.get('path', ''))
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        st = os.stat(path)
+    except Exception:
         return abort(404)
 
+    name = os.path.basename(path)
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    inline = request.args.get('inline') == '1' and is_inline_type(mimetype)
+    etag = file_etag(path, st)
+
+    # 複数範囲は send_file が対応していないため、ここで multipart/byteranges を返す
+    ranges = parse_ranges(request.headers.get('Range'))
+    if (ranges and 1 < len(ranges) <= MAX_RANGES
+            and not app.config['USE_X_SENDFILE']
+            and etag not in request.if_none_match
+            and if_range_matches(etag, st)):
+        resolved = resolve_ranges(ranges, st.st_size)
+        if not resolved:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f"bytes */{st.st_size}"
+            return response
+        response = range_response(path, st.st_size, resolved, mimetype)
+        response.set_etag(etag)
+        response.last_modified = int(st.st_mtime)
+        response.accept_ranges = 'bytes'
+        response.headers['Content-Disposition'] = content_disposition(name, 'inline' if inline else 'attachment')
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        return response
+
+    # 単一範囲・条件付きGETは send_file に任せる (サーバーが対応していれば wsgi.file_wrapper 経由で sendfile される)
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        as_attachment=not inline,
+        download_name=name,
+        conditional=True,
+        etag=etag,
+        last_modified=st.st_mtime,
+    )
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
 @app.route('/api/zip/<root_name>')
 def zip_folder(root_name):
     base = DOWNLOAD_DIR if root_name == 'downloads' else EXTRACT_DIR
     try:
         target = safe_join(base, request.args.get('path', ''))
+        if not os.path.isdir(target):
+            raise ValueError("Not a directory")
         folder_name = os.path.basename(target) or root_name
-        temp_dir = tempfile.mkdtemp()
-        zip_path = shutil.make_archive(os.path.join(temp_dir, folder_name), 'zip', target)
-        return send_file(zip_path, as_attachment=True, download_name=f"{folder_name}.zip")
+        # store_media=0 で動画・画像なども含めて全て圧縮する
+        store_media = request.args.get('store_media', '1') != '0'
+        response = Response(stream_with_context(generate_zip(target, store_media)), mimetype='application/zip')
+        response.headers['Content-Disposition'] = content_disposition(f"{folder_name}.zip")
+        return response
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
@@ -367,14 +2517,117 @@ def zip_folder(root_name):
 def extract():
     try:
         src = safe_join(DOWNLOAD_DIR, request.args.get('path', ''))
-        folder_name = os.path.splitext(os.path.basename(src))[0]
-        dst = os.path.join(EXTRACT_DIR, folder_name)
-        os.makedirs(dst, exist_ok=True)
-        patoolib.extract_archive(src, outdir=dst)
-        return jsonify({"status": "ok"})
+        if not os.path.isfile(src):
+            raise FileNotFoundError("File not found")
+        job = submit_extract(src)
+        return jsonify({"status": "ok", "job_id": job["id"]})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/api/extract/batch', methods=['POST'])
+def extract_batch():
+    """JSONの paths (Downloads内のパス) をまとめて解凍する"""
+    try:
+        paths = (request.get_json(silent=True) or {}).get('paths') or []
+        if not paths:
+            raise ValueError("No files selected")
+        submitted, skipped, errors = submit_extract_batch(paths)
+        return jsonify({"status": "ok", "jobs": submitted, "skipped": skipped, "errors": errors})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
+@app.route('/api/archive/<root_name>')
+def archive_entries(root_name):
+    """アーカイブの中身の一覧 (q で名前を絞り込み, offset/limit で分割取得)"""
+    base = DOWNLOAD_DIR if root_name == 'downloads' else EXTRACT_DIR
+    try:
+        path = safe_join(base, request.args.get('path', ''))
+        if not os.path.isfile(path):
+            raise FileNotFoundError("File not found")
+        entries = list_archive(path)["entries"]
+        q = request.args.get('q', '').strip().lower()
+        if q:
+            entries = [e for e in entries if q in e["name"].lower()]
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = min(request.args.get('limit', 1000, type=int), 10000)
+        return jsonify({
+            "status": "ok",
+            "total": len(entries),
+            "offset": offset,
+            "entries": [
+                {"name": e["name"], "size": e["size"], "size_text": "-" if e["is_dir"] else get_size_format(e["size"]),
+                 "type": "dir" if e["is_dir"] else "file", "mtime": e["mtime"]}
+                for e in entries[offset:offset + limit]
+            ],
+        })
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/api/archive/<root_name>/entry')
+def archive_entry(root_name):
+    """アーカイブ内の1ファイルを、全体を解凍せずに送る (inline=1 で動画・画像などを表示)"""
+    base = DOWNLOAD_DIR if root_name == 'downloads' else EXTRACT_DIR
+    try:
+        path = safe_join(base, request.args.get('path', ''))
+        entry, data = stream_archive_entry(path, request.args.get('name', ''))
+    except Exception:
+        return abort(404)
+    name = os.path.basename(entry["name"])
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    inline = request.args.get('inline') == '1' and is_inline_type(mimetype)
+    response = Response(stream_with_context(data), mimetype=mimetype)
+    response.content_length = entry["size"]
+    response.headers['Content-Disposition'] = content_disposition(name, 'inline' if inline else 'attachment')
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+@app.route('/api/archive/<root_name>/extract', methods=['POST'])
+def archive_extract(root_name):
+    """選んだエントリ (JSONの names) だけを Extracted に解凍する"""
+    base = DOWNLOAD_DIR if root_name == 'downloads' else EXTRACT_DIR
+    try:
+        src = safe_join(base, request.args.get('path', ''))
+        if not os.path.isfile(src):
+            raise FileNotFoundError("File not found")
+        names = (request.get_json(silent=True) or {}).get('names') or []
+        if not names:
+            raise ValueError("No entries selected")
+        job = submit_extract(src, names)
+        return jsonify({"status": "ok", "job_id": job["id"]})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+def find_job(job_id):
+    """全ワーカーのジョブから探す (このプロセスのジョブは最新の状態を返す)"""
+    job = jobs.get(job_id)
+    if job is not None:
+        return job_to_dict(job)
+    found = shared.jobs(job_id)
+    return found[0] if found else None
+
+@app.route('/api/jobs')
+def list_jobs():
+    share_jobs()
+    return jsonify({"status": "ok", "jobs": shared.jobs()})
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify({"status": "ok", "job": job})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = jobs.get(job_id)
+    if job is not None:
+        cancel_local_job(job)
+        share_jobs()
+    # 別のワーカーのジョブなら、そのワーカーが次に確認したときに止める
+    elif not shared.request_cancel(job_id):
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify({"status": "ok", "job": find_job(job_id)})
+
 @app.route('/api/delete/<root_name>', methods=['POST'])
 def delete(root_name):
     base = DOWNLOAD_DIR if root_name == 'downloads' else EXTRACT_DIR
@@ -382,6 +2635,8 @@ def delete(root_name):
         t = safe_join(base, request.args.get('path', ''))
         if os.path.isfile(t): os.remove(t)
         else: shutil.rmtree(t)
+        invalidate_listing(t, recursive=True)
+        notify_change(os.path.dirname(t))
         return jsonify({"status": "ok"})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
@@ -392,12 +2647,181 @@ def upload():
         save_dir = safe_join(DOWNLOAD_DIR, request.form.get('target_path', ''))
         for f in request.files.getlist('files'):
             if f.filename: f.save(os.path.join(save_dir, f.filename))
+        notify_change(save_dir)
+        return jsonify({"status": "ok"})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/api/upload/init', methods=['POST'])
+def upload_init():
+    """分割アップロードを始める (fingerprint が同じ受信途中のアップロードがあればそれを返す)"""
+    try:
+        data = request.get_json(force=True)
+        dedup = data.get('dedup') or UPLOAD_DEDUP
+        if dedup not in DEDUP_MODES:
+            raise ValueError(f"dedup must be one of {', '.join(DEDUP_MODES)}")
+        # sha256 を付けて送られてきて、同じ内容のファイルが既にあれば本文は受け取らない
+        duplicate = find_duplicate_upload(
+            str(data.get('name', '')), str(data.get('target_path', '')), data.get('sha256'), dedup)
+        if duplicate:
+            return jsonify({"status": "ok", "duplicate": os.path.relpath(duplicate, DOWNLOAD_DIR)})
+        upload = create_upload(
+            name=str(data.get('name', '')),
+            size=int(data['size']),
+            target_path=str(data.get('target_path', '')),
+            chunk_size=int(data['chunk_size']) if data.get('chunk_size') else None,
+            fingerprint=data.get('fingerprint'),
+            dedup=dedup,
+        )
+        return jsonify({"status": "ok", **upload_to_dict(upload)})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/api/upload/<upload_id>')
+def upload_status(upload_id):
+    try:
+        return jsonify({"status": "ok", **upload_to_dict(load_upload(upload_id))})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+
+@app.route('/api/upload/<upload_id>/chunk', methods=['PUT'])
+def upload_chunk(upload_id):
+    """?index=N のチャンクを受け取る (本文はチャンクのバイト列, X-Chunk-SHA256 で検証も可)"""
+    try:
+        upload = write_chunk(
+            upload_id,
+            request.args.get('index', type=int, default=-1),
+            request.stream,
+            request.content_length,
+            request.headers.get('X-Chunk-SHA256'),
+        )
+        return jsonify({"status": "ok", "received": len(upload["received"])})
+    except FileNotFoundError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+@app.route('/api/upload/<upload_id>/complete', methods=['POST'])
+def upload_complete(upload_id):
+    try:
+        path, existing = complete_upload(upload_id)
+        return jsonify({
+            "status": "ok",
+            "path": os.path.relpath(path, DOWNLOAD_DIR),
+            "duplicate": os.path.relpath(existing, DOWNLOAD_DIR) if existing else None,
+        })
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/api/upload/<upload_id>', methods=['DELETE'])
+def upload_abort(upload_id):
+    try:
+        with uploads_lock:
+            remove_upload(upload_id)
         return jsonify({"status": "ok"})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
+@app.route('/api/search')
+def search():
+    """索引から名前 (部分一致)・拡張子・サイズでファイルを探す"""
+    try:
+        root = request.args.get('root')
+        if root and root not in ROOTS:
+            raise ValueError("Unknown root")
+        results = file_index.search(
+            q=request.args.get('q', '').strip(),
+            ext=request.args.get('ext', '').strip(),
+            min_size=request.args.get('min_size', type=int),
+            max_size=request.args.get('max_size', type=int),
+            root=root,
+            kind=request.args.get('type'),
+            limit=min(request.args.get('limit', 100, type=int), 1000),
+            offset=max(request.args.get('offset', 0, type=int), 0),
+        )
+        for r in results:
+            r["size_text"] = get_size_format(r["size"]) if r["type"] == "file" else "-"
+            r["mtime_text"] = datetime.fromtimestamp(r["mtime"]).strftime('%Y-%m-%d %H:%M')
+        return jsonify({"status": "ok", "results": results, "indexing": not index_ready()})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/api/usage')
+def usage():
+    """フォルダの合計サイズが大きい順 (索引で集計済みの値を使い、その場では走査しない)"""
+    try:
+        root = request.args.get('root')
+        if root and root not in ROOTS:
+            raise ValueError("Unknown root")
+        rel = ''
+        if request.args.get('path'):
+            if not root:
+                raise ValueError("root is required with path")
+            rel = file_index.locate(safe_join(ROOTS[root], request.args['path']))[1]
+        items = file_index.largest_dirs(
+            root=root,
+            rel=rel,
+            limit=min(request.args.get('limit', 20, type=int), 1000),
+            max_depth=request.args.get('depth', type=int),
+        )
+        for item in items:
+            item["size_text"] = get_size_format(item["size"])
+        total = sum(file_index.dir_size(r, rel)[0] for r in ([root] if root else ROOTS))
+        return jsonify({
+            "status": "ok",
+            "path": rel,
+            "total": total,
+            "total_text": get_size_format(total),
+            "items": items,
+            "indexing": not index_ready(),
+        })
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/api/duplicates')
+def duplicates():
+    """downloads 内の同じ内容のファイル (ハードリンクは1つと数える)"""
+    try:
+        groups = hash_index.duplicate_groups(min(request.args.get('limit', 100, type=int), 1000))
+        for group in groups:
+            group["size_text"] = get_size_format(group["size"])
+        wasted = sum(g["wasted"] for g in groups)
+        return jsonify({
+            "status": "ok",
+            "groups": groups,
+            "wasted": wasted,
+            "wasted_text": get_size_format(wasted),
+            "indexing": not hashes_ready(),
+        })
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
 @app.route('/api/disk')
 def disk(): return jsonify(get_disk_usage())
 
+@app.route('/api/downloads')
+def downloads():
+    """downloader.py で実行中・最近終わったダウンロードと、全体の速度"""
+    return jsonify({"status": "ok", **get_downloads()})
+
+@app.route('/api/events')
+def events():
+    """フォルダの変更・ディスク容量・ジョブの進捗を Server-Sent Events で送り続ける"""
+    response = Response(stream_with_context(event_stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx にバッファさせない
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """リクエスト数・処理時間のヒストグラム・送信バイト数 (Prometheus のテキスト形式)"""
+    if WORKER_COUNT > 1:
+        # 他のワーカーの値は METRICS_SHARE_INTERVAL ごとに書き出されたもの
+        shared.save_metrics(request_metrics.snapshot())
+        snap = merge_metrics(shared.metrics())
+    else:
+        snap = request_metrics.snapshot()
+    return Response(render_metrics(snap), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,609 @@
+"""性能の計測 (ベンチマーク)
+
+合成したファイル (一覧用に 10〜100万件のフォルダ、圧縮用のデータ、大きなファイル、zip/tar.gz) を
+作業フォルダに作り、app.py を起動して次の処理の時間を計る。結果は JSON に保存するので、
+コミットごとに実行して --compare で前の結果と比べられる。
+
+- get_file_info: フォルダの読み込み (キャッシュ無し / キャッシュ有り)
+- /api/list: 一覧のAPI (1ページ分・全件・ETag による 304)
+- /api/download, /api/zip: 送信のスループット
+- /api/extract: zip / tar.gz の解凍時間
+- download_http: ローカルのテスト用HTTPサーバーからのダウンロードのスループット (接続数ごと)
+
+    python bench.py
+    python bench.py --files 10,1000,1000000 --data-mb 1024
+    python bench.py --gunicorn --workers 4
+    python bench.py --compare bench-results/20260101-000000-abc1234.json
+
+作ったファイルは作業フォルダに残し、同じ設定なら次回も使う (乱数の種が同じなら内容も同じ)。
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import zipfile
+import tarfile
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import threading
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), 'file-manager-bench')
+DEFAULT_RESULTS_DIR = 'bench-results'
+DEFAULT_FILES = '10,1000,10000'  # 一覧を計るフォルダのファイル数
+DEFAULT_DATA_MB = 256  # /api/zip と解凍に使うデータの合計
+DEFAULT_FILE_MB = 256  # /api/download と download_http に使うファイルの大きさ
+DEFAULT_REPEAT = 20  # 一覧の計測回数
+DEFAULT_TRANSFER_REPEAT = 3  # 送信・解凍・ダウンロードの計測回数
+DEFAULT_BUDGET = 30  # 1項目の計測にかける最大時間 (秒, 最低 MIN_SAMPLES 回は計る)
+DEFAULT_CONNECTIONS = '1,4'  # download_http の接続数
+DEFAULT_SEED = 1234
+MIN_SAMPLES = 3
+PAGE_SIZE = 200  # 画面が1回に読み込む件数 (HTML_TEMPLATE の PAGE_SIZE)
+READ_SIZE = 1024 * 1024
+DATA_FILE_SIZE = 8 * 1024 * 1024  # 圧縮用データの大きいファイル1つの大きさ
+SMALL_FILES = 1000  # 圧縮用データの小さいファイルの数
+SMALL_FILE_SIZE = 4096
+LIST_EXTS = ('.jpg', '.mp4', '.txt', '.zip', '.pdf', '.mkv', '.png', '.log')
+BASE_MTIME = 1704067200  # 合成したファイルの更新日時の基準 (2024-01-01)
+SERVER_START_TIMEOUT = 60
+JOB_POLL_INTERVAL = 0.05
+BENCHES = ('list', 'download', 'zip', 'extract', 'http')
+
+WORDS = ("alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo lima mike november "
+         "oscar papa quebec romeo sierra tango uniform victor whiskey xray yankee zulu").split()
+
+
+# --- 合成データ ---
+def random_bytes(rng, size):
+    """乱数の種から決まる (圧縮できない) データを少しずつ返す"""
+    while size > 0:
+        n = min(size, READ_SIZE)
+        yield rng.randbytes(n)
+        size -= n
+
+
+def text_block(rng, size):
+    """圧縮しやすいテキスト"""
+    lines = []
+    length = 0
+    while length < size:
+        line = f"{len(lines):08d} " + " ".join(rng.choices(WORDS, k=12)) + "\n"
+        lines.append(line)
+        length += len(line)
+    return "".join(lines).encode()[:size]
+
+
+def make_list_tree(path, count, rng):
+    """一覧用: count 件のファイルを1つのフォルダに作る (中身は空で、サイズだけ持たせる)"""
+    os.makedirs(path)
+    width = len(str(count))
+    for i in range(count):
+        name = f"{i:0{width}d}-{rng.choice(WORDS)}{rng.choice(LIST_EXTS)}"
+        file_path = os.path.join(path, name)
+        with open(file_path, 'wb') as f:
+            f.truncate(rng.randrange(1024 * 1024 * 1024))
+        mtime = BASE_MTIME + rng.randrange(365 * 24 * 3600)
+        os.utime(file_path, (mtime, mtime))
+        if count >= 100000 and (i + 1) % 100000 == 0:
+            print(f"   {i + 1:,} / {count:,}")
+
+
+def make_data_tree(path, total, rng):
+    """圧縮・解凍用: 動画 (圧縮できない) とログ (圧縮しやすい) を半分ずつと、小さいファイルたち"""
+    os.makedirs(os.path.join(path, 'small'))
+    block = text_block(rng, DATA_FILE_SIZE * 2)
+    for i in range(max(total // DATA_FILE_SIZE, 1)):
+        if i % 2 == 0:
+            with open(os.path.join(path, f"video-{i:04d}.mp4"), 'wb') as f:
+                for data in random_bytes(rng, DATA_FILE_SIZE):
+                    f.write(data)
+        else:
+            start = rng.randrange(DATA_FILE_SIZE)
+            with open(os.path.join(path, f"log-{i:04d}.log"), 'wb') as f:
+                f.write(block[start:start + DATA_FILE_SIZE])
+    for i in range(SMALL_FILES):
+        start = rng.randrange(DATA_FILE_SIZE)
+        with open(os.path.join(path, 'small', f"note-{i:04d}.txt"), 'wb') as f:
+            f.write(block[start:start + SMALL_FILE_SIZE])
+
+
+def make_big_file(path, size, rng):
+    with open(path, 'wb') as f:
+        for data in random_bytes(rng, size):
+            f.write(data)
+
+
+def make_zip(path, src):
+    """generate_zip と同じく、動画はそのまま格納してそれ以外は圧縮する"""
+    with zipfile.ZipFile(path, 'w') as zf:
+        for dirpath, _, filenames in os.walk(src):
+            for name in sorted(filenames):
+                file_path = os.path.join(dirpath, name)
+                method = zipfile.ZIP_STORED if name.endswith('.mp4') else zipfile.ZIP_DEFLATED
+                zf.write(file_path, os.path.relpath(file_path, src), compress_type=method)
+
+
+def make_tar(path, src):
+    with tarfile.open(path, 'w:gz') as tf:
+        tf.add(src, arcname='.')
+
+
+def tree_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            total += os.path.getsize(os.path.join(dirpath, name))
+    return total
+
+
+def prepare(workdir, args):
+    """合成データを作る。前回と同じ設定で作ったものはそのまま使う"""
+    manifest_path = os.path.join(workdir, 'bench-manifest.json')
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    extracted = os.path.join(workdir, 'extracted')
+    downloads = os.path.join(workdir, 'downloads')
+    data_dir = os.path.join(extracted, 'bench-data')
+    items = [
+        (f"list-{count}", os.path.join(extracted, 'bench-list', str(count)), {"files": count},
+         lambda path, rng, count=count: make_list_tree(path, count, rng))
+        for count in args.files
+    ]
+    items += [
+        ("data", data_dir, {"mb": args.data_mb},
+         lambda path, rng: make_data_tree(path, args.data_mb * 1024 * 1024, rng)),
+        ("file", os.path.join(extracted, 'bench-file.bin'), {"mb": args.file_mb},
+         lambda path, rng: make_big_file(path, args.file_mb * 1024 * 1024, rng)),
+        # アーカイブは data から作るので data の後に
+        ("zip", os.path.join(downloads, 'bench-archive.zip'), {"mb": args.data_mb},
+         lambda path, rng: make_zip(path, data_dir)),
+        ("tar", os.path.join(downloads, 'bench-archive-tar.tar.gz'), {"mb": args.data_mb},
+         lambda path, rng: make_tar(path, data_dir)),
+    ]
+    rebuilt = False
+    for name, path, params, build in items:
+        params = {**params, "seed": args.seed}
+        # 元にしたデータを作り直したら、アーカイブも作り直す
+        if manifest.get(name) == params and os.path.exists(path) and not (rebuilt and name in ("zip", "tar")):
+            continue
+        print(f"🛠️ 作成中: {name} {params}")
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        build(path, random.Random(f"{args.seed}:{name}"))
+        manifest[name] = params
+        rebuilt = rebuilt or name == "data"
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+    return {"data_bytes": tree_size(data_dir)}
+
+
+# --- 計測 ---
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "p95": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+        "mean": statistics.fmean(ordered),
+    }
+
+
+def measure(fn, repeat, budget):
+    """fn の実行時間 (秒) を repeat 回計る。budget 秒を超えたら MIN_SAMPLES 回で打ち切る"""
+    samples = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+        if len(samples) >= MIN_SAMPLES and time.perf_counter() - started > budget:
+            break
+    return samples
+
+
+def latency_result(name, samples, **extra):
+    stats = summarize(samples)
+    print(f"   {name:<40} 中央値 {stats['median'] * 1000:10.2f} ms  (p95 {stats['p95'] * 1000:.2f} ms, {stats['n']} 回)")
+    return {"name": name, "unit": "s", "value": stats["median"], **stats, **extra}
+
+
+def throughput_result(name, size, samples, **extra):
+    stats = summarize(samples)
+    rate = size / stats["median"] / 1024 / 1024
+    print(f"   {name:<40} {rate:10.1f} MB/s  ({size / 1024 / 1024:.0f} MB, 中央値 {stats['median']:.2f} 秒, {stats['n']} 回)")
+    return {"name": name, "unit": "MB/s", "value": rate, "bytes": size, "seconds": stats, **extra}
+
+
+def read_body(response):
+    size = 0
+    for data in response.iter_content(READ_SIZE):
+        size += len(data)
+    return size
+
+
+def bench_list(app, session, base_url, args):
+    results = []
+    print("📂 一覧")
+    for count in args.files:
+        rel = f"bench-list/{count}"
+        path = os.path.join(app.EXTRACT_DIR, 'bench-list', str(count))
+
+        def cold():
+            app.invalidate_listing(path)
+            app.get_file_info(app.EXTRACT_DIR, rel)
+
+        results.append(latency_result(f"get_file_info.cold[{count}]", measure(cold, args.repeat, args.budget),
+                                      files=count))
+        app.get_file_info(app.EXTRACT_DIR, rel)
+        results.append(latency_result(
+            f"get_file_info.warm[{count}]",
+            measure(lambda: app.get_file_info(app.EXTRACT_DIR, rel), args.repeat, args.budget), files=count))
+
+        url = f"{base_url}/api/list/extracted"
+        page = {"path": rel, "sort": "mtime", "order": "desc", "offset": 0, "limit": PAGE_SIZE}
+
+        def get(params, headers=None):
+            r = session.get(url, params=params, headers=headers)
+            if r.status_code not in (200, 304):
+                raise RuntimeError(f"{url}: HTTP {r.status_code}")
+            return r
+
+        if not args.gunicorn:
+            # 他のワーカーのキャッシュは消せないので、1プロセスのときだけ
+            def cold_page():
+                app.invalidate_listing(path)
+                get(page)
+            results.append(latency_result(f"api_list.page.cold[{count}]",
+                                          measure(cold_page, args.repeat, args.budget), files=count))
+        results.append(latency_result(f"api_list.page[{count}]",
+                                      measure(lambda: get(page), args.repeat, args.budget), files=count))
+        results.append(latency_result(f"api_list.name_sort[{count}]",
+                                      measure(lambda: get({**page, "sort": "name", "order": "asc"}),
+                                              args.repeat, args.budget), files=count))
+        results.append(latency_result(f"api_list.full[{count}]",
+                                      measure(lambda: get({"path": rel}), args.repeat, args.budget), files=count))
+
+        # ETag はフォルダの内容から決まるので、読み直し・別のワーカーでも変わらない
+        etag = get(page).headers.get('ETag')
+
+        def not_modified():
+            if get(page, {"If-None-Match": etag}).status_code != 304:
+                raise RuntimeError("/api/list: 内容が変わっていないのに 304 になりません")
+
+        if etag:
+            results.append(latency_result(f"api_list.not_modified[{count}]",
+                                          measure(not_modified, args.repeat, args.budget), files=count))
+    return results
+
+
+def bench_download(app, session, base_url, args):
+    print("📤 送信")
+    path = os.path.join(app.EXTRACT_DIR, 'bench-file.bin')
+    size = os.path.getsize(path)
+
+    def download():
+        with session.get(f"{base_url}/api/download/extracted", params={"path": "bench-file.bin"}, stream=True) as r:
+            r.raise_for_status()
+            if read_body(r) != size:
+                raise RuntimeError("/api/download: サイズが一致しません")
+
+    return [throughput_result("api_download", size, measure(download, args.transfer_repeat, args.budget))]
+
+
+def bench_zip(app, session, base_url, args, data_bytes):
+    print("🗜️ ZIP")
+    results = []
+    for name, store_media in (("api_zip", "1"), ("api_zip.deflate_all", "0")):
+        sizes = []
+
+        def download():
+            with session.get(f"{base_url}/api/zip/extracted",
+                             params={"path": "bench-data", "store_media": store_media}, stream=True) as r:
+                r.raise_for_status()
+                sizes.append(read_body(r))
+
+        samples = measure(download, args.transfer_repeat, args.budget)
+        # スループットは元のファイルの合計で計算する (出力の大きさは圧縮率で変わるため)
+        results.append(throughput_result(name, data_bytes, samples, output_bytes=sizes[-1]))
+    return results
+
+
+def bench_extract(app, session, base_url, args, data_bytes):
+    print("📦 解凍")
+    results = []
+    for name, archive in (("api_extract.zip", "bench-archive.zip"), ("api_extract.tar_gz", "bench-archive-tar.tar.gz")):
+        def extract():
+            before = set(os.listdir(app.EXTRACT_DIR))
+            r = session.post(f"{base_url}/api/extract", params={"path": archive}).json()
+            if r["status"] != "ok":
+                raise RuntimeError(f"/api/extract: {r['message']}")
+            while True:
+                job = session.get(f"{base_url}/api/jobs/{r['job_id']}").json()["job"]
+                if job["state"] not in ("queued", "running"):
+                    break
+                time.sleep(JOB_POLL_INTERVAL)
+            # 計測した時間には含めたくないが、次の回の前に消す必要がある
+            for entry in set(os.listdir(app.EXTRACT_DIR)) - before:
+                shutil.rmtree(os.path.join(app.EXTRACT_DIR, entry), ignore_errors=True)
+            if job["state"] != "done":
+                raise RuntimeError(f"/api/extract: {job['state']} {job['error'] or ''}")
+
+        samples = measure(extract, args.transfer_repeat, args.budget)
+        results.append(throughput_result(name, data_bytes, samples,
+                                         archive_bytes=os.path.getsize(os.path.join(app.DOWNLOAD_DIR, archive))))
+    return results
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """download_http の相手をするテスト用のサーバー (単一範囲の Range に対応し、sendfile で送る)"""
+    protocol_version = 'HTTP/1.1'
+    root = None
+
+    def do_GET(self):
+        path = os.path.join(self.root, os.path.basename(self.path.split('?', 1)[0]))
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404)
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            start, end = 0, st.st_size - 1
+            header = self.headers.get('Range', '')
+            if header.startswith('bytes='):
+                first, _, last = header[6:].partition('-')
+                start = int(first)
+                end = min(int(last), end) if last else end
+                self.send_response(206)
+                self.send_header('Content-Range', f"bytes {start}-{end}/{st.st_size}")
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Last-Modified', self.date_time_string(int(st.st_mtime)))
+            self.end_headers()
+            try:
+                self.wfile.flush()
+                self.connection.sendfile(f, start, end - start + 1)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # ダウンロード側が最初のレスポンスを途中で閉じた
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_http(app, args, workdir):
+    print("🌐 download_http")
+    try:
+        import downloader
+    except SystemExit:
+        print("⚠️ downloader.py を読み込めないので download_http は計りません")
+        return []
+    # 索引・一覧の対象外に保存する (バックグラウンドの索引の更新が計測に混ざらないように)
+    downloader.SAVE_PATH = os.path.join(workdir, 'http-out')
+    RangeHandler.root = app.EXTRACT_DIR
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/bench-file.bin"
+    size = os.path.getsize(os.path.join(app.EXTRACT_DIR, 'bench-file.bin'))
+    results = []
+    try:
+        for connections in args.connections:
+            def download():
+                shutil.rmtree(downloader.SAVE_PATH, ignore_errors=True)
+                if downloader.download_http(url, connections=connections, verbose=False) is None:
+                    raise RuntimeError("download_http が失敗しました")
+
+            results.append(throughput_result(f"download_http[c={connections}]", size,
+                                             measure(download, args.transfer_repeat, args.budget),
+                                             connections=connections))
+    finally:
+        server.shutdown()
+        shutil.rmtree(downloader.SAVE_PATH, ignore_errors=True)
+    return results
+
+
+# --- サーバー ---
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(app, args, workdir):
+    """app を起動して (URL, 止める関数) を返す。--gunicorn なら serve.py を別プロセスで起動する"""
+    if not args.gunicorn:
+        from werkzeug.serving import make_server, WSGIRequestHandler
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args):
+                pass
+
+        server = make_server('127.0.0.1', 0, app.app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+    port = free_port()
+    log = open(os.path.join(workdir, 'server.log'), 'ab')
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, 'serve.py'), '--bind', f"127.0.0.1:{port}",
+         '--workers', str(args.workers)],
+        cwd=workdir, stdout=log, stderr=log)
+
+    def stop():
+        proc.terminate()
+        proc.wait()
+        log.close()
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            requests.get(f"{url}/api/disk", timeout=1)
+            return url, stop
+        except requests.ConnectionError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                stop()
+                raise RuntimeError(f"serve.py を起動できませんでした ({os.path.join(workdir, 'server.log')})")
+            time.sleep(0.2)
+
+
+def wait_for_index(app):
+    """索引が出来るまで待つ (作成中の走査・ハッシュ計算が計測に混ざらないように)"""
+    started = last_report = time.monotonic()
+    while not (app.index_ready() and app.hashes_ready()):
+        if time.monotonic() - last_report >= 10:
+            last_report = time.monotonic()
+            print(f"⏳ 索引の作成を待っています ({last_report - started:.0f} 秒)")
+        time.sleep(0.5)
+
+
+# --- 結果 ---
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def compare(old_path, report):
+    """前の結果と中央値を比べて表示する (+ が良くなった方向)"""
+    with open(old_path) as f:
+        old_report = json.load(f)
+    old = {r["name"]: r for r in old_report["results"]}
+    print(f"\n📊 比較: {old_report['commit']} → {report['commit']}")
+    for result in report["results"]:
+        before = old.get(result["name"])
+        if not before or not before["value"]:
+            continue
+        change = (result["value"] - before["value"]) / before["value"] * 100
+        better = -change if result["unit"] == "s" else change
+        mark = "🟢" if better > 5 else "🔴" if better < -5 else "⚪"
+        print(f"   {mark} {result['name']:<40} {before['value']:.4g} → {result['value']:.4g} {result['unit']} "
+              f"({better:+.1f}%)")
+
+
+def parse_list(text):
+    return [int(v) for v in text.split(',') if v.strip()]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="File Manager の一覧・送信・解凍・ダウンロードの性能を計ります")
+    parser.add_argument('--files', type=parse_list, default=parse_list(DEFAULT_FILES),
+                        help=f"一覧を計るフォルダのファイル数 (カンマ区切り, 既定: {DEFAULT_FILES})")
+    parser.add_argument('--data-mb', type=int, default=DEFAULT_DATA_MB,
+                        help=f"ZIP・解凍に使うデータの合計 (MB, 既定: {DEFAULT_DATA_MB})")
+    parser.add_argument('--file-mb', type=int, default=DEFAULT_FILE_MB,
+                        help=f"ダウンロードに使うファイルの大きさ (MB, 既定: {DEFAULT_FILE_MB})")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help=f"一覧の計測回数 (既定: {DEFAULT_REPEAT})")
+    parser.add_argument('--transfer-repeat', type=int, default=DEFAULT_TRANSFER_REPEAT,
+                        help=f"送信・解凍・ダウンロードの計測回数 (既定: {DEFAULT_TRANSFER_REPEAT})")
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                        help=f"1項目の計測にかける最大時間 (秒, 既定: {DEFAULT_BUDGET})")
+    parser.add_argument('--connections', type=parse_list, default=parse_list(DEFAULT_CONNECTIONS),
+                        help=f"download_http の接続数 (カンマ区切り, 既定: {DEFAULT_CONNECTIONS})")
+    parser.add_argument('--only', default=','.join(BENCHES),
+                        help=f"計る項目 (カンマ区切り: {', '.join(BENCHES)})")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="合成データの乱数の種")
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR,
+                        help=f"合成データと app の作業フォルダ (既定: {DEFAULT_WORKDIR})")
+    parser.add_argument('--gunicorn', action='store_true', help="serve.py (gunicorn) で起動して計る")
+    parser.add_argument('--workers', type=int, default=4, help="--gunicorn のワーカー数 (既定: 4)")
+    parser.add_argument('--out', help=f"結果の保存先 (既定: {DEFAULT_RESULTS_DIR}/日時-コミット.json)")
+    parser.add_argument('--compare', help="比べる前回の結果 (JSON)")
+    args = parser.parse_args()
+    args.only = [b for b in args.only.split(',') if b]
+    unknown = set(args.only) - set(BENCHES)
+    if unknown:
+        parser.error(f"不明な項目: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main():
+    args = parse_args()
+    commit = git_commit()
+    out = os.path.abspath(args.out or os.path.join(
+        DEFAULT_RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'unknown'}.json"))
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    workdir = os.path.abspath(args.workdir)
+    os.makedirs(workdir, exist_ok=True)
+
+    info = prepare(workdir, args)
+    # app.py は起動したフォルダの downloads / extracted を使う
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import app
+
+    print("⏳ 索引の作成を待っています")
+    wait_for_index(app)
+    base_url, stop = start_server(app, args, workdir)
+    print(f"🚀 {base_url} ({'gunicorn' if args.gunicorn else 'Flask'}) で計測します")
+    session = requests.Session()
+    results = []
+    try:
+        if 'list' in args.only:
+            results += bench_list(app, session, base_url, args)
+        if 'download' in args.only:
+            results += bench_download(app, session, base_url, args)
+        if 'zip' in args.only:
+            results += bench_zip(app, session, base_url, args, info["data_bytes"])
+        if 'extract' in args.only:
+            results += bench_extract(app, session, base_url, args, info["data_bytes"])
+        if 'http' in args.only:
+            results += bench_http(app, args, workdir)
+    finally:
+        session.close()
+        stop()
+
+    report = {
+        "commit": commit,
+        "created": datetime.now().isoformat(timespec='seconds'),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "params": {
+            "files": args.files,
+            "data_mb": args.data_mb,
+            "file_mb": args.file_mb,
+            "seed": args.seed,
+            "server": f"gunicorn x{args.workers}" if args.gunicorn else "flask",
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n✅ 結果を保存しました: {out}")
+    if compare_path:
+        compare(compare_path, report)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,8 +6,18 @@ import os
 sys.path.append("/usr/lib/python3/dist-packages")
 
 import time
+import json
+import uuid
+import hashlib
+import argparse
+import tempfile
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse, unquote
+from job_registry import JobRegistry
+from hash_index import HashIndex, link_file
 
 # libtorrentのインポート
 try:
@@ -22,6 +32,85 @@ except ImportError:
 # 保存先フォルダの設定
 SAVE_PATH = './downloads'
 
+# HTTPダウンロードの設定
+DEFAULT_CHUNK_SIZE = 256 * 1024  # 1回に読み込むサイズ (バイト)
+DEFAULT_CONNECTIONS = 4
+MIN_SEGMENT_SIZE = 1024 * 1024  # これより小さい分割はしない
+MARK_INTERVAL = 1024 * 1024  # 完了範囲を記録する間隔 (バイト)
+STATE_SAVE_INTERVAL = 1.0  # 再開用ファイルを書き出す間隔 (秒)
+PART_SUFFIX = '.part'  # ダウンロード途中のファイル
+STATE_SUFFIX = '.part.json'  # 再開用の情報 (ETag/Last-Modified と完了済みの範囲)
+HASH_READ_SIZE = 1024 * 1024  # 分割ダウンロードでハッシュ計算が追いつくときに読むサイズ
+HASH_FOLLOW_INTERVAL = 0.2  # 分割ダウンロードで、書き終わった範囲のハッシュを計算しに行く間隔 (秒)
+
+# キューモードの設定
+DEFAULT_JOBS = 3  # 同時に実行するジョブ数
+DEFAULT_RETRIES = 3
+RETRY_BACKOFF = 5  # 再試行までの待ち時間 (秒, 1回ごとに2倍)
+RETRY_BACKOFF_MAX = 300
+METADATA_TIMEOUT = 60  # Torrentのメタデータ取得を諦めるまでの時間 (秒)
+DEFAULT_INTERVAL = 1.0  # Torrentの進捗を更新する間隔 (秒)
+
+# Ctrl+C で全ジョブを止めるためのフラグ
+STOP = threading.Event()
+
+# Torrentの状態の保存先 (再開データ, メタデータ, セッション/DHTの状態)
+STATE_DIR = './.state'
+TORRENT_STATE_DIR = os.path.join(STATE_DIR, 'torrents')
+SESSION_STATE_FILE = os.path.join(STATE_DIR, 'session.dat')
+RESUME_SAVE_INTERVAL = 60  # 再開データを保存する間隔 (秒)
+
+# Web画面 (app.py) にジョブの状態を伝える登録簿
+REGISTRY_FILE = os.path.join(STATE_DIR, 'downloads.db')
+REGISTRY_INTERVAL = 1.0  # 登録簿に書き込む間隔 (秒)
+
+# 内容ハッシュの索引 (同じファイルの重複ダウンロードを避ける。app.py と共有)
+HASH_INDEX_FILE = os.path.join(STATE_DIR, 'hashes.db')
+CHECKSUM_ALGORITHMS = ('sha256', 'md5')  # --checksum で指定できるアルゴリズム
+DEDUP_MODES = ('off', 'skip', 'link')  # 同じ内容のファイルがあるとき: 何もしない / 保存しない / ハードリンクにする
+
+# libtorrentの設定
+LISTEN_INTERFACES = '0.0.0.0:6881,[::]:6881'
+DEFAULT_PROFILE = 'default'
+
+# 性能プロファイル: preset は libtorrent 組み込みの設定, settings はその上書き
+TORRENT_PROFILES = {
+    'default': {
+        'preset': None,
+        'settings': {},
+    },
+    'high_throughput': {
+        'preset': 'high_performance_seed',
+        'settings': {
+            'connections_limit': 800,
+            'active_downloads': 10,
+            'active_seeds': 10,
+            'active_limit': 50,
+            'aio_threads': 8,
+            'hashing_threads': 4,
+            'max_queued_disk_bytes': 64 * 1024 * 1024,
+            'send_buffer_watermark': 3 * 1024 * 1024,
+        },
+    },
+    'low_memory': {
+        'preset': 'min_memory_usage',
+        'settings': {
+            'connections_limit': 50,
+            'active_downloads': 2,
+            'active_seeds': 1,
+            'active_limit': 5,
+            'aio_threads': 1,
+            'hashing_threads': 1,
+            'max_queued_disk_bytes': 1024 * 1024,
+        },
+    },
+}
+
+# ブラウザのふりをするためのヘッダー
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
 def get_filename_from_cd(cd):
     """Content-Dispositionヘッダーからファイル名を取得"""
     if not cd:
@@ -34,17 +123,362 @@ def get_filename_from_cd(cd):
             pass
     return fname
 
-def download_http(url):
-    """普通のURL（直リンク）からのダウンロード"""
-    print(f"🔗 HTTP接続を開始: {url}")
-    
-    # ブラウザのふりをするためのヘッダー
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+def get_size_format(b, factor=1024, suffix="B"):
+    for unit in ["", "K", "M", "G", "T", "P"]:
+        if b < factor:
+            return f"{b:.2f}{unit}{suffix}"
+        b /= factor
+    return f"{b:.2f}Y{suffix}"
+
+class Progress:
+    """複数スレッドから更新される進捗バー (サイズ不明の場合は受信量と速度のみ)
+
+    job が指定された場合はジョブの状態も更新する。show が False なら画面には描画しない
+    (省略時は job が無いときだけ描画する)。
+    """
+
+    def __init__(self, total, done=0, job=None, show=None):
+        self.total = total
+        self.done = done
+        self.job = job
+        self.show = job is None if show is None else show
+        self.lock = threading.Lock()
+        self.last_draw = 0
+        self.start_done = done
+        self.start_time = time.monotonic()
+        if job is not None:
+            job.total = total
+            job.done = done
+
+    def add(self, n):
+        with self.lock:
+            self.done += n
+            if self.job is not None:
+                self.job.done = self.done
+                self.job.received += n
+                self.job.rate = self.rate()
+            if not self.show:
+                return
+            now = time.monotonic()
+            if now - self.last_draw >= 0.1 or (self.total > 0 and self.done >= self.total):
+                self.last_draw = now
+                self.draw()
+
+    def rate(self):
+        elapsed = time.monotonic() - self.start_time
+        return (self.done - self.start_done) / elapsed if elapsed > 0 else 0
+
+    def draw(self):
+        if not self.show:
+            return
+        speed = f"{get_size_format(self.rate())}/s"
+        # ゼロ除算防止
+        if self.total > 0:
+            done = min(50, int(50 * self.done / self.total))
+            percent = min(100, (self.done / self.total) * 100)
+            sys.stdout.write(f"\r[{'=' * done}{' ' * (50-done)}] {percent:.2f}% ({speed})")
+        else:
+            sys.stdout.write(f"\r📦 {get_size_format(self.done)} 受信 ({speed})   ")
+        sys.stdout.flush()
+
+def merge_ranges(ranges):
+    """重なり・隣接するバイト範囲をまとめる"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def missing_ranges(done, total):
+    """完了済みの範囲から、まだ取得していない範囲を求める"""
+    missing = []
+    pos = 0
+    for start, end in merge_ranges(done):
+        if start > pos:
+            missing.append((pos, start - 1))
+        pos = max(pos, end + 1)
+    if pos < total:
+        missing.append((pos, total - 1))
+    return missing
+
+class RangeTracker:
+    """完了したバイト範囲を記録し、再開用ファイルへ定期的に保存する"""
+
+    def __init__(self, state_path, state):
+        self.state_path = state_path
+        self.state = state
+        self.lock = threading.Lock()
+        self.last_save = 0
+
+    def mark(self, start, end):
+        with self.lock:
+            self.state['done'] = merge_ranges(self.state['done'] + [[start, end]])
+            if time.monotonic() - self.last_save >= STATE_SAVE_INTERVAL:
+                self._save()
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def contiguous(self):
+        """先頭から途切れずに完了している長さ"""
+        with self.lock:
+            done = self.state['done']
+            return done[0][1] + 1 if done and done[0][0] == 0 else 0
+
+    def _save(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+        self.last_save = time.monotonic()
+
+class StreamHasher:
+    """書き込んだデータのハッシュを先頭から順に計算する
+
+    1本の接続で先頭から受け取る場合は、書き込むデータをそのまま計算する (update)。
+    分割ダウンロードと前回の続きからの再開では、専用のスレッドが先頭から途切れずに
+    書き終わった範囲を (書き込んだ直後でキャッシュに乗っている) ファイルから順に読んで計算する (follow)。
+    書き込むスレッドとはロックを共有しないので、ダウンロードを待たせない。
+    """
+
+    def __init__(self, path, algorithms):
+        self.path = path
+        self.digests = {name: hashlib.new(name) for name in algorithms}
+        self.pos = 0  # ここまで計算済み
+        self.thread = None
+        self.stop = threading.Event()
+
+    def _feed(self, data):
+        for digest in self.digests.values():
+            digest.update(data)
+        self.pos += len(data)
+
+    def update(self, offset, data):
+        """offset の位置に書き込んだデータ (1本の接続で順に書き込む場合だけ使う)"""
+        if offset <= self.pos < offset + len(data):
+            self._feed(data[self.pos - offset:])
+
+    def read_until(self, limit):
+        """ファイルに書き終わった limit までを読んで計算する"""
+        if self.pos >= limit:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.pos)
+            while self.pos < limit:
+                data = f.read(min(limit - self.pos, HASH_READ_SIZE))
+                if not data:
+                    break
+                self._feed(data)
+
+    def follow(self, tracker):
+        """tracker の先頭から続く完了範囲を、別のスレッドで追いかけて計算する"""
+        def run():
+            while not self.stop.wait(HASH_FOLLOW_INTERVAL):
+                self.read_until(tracker.contiguous())
+        self.thread = threading.Thread(target=run, name="stream-hasher", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        if self.thread is not None:
+            self.stop.set()
+            self.thread.join()
+            self.thread = None
+
+    def finish(self, total):
+        """全体のハッシュ値 (アルゴリズム名 -> 16進数)"""
+        self.close()
+        self.read_until(total)
+        if self.pos != total:
+            raise IOError("ハッシュを計算できませんでした (ファイルが短すぎます)")
+        return {name: digest.hexdigest() for name, digest in self.digests.items()}
+
+def parse_checksum(text):
+    """'sha256:<16進数>' 形式のチェックサムを (アルゴリズム, 16進数) にする"""
+    algorithm, _, value = text.partition(':')
+    algorithm = algorithm.lower()
+    value = value.strip().lower()
+    if algorithm not in CHECKSUM_ALGORITHMS or not value:
+        raise ValueError(f"チェックサムは {'/'.join(a + ':<16進数>' for a in CHECKSUM_ALGORITHMS)} の形式で指定してください")
+    if len(value) != hashlib.new(algorithm).digest_size * 2 or any(c not in '0123456789abcdef' for c in value):
+        raise ValueError(f"{algorithm} のチェックサムの長さまたは文字が正しくありません")
+    return algorithm, value
+
+_hash_index = None
+
+def get_hash_index():
+    """保存先フォルダの内容ハッシュの索引"""
+    global _hash_index
+    if _hash_index is None:
+        _hash_index = HashIndex(HASH_INDEX_FILE, SAVE_PATH)
+    return _hash_index
+
+def load_state(state_path):
+    """再開用ファイルを読み込む (無い・壊れている場合は None)"""
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def make_session(pool_size):
+    """接続を使い回すためのセッションを作成"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(HTTP_HEADERS)
+    return session
+
+def split_ranges(ranges, connections):
+    """取得する範囲を、接続数に合わせて細かく分割"""
+    ranges = sorted(ranges, key=lambda x: x[1] - x[0], reverse=True)
+    while len(ranges) < connections:
+        start, end = ranges[0]
+        size = end - start + 1
+        if size < 2 * MIN_SEGMENT_SIZE:
+            break
+        mid = start + size // 2
+        ranges = sorted(ranges[1:] + [(start, mid - 1), (mid, end)],
+                        key=lambda x: x[1] - x[0], reverse=True)
+    return sorted(ranges)
+
+class ServerFileChanged(IOError):
+    """If-Range が一致せず、サーバーが範囲ではなく全体を返した (ファイルが変わった)"""
+
+class DownloadInterrupted(IOError):
+    """Ctrl+C (STOP) や他の接続の失敗で、本文を最後まで受け取る前に止めた"""
+
+def write_stream(r, path, start, progress, tracker=None, stop=None, chunk_size=DEFAULT_CHUNK_SIZE, hasher=None):
+    """レスポンスの本文をファイルの start の位置から書き込む (メモリ使用量は chunk_size 分のみ)
+
+    hasher が指定された場合は、書き込みながらハッシュも計算する。
+    途中で止められた場合は、書き込んだところまでを記録して DownloadInterrupted を送出する。
+    """
+    with open(path, 'r+b') as f:
+        f.seek(start)
+        pos = marked = start
+        for data in r.iter_content(chunk_size=chunk_size):
+            if STOP.is_set() or (stop is not None and stop.is_set()):
+                f.flush()
+                if tracker and pos > marked:
+                    tracker.mark(marked, pos - 1)
+                raise DownloadInterrupted("中断されました")
+            f.write(data)
+            if hasher:
+                hasher.update(pos, data)
+            pos += len(data)
+            progress.add(len(data))
+            # 書き込んだ内容をディスクへ渡してから完了範囲として記録する
+            if tracker and pos - marked >= MARK_INTERVAL:
+                f.flush()
+                tracker.mark(marked, pos - 1)
+                marked = pos
+        f.flush()
+        if tracker and pos > marked:
+            tracker.mark(marked, pos - 1)
+
+def fetch_range(session, url, part_path, start, end, progress, tracker, stop,
+                if_range=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """指定されたバイト範囲を取得し、ファイルの該当オフセットへ直接書き込む"""
+    headers = {'Range': f'bytes={start}-{end}'}
+    if if_range:
+        headers['If-Range'] = if_range
+    with session.get(url, stream=True, headers=headers) as r:
+        r.raise_for_status()
+        if r.status_code != 206 and if_range:
+            raise ServerFileChanged("サーバー上のファイルが変更されています")
+        if r.status_code != 206:
+            raise IOError(f"サーバーがRangeリクエストに応じませんでした (HTTP {r.status_code})")
+        write_stream(r, part_path, start, progress, tracker, stop, chunk_size)
+
+def download_ranges(session, url, part_path, ranges, connections, progress, tracker,
+                    if_range=None, chunk_size=DEFAULT_CHUNK_SIZE, hasher=None):
+    """バイト範囲ごとに並列ダウンロード (hasher には書き終わった範囲を別のスレッドで追いかけさせる)"""
+    ranges = split_ranges(ranges, connections)
+    workers = min(connections, len(ranges))
+    if workers > 1 and progress.show:
+        print(f"⚡ {workers} 接続で分割ダウンロードします")
+
+    stop = threading.Event()
+    if hasher:
+        hasher.follow(tracker)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(fetch_range, session, url, part_path, start, end,
+                            progress, tracker, stop, if_range, chunk_size)
+                for start, end in ranges
+            ]
+            try:
+                wait(futures, return_when=FIRST_EXCEPTION)
+            except BaseException:
+                stop.set()
+                raise
+            errors = [f.exception() for f in futures if f.done() and f.exception()]
+            if errors:
+                # 1つ失敗したら残りの接続も止め、止めたことによる中断ではない元のエラーを伝える
+                stop.set()
+                wait(futures)
+                errors = [f.exception() for f in futures if f.exception()]
+                raise next((e for e in errors if not isinstance(e, DownloadInterrupted)), errors[0])
+    finally:
+        if hasher:
+            hasher.close()
+
+def get_validator(headers):
+    """サーバー上のファイルが変わっていないか確認するための情報"""
+    return {
+        'etag': headers.get('etag'),
+        'last_modified': headers.get('last-modified'),
     }
-    
+
+def get_if_range(validator):
+    """If-Range に使う値 (弱いETagは使えないので Last-Modified を優先)"""
+    etag = validator.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return validator.get('last_modified')
+
+def quiet(*args, **kwargs):
+    pass
+
+def reuse_duplicate(existing, full_path, sha256, dedup, log):
+    """同じ内容の既存ファイルを使う (skip: 既存ファイルのパス, link: ハードリンクにしたパスを返す)
+
+    skip の場合は何も消さない (full_path に同じ名前の別のファイルがあっても残す)。"""
+    if dedup == 'skip':
+        log(f"\n♻️ 同じ内容のファイルがあるため保存しません: {existing}")
+        return existing
+    link_file(existing, full_path)
+    get_hash_index().record(full_path, sha256)
+    log(f"\n🔗 同じ内容のファイルへのハードリンクにしました: {existing}")
+    return full_path
+
+def download_http(url, connections=DEFAULT_CONNECTIONS, chunk_size=DEFAULT_CHUNK_SIZE, job=None, verbose=None,
+                  checksum=None, dedup='off', hashing=True):
+    """普通のURL（直リンク）からのダウンロード
+
+    成功した場合は保存先のパス、失敗した場合は None を返す。
+    job が指定された場合はジョブの状態を更新する。verbose が False なら画面に出力しない
+    (省略時は job が無いときだけ出力する)。
+
+    checksum に (アルゴリズム, 16進数) を指定すると、書き込みながら計算したハッシュで検証する。
+    hashing が True なら SHA-256 も計算して索引に登録し、dedup ('skip'/'link') に応じて
+    同じ内容の既存ファイルがあれば保存しない・ハードリンクにする。
+    """
+    if verbose is None:
+        verbose = job is None
+    log = print if verbose else quiet
+    log(f"🔗 HTTP接続を開始: {url}")
+
+    session = make_session(connections)
+    tracker = None
+
     try:
-        with requests.get(url, stream=True, headers=headers) as r:
+        with session.get(url, stream=True) as r:
             r.raise_for_status()
             
             filename = get_filename_from_cd(r.headers.get('content-disposition'))
@@ -57,137 +491,839 @@ def download_http(url):
                 os.makedirs(SAVE_PATH)
             
             full_path = os.path.join(SAVE_PATH, unquote(filename))
-            total_length = r.headers.get('content-length')
+            if job is not None:
+                job.name = os.path.basename(full_path)
 
-            print(f"📥 ダウンロード開始: {filename}")
+            # SHA-256 が分かっていて同じ内容のファイルが既にあれば、ダウンロードしない
+            if checksum and checksum[0] == 'sha256' and dedup != 'off':
+                existing = get_hash_index().lookup(checksum[1])
+                if existing:
+                    if any(os.path.abspath(p) == os.path.abspath(full_path) for p in existing):
+                        log(f"✅ 既にダウンロード済みです: {full_path}")
+                        return full_path
+                    return reuse_duplicate(existing[0], full_path, checksum[1], dedup, log)
 
-            with open(full_path, 'wb') as f:
-                if total_length is None or int(total_length) == 0:
-                    # サイズ不明の場合はそのまま書き込む
-                    f.write(r.content)
+            part_path = full_path + PART_SUFFIX
+            state_path = full_path + STATE_SUFFIX
+            total_length = int(r.headers.get('content-length') or 0)
+            accept_ranges = r.headers.get('accept-ranges', '').lower() == 'bytes'
+            # 圧縮転送されている場合はバイト範囲が一致しないので範囲指定しない
+            encoded = r.headers.get('content-encoding', 'identity').lower() != 'identity'
+            validator = get_validator(r.headers)
+            algorithms = set()
+            if hashing:
+                algorithms.add('sha256')
+            if checksum:
+                algorithms.add(checksum[0])
+
+            log(f"📥 ダウンロード開始: {filename}")
+
+            if accept_ranges and not encoded and total_length > 0:
+                # 前回の途中ファイルがあり、サーバー上のファイルが同じなら続きから
+                state = load_state(state_path)
+                # ETag も Last-Modified も無いと同じファイルか確かめられず、If-Range も送れないので最初から
+                resumable = (
+                    state is not None
+                    and get_if_range(validator) is not None
+                    and os.path.exists(part_path)
+                    and state.get('total') == total_length
+                    and state.get('etag') == validator['etag']
+                    and state.get('last_modified') == validator['last_modified']
+                )
+                if resumable:
+                    missing = missing_ranges(state['done'], total_length)
+                    remaining = sum(end - start + 1 for start, end in missing)
+                    log(f"♻️ 前回の続きから再開します (残り {remaining / 1024 / 1024:.1f} MB)")
                 else:
-                    dl = 0
-                    total_length = int(total_length)
-                    for data in r.iter_content(chunk_size=8192):
-                        dl += len(data)
-                        f.write(data)
-                        
-                        # ゼロ除算防止
-                        if total_length > 0:
-                            done = int(50 * dl / total_length)
-                            percent = (dl / total_length) * 100
-                            sys.stdout.write(f"\r[{'=' * done}{' ' * (50-done)}] {percent:.2f}%")
-                            sys.stdout.flush()
-            
-            print(f"\n✅ 完了: {full_path}")
+                    if state is not None:
+                        log("⚠️ サーバー上のファイルが変更されています。最初からダウンロードし直します")
+                    state = {'url': url, 'total': total_length, **validator, 'done': []}
+                    missing = [(0, total_length - 1)]
+                    # 事前にファイルサイズを確保しておく
+                    with open(part_path, 'wb') as f:
+                        f.truncate(total_length)
 
+                tracker = RangeTracker(state_path, state)
+                tracker.save()
+                progress = Progress(total_length, total_length - sum(end - start + 1 for start, end in missing), job, verbose)
+                hasher = StreamHasher(part_path, algorithms) if algorithms else None
+
+                if not resumable and connections <= 1:
+                    # 最初のレスポンスをそのまま使う
+                    write_stream(r, part_path, 0, progress, tracker, chunk_size=chunk_size, hasher=hasher)
+                elif missing:
+                    # 最初のレスポンスは使わずに閉じ、リダイレクト後のURLで範囲ごとに取得する
+                    r.close()
+                    try:
+                        download_ranges(session, r.url, part_path, missing, connections,
+                                        progress, tracker, get_if_range(validator), chunk_size, hasher)
+                    except ServerFileChanged:
+                        if not resumable:
+                            raise
+                        # 再開しようとした途中のファイルは古い内容なので捨てて、最初からやり直す
+                        tracker = None
+                        os.remove(state_path)
+                        os.remove(part_path)
+                        log("⚠️ サーバー上のファイルが変更されています。最初からダウンロードし直します")
+                        return download_http(url, connections, chunk_size, job, verbose, checksum, dedup, hashing)
+
+                if missing_ranges(state['done'], total_length):
+                    raise IOError("ダウンロードが途中で終了しました。再実行すると続きから再開します")
+            else:
+                # 範囲指定できない・サイズ不明の場合も、全体をメモリに載せずに少しずつ書き込む
+                open(part_path, 'wb').close()
+                # 圧縮転送では展開後のサイズが分からない (Content-Length は圧縮後) ので、受信量と速度だけ表示する
+                progress = Progress(0 if encoded else total_length, job=job, show=verbose)
+                hasher = StreamHasher(part_path, algorithms) if algorithms else None
+                write_stream(r, part_path, 0, progress, chunk_size=chunk_size, hasher=hasher)
+                progress.draw()
+                # 圧縮転送では Content-Length は圧縮後のサイズなので、書き込んだサイズではなく受信したバイト数と比べる
+                received = r.raw.tell() if encoded else os.path.getsize(part_path)
+                if total_length and received != total_length:
+                    raise IOError(f"ダウンロードが途中で終了しました ({received} / {total_length} バイト)")
+
+            digests = hasher.finish(os.path.getsize(part_path)) if hasher else {}
+            if checksum and digests[checksum[0]] != checksum[1]:
+                # 壊れた内容は続きから再開しても直らないので、途中ファイルごと消す
+                if tracker:
+                    tracker = None
+                    os.remove(state_path)
+                os.remove(part_path)
+                raise IOError(f"チェックサムが一致しません ({checksum[0]}: 期待値 {checksum[1]}, 実際 {digests[checksum[0]]})")
+
+            sha256 = digests.get('sha256')
+            if sha256 and dedup == 'skip':
+                # 同じ内容のファイルがあれば、保存先 (別のファイルがあるかもしれない) には触れずに途中ファイルを捨てる
+                existing = get_hash_index().lookup(sha256, exclude=full_path)
+                if existing:
+                    if tracker:
+                        tracker = None
+                        os.remove(state_path)
+                    os.remove(part_path)
+                    return reuse_duplicate(existing[0], full_path, sha256, dedup, log)
+
+            os.replace(part_path, full_path)
+            if tracker:
+                tracker = None
+                os.remove(state_path)
+
+            log(f"\n✅ 完了: {full_path}")
+            if checksum:
+                log(f"🔒 {checksum[0]} のチェックサムが一致しました")
+            if sha256:
+                log(f"🔑 SHA-256: {sha256}")
+                try:
+                    existing = get_hash_index().lookup(sha256, exclude=full_path)
+                    if existing and dedup != 'off':
+                        return reuse_duplicate(existing[0], full_path, sha256, dedup, log)
+                    if existing:
+                        log(f"⚠️ 同じ内容のファイルがあります: {existing[0]}")
+                    get_hash_index().record(full_path, sha256)
+                except Exception as e:
+                    # 索引を更新できなくてもダウンロード自体は成功している
+                    log(f"⚠️ ハッシュの索引を更新できませんでした: {e}")
+            return full_path
+
+    except KeyboardInterrupt:
+        print("\n⏸ 中断しました。同じコマンドを再実行すると続きから再開します。")
+    except DownloadInterrupted as e:
+        if job is not None:
+            job.error = str(e)
+        log("\n⏸ 中断しました。同じコマンドを再実行すると続きから再開します。")
     except Exception as e:
-        print(f"\n❌ エラー: {e}")
+        if job is not None:
+            job.error = str(e)
+        log(f"\n❌ エラー: {e}")
+    finally:
+        if tracker:
+            tracker.save()
+        session.close()
 
-def download_torrent_session(handle):
-    """Torrentのダウンロードループ処理"""
-    print(f"⏳ メタデータを取得中... (最大60秒待機)")
+def print_torrent_status(s, connections_limit):
+    """Torrentの進捗を1行で表示"""
+    progress = s.progress * 100
     
-    timeout = 0
-    while not handle.has_metadata():
-        time.sleep(1)
-        timeout += 1
-        if timeout % 10 == 0:
-            print(f"   ...待機中 ({timeout}秒経過)")
-        if timeout > 60:
-            print("\n⚠️ タイムアウト: メタデータの取得に失敗しました。ピアが見つからない可能性があります。")
-            return
+    state_str = ['Queued', 'Check', 'DL Meta', 'DL', 'Done', 'Seed', 'Alloc']
+    state = state_str[s.state] if s.state < len(state_str) else 'Unknown'
 
-    info = handle.get_torrent_info()
-    print(f"📥 Torrent開始: {info.name()}")
-
-    while not handle.is_seed():
-        s = handle.status()
-        progress = s.progress * 100
-        
-        state_str = ['Queued', 'Check', 'DL Meta', 'DL', 'Done', 'Seed', 'Alloc']
-        state = state_str[s.state] if s.state < len(state_str) else 'Unknown'
-
-        sys.stdout.write(
-            f'\r[{state}] {progress:.2f}% '
-            f'(↓{s.download_rate / 1000:.1f} kB/s, '
-            f'↑{s.upload_rate / 1000:.1f} kB/s, '
-            f'Peers: {s.num_peers})'
-        )
-        sys.stdout.flush()
-        time.sleep(1)
+    sys.stdout.write(
+        f'\r[{state}] {progress:.2f}% '
+        f'(↓{s.download_rate / 1000:.1f} kB/s, '
+        f'↑{s.upload_rate / 1000:.1f} kB/s, '
+        f'Peers: {s.num_peers}, '
+        f'Conn: {s.num_connections}/{connections_limit}) '
+        f'[{_profile}]'
+    )
+    sys.stdout.flush()
+
+def update_job_from_status(job, s):
+    """libtorrentの torrent_status をジョブの状態に写す"""
+    if s.has_metadata:
+        job.has_metadata = True
+        job.name = s.name
+    job.total = s.total_wanted
+    job.done = s.total_wanted_done
+    job.rate = s.download_rate
+    job.peers = s.num_peers
+    job.received = s.total_payload_download
+
+def download_torrent_session(handle, interval=DEFAULT_INTERVAL, metadata_timeout=METADATA_TIMEOUT, job=None):
+    """Torrentのダウンロードループ処理
+
+    libtorrentのアラートを待ち受け、メタデータ取得・完了・エラーを即座に処理する。
+    進捗は interval 秒ごとに post_torrent_updates で受け取って表示する (job があればその状態も更新する)。
+    """
+    ses = get_session()
+    connections_limit = ses.get_settings()['connections_limit']
+    finished = handle.status().is_seeding
+    has_metadata = handle.has_metadata()
+    error = None
+
+    def on_alert(a):
+        nonlocal finished, has_metadata, error
+        if isinstance(a, lt.state_update_alert):
+            for s in a.status:
+                if s.handle == handle:
+                    print_torrent_status(s, connections_limit)
+                    if job is not None:
+                        update_job_from_status(job, s)
+                    if s.has_metadata and s.is_seeding:
+                        finished = True
+        elif isinstance(a, lt.metadata_received_alert) and a.handle == handle:
+            has_metadata = True
+            print(f"\n📥 Torrent開始: {handle.torrent_file().name()}")
+        elif isinstance(a, lt.torrent_finished_alert) and a.handle == handle:
+            finished = True
+        elif isinstance(a, lt.torrent_error_alert) and a.handle == handle:
+            error = a.message()
+
+    if has_metadata:
+        print(f"📥 Torrent開始: {handle.torrent_file().name()}")
+    else:
+        print(f"⏳ メタデータを取得中... (最大{metadata_timeout}秒待機)")
+
+    started = last_save = next_update = time.monotonic()
+    next_notice = 10
+    while not finished and error is None:
+        now = time.monotonic()
+        if now >= next_update:
+            ses.post_torrent_updates()
+            next_update = now + interval
+
+        if not has_metadata:
+            waited = now - started
+            if waited > metadata_timeout:
+                print("\n⚠️ タイムアウト: メタデータの取得に失敗しました。ピアが見つからない可能性があります。")
+                if job is not None:
+                    job.fail("メタデータの取得がタイムアウトしました", retries=0)
+                return
+            if waited >= next_notice:
+                print(f"   ...待機中 ({int(waited)}秒経過)")
+                next_notice += 10
+
+        if now - last_save >= RESUME_SAVE_INTERVAL:
+            save_resume_data(ses, [handle], on_alert)
+            last_save = now
+
+        # 次の更新時刻まで、アラートが来るのを待つ
+        ses.wait_for_alert(int(max(next_update - time.monotonic(), 0) * 1000))
+        handle_alerts(ses, on_alert)
+
+    if error is not None:
+        print(f"\n❌ Torrentエラー: {error}")
+        if job is not None:
+            job.fail(error, retries=0)
+        return
     
     print("\n✅ Torrentダウンロード完了！")
+    if job is not None:
+        job.finish()
 
-def download_torrent(source_type, source_data):
-    """Torrentダウンロード処理（Libtorrent 2.x対応版）"""
+# --- Torrentの状態の保存 ---
+def write_file_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def read_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def torrent_state_path(info_hashes, ext):
+    """infohashごとの保存ファイル (.resume: 再開データ, .torrent: メタデータ)"""
+    return os.path.join(TORRENT_STATE_DIR, str(info_hashes.get_best()) + ext)
+
+def save_metadata(handle):
+    """マグネットで取得したメタデータを .torrent として保存"""
+    info = handle.torrent_file()
+    if info is None:
+        return
+    data = lt.bencode(lt.create_torrent(info).generate())
+    write_file_atomic(torrent_state_path(handle.info_hashes(), '.torrent'), data)
+
+def handle_alerts(ses, on_alert=None):
+    """セッションのアラートを処理し、受け取った再開データ (失敗を含む) の件数を返す
+
+    メタデータと再開データはここで保存し、全てのアラートを on_alert にも渡す。
+    """
+    received = 0
+    for a in ses.pop_alerts():
+        if on_alert is not None:
+            on_alert(a)
+        if isinstance(a, lt.metadata_received_alert):
+            save_metadata(a.handle)
+        elif isinstance(a, lt.save_resume_data_alert):
+            path = torrent_state_path(a.params.info_hashes, '.resume')
+            write_file_atomic(path, lt.write_resume_data_buf(a.params))
+            received += 1
+        elif isinstance(a, lt.save_resume_data_failed_alert):
+            received += 1
+    return received
+
+def save_resume_data(ses, handles, on_alert=None, timeout=10):
+    """再開データ (ダウンロード済みのピース情報) を保存し、書き終わるまで待つ"""
+    pending = 0
+    for handle in handles:
+        if handle.is_valid() and handle.has_metadata() and handle.need_save_resume_data():
+            handle.save_resume_data(lt.save_resume_flags_t.save_info_dict)
+            pending += 1
+
+    deadline = time.monotonic() + timeout
+    while pending > 0 and time.monotonic() < deadline:
+        ses.wait_for_alert(500)
+        pending -= handle_alerts(ses, on_alert)
+
+def load_torrent_params(info_hashes, atp):
+    """保存済みの再開データまたはメタデータがあれば、それを使った add_torrent_params を返す"""
+    data = read_file(torrent_state_path(info_hashes, '.resume'))
+    if data:
+        try:
+            resumed = lt.read_resume_data(data)
+            if resumed.ti is None and atp.ti is not None:
+                resumed.ti = atp.ti
+            return resumed, "♻️ 再開データを読み込みました (ハッシュチェックを省略)"
+        except Exception:
+            pass
+
+    if atp.ti is None:
+        cached = torrent_state_path(info_hashes, '.torrent')
+        if os.path.exists(cached):
+            atp.ti = lt.torrent_info(cached)
+            return atp, "🗂 保存済みのメタデータを使用します"
+    return atp, None
+
+def build_settings(profile):
+    """プロファイル名から libtorrent の settings_pack を組み立てる"""
+    config = TORRENT_PROFILES[profile]
+    settings = getattr(lt, config['preset'])() if config['preset'] else {}
+    settings.update(config['settings'])
+    settings['listen_interfaces'] = LISTEN_INTERFACES
+    settings['alert_mask'] = (
+        lt.alert_category.error | lt.alert_category.status | lt.alert_category.storage
+    )
+    return settings
+
+_session = None
+_profile = DEFAULT_PROFILE
+
+def get_session(profile=None):
+    """全てのTorrentで共有するlibtorrentセッション (前回のDHTの状態を引き継ぐ)"""
+    global _session, _profile
+    if _session is None:
+        _profile = profile or DEFAULT_PROFILE
+        data = read_file(SESSION_STATE_FILE)
+        params = lt.read_session_params(data) if data else lt.session_params()
+        _session = lt.session(params)
+        _session.apply_settings(build_settings(_profile))
+    return _session
+
+def close_session():
+    """全Torrentの再開データとセッションの状態を保存する"""
+    global _session
+    if _session is None:
+        return
+    save_resume_data(_session, _session.get_torrents())
+    # 設定はプロファイルで決めるので、DHTの状態だけを保存する
+    state = _session.session_state(lt.save_state_flags_t.save_dht_state)
+    write_file_atomic(SESSION_STATE_FILE, lt.write_session_params_buf(state))
+    _session = None
+
+def add_torrent(ses, source_type, source_data, log=print):
+    """Torrentをセッションに追加してハンドルを返す"""
     if not os.path.exists(SAVE_PATH):
         os.makedirs(SAVE_PATH)
 
-    # セッション設定
-    ses = lt.session()
-    ses.listen_on(6881, 6891)
-    
-    handle = None
-
-    try:
-        if source_type == 'magnet':
-            print("🧲 マグネットリンクを解析中...")
-            atp = lt.parse_magnet_uri(source_data)
-            atp.save_path = SAVE_PATH
-            handle = ses.add_torrent(atp)
-        
-        elif source_type == 'file':
-            print(f"📄 Torrentファイルを読み込み中: {source_data}")
+    if source_type == 'magnet':
+        log("🧲 マグネットリンクを解析中...")
+        atp = lt.parse_magnet_uri(source_data)
+        info_hashes = atp.info_hashes
+    else:
+        if source_type == 'url':
+            log("🌐 Web上の.torrentファイルを検出。一時ダウンロードします...")
+            # User-Agentを追加して拒否を防ぐ
+            r = requests.get(source_data, headers=HTTP_HEADERS)
+            r.raise_for_status()
+            fd, temp_file = tempfile.mkstemp(suffix='.torrent')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(r.content)
+                info = lt.torrent_info(temp_file)
+            finally:
+                os.remove(temp_file)
+        else:
+            log(f"📄 Torrentファイルを読み込み中: {source_data}")
             info = lt.torrent_info(source_data)
-            
-            atp = lt.add_torrent_params()
-            atp.ti = info
-            atp.save_path = SAVE_PATH
-            handle = ses.add_torrent(atp)
 
-        download_torrent_session(handle)
+        atp = lt.add_torrent_params()
+        atp.ti = info
+        info_hashes = info.info_hashes()
+
+    atp, message = load_torrent_params(info_hashes, atp)
+    if message:
+        log(message)
+    atp.save_path = SAVE_PATH
+    return ses.add_torrent(atp)
+
+def download_torrent(source_type, source_data, profile=DEFAULT_PROFILE,
+                     interval=DEFAULT_INTERVAL, metadata_timeout=METADATA_TIMEOUT, job=None):
+    """Torrentダウンロード処理（Libtorrent 2.x対応版）"""
+    try:
+        handle = add_torrent(get_session(profile), source_type, source_data)
+        download_torrent_session(handle, interval, metadata_timeout, job)
 
+    except KeyboardInterrupt:
+        print("\n⏸ 中断しました。同じコマンドを再実行すると続きから再開します。")
+        if job is not None:
+            job.fail("中断されました", retries=0)
     except Exception as e:
         print(f"\n❌ Torrentエラー: {e}")
         print("ヒント: マグネットリンクが正しいか、またはファイルが壊れていないか確認してください。")
+        if job is not None:
+            job.fail(e, retries=0)
+    finally:
+        close_session()
 
-def main():
-    if len(sys.argv) < 2:
-        print("使用法: python downloader.py \"<リンク または ファイルパス>\"")
-        sys.exit(1)
+def detect_source(input_str):
+    """入力の種類を判定 ('magnet', 'url', 'http', 'file' または None)"""
+    if input_str.startswith("magnet:?"):
+        return 'magnet'
+    if input_str.startswith("http://") or input_str.startswith("https://"):
+        if input_str.lower().endswith(".torrent") or ".torrent?" in input_str.lower():
+            return 'url'
+        return 'http'
+    if os.path.isfile(input_str):
+        return 'file'
+    return None
 
-    input_str = sys.argv[1]
+# --- キューモード ---
+JOB_STATE_LABELS = {
+    'queued': '待機',
+    'running': '実行中',
+    'retrying': '再試行待ち',
+    'done': '完了',
+    'failed': '失敗',
+}
 
-    # 1. マグネットリンク
-    if input_str.startswith("magnet:?"):
-        download_torrent('magnet', input_str)
+class Job:
+    """キューで管理するダウンロード1件分の状態"""
 
-    # 2. Web上のURL (http/https)
-    elif input_str.startswith("http://") or input_str.startswith("https://"):
-        if input_str.lower().endswith(".torrent") or ".torrent?" in input_str.lower():
-            print("🌐 Web上の.torrentファイルを検出。一時ダウンロードします...")
+    def __init__(self, source, checksum=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.created = time.time()
+        self.source = source
+        self.checksum = checksum  # (アルゴリズム, 16進数) または None
+        self.source_type = detect_source(source)
+        self.name = source
+        self.state = 'queued'
+        self.total = 0
+        self.done = 0
+        self.received = 0  # 今回の実行で受信したバイト数 (再試行を含む)
+        self.rate = 0
+        self.peers = 0
+        self.attempts = 0
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.retry_at = 0
+        self.added = None  # Torrentをセッションに追加した時刻
+        self.has_metadata = False
+
+    @property
+    def is_torrent(self):
+        return self.source_type in ('magnet', 'url', 'file')
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0
+        return (self.finished or time.monotonic()) - self.started
+
+    def start(self):
+        self.attempts += 1
+        self.state = 'running'
+        self.error = None
+        if self.started is None:
+            self.started = time.monotonic()
+
+    def fail(self, error, retries):
+        """失敗を記録し、再試行するなら待ち時間を設定する (再試行する場合 True)"""
+        self.error = str(error)
+        self.rate = 0
+        if self.attempts <= retries and not STOP.is_set():
+            self.state = 'retrying'
+            self.retry_at = time.monotonic() + retry_delay(self.attempts)
+            return True
+        self.state = 'failed'
+        self.finished = time.monotonic()
+        return False
+
+    def finish(self):
+        self.state = 'done'
+        self.error = None
+        self.rate = 0
+        self.finished = time.monotonic()
+
+    def record(self):
+        """登録簿に書き込む状態"""
+        remaining = self.total - self.done
+        return {
+            'id': self.id,
+            'pid': os.getpid(),
+            'kind': 'torrent' if self.is_torrent else 'http',
+            'source': self.source,
+            'name': self.name,
+            'state': self.state,
+            'total': self.total,
+            'done': self.done,
+            'rate': self.rate,
+            'peers': self.peers,
+            'eta': remaining / self.rate if self.rate > 0 and remaining > 0 else None,
+            'attempts': self.attempts,
+            'error': self.error,
+            'created': self.created,
+        }
+
+class Reporter:
+    """ジョブの状態を一定間隔でまとめて登録簿に書き込み、Web画面から見えるようにする
+
+    with で囲んだ間だけ動き、抜けるときに最後の状態を書き込む。
+    """
+
+    def __init__(self, jobs, interval=REGISTRY_INTERVAL):
+        self.jobs = jobs
+        self.interval = interval
+        self.registry = JobRegistry(REGISTRY_FILE)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.publish()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self.publish()
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            self.publish()
+
+    def publish(self):
+        try:
+            self.registry.publish([job.record() for job in self.jobs])
+        except Exception:
+            pass  # 登録簿に書けなくてもダウンロードは続ける
+
+def retry_delay(attempt):
+    return min(RETRY_BACKOFF * 2 ** (attempt - 1), RETRY_BACKOFF_MAX)
+
+def parse_queue_line(line):
+    """キューの1行からジョブを作る (URLの後に空白を空けて 'sha256:<16進数>' を書ける)"""
+    parts = line.rsplit(None, 1)
+    if len(parts) == 2 and parts[1].partition(':')[0].lower() in CHECKSUM_ALGORITHMS:
+        try:
+            return Job(parts[0], parse_checksum(parts[1]))
+        except ValueError as e:
+            job = Job(parts[0])
+            job.attempts = 1
+            job.fail(e, retries=0)
+            return job
+    return Job(line)
+
+def read_queue(path):
+    """キューファイル (1行1件, '#' はコメント) を読み込む。'-' は標準入力"""
+    f = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    try:
+        return [parse_queue_line(line.strip()) for line in f if line.strip() and not line.strip().startswith('#')]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def run_http_job(job, args, slots):
+    """HTTPジョブを1回実行する
+
+    失敗して再試行する場合は 'retrying' になり、retry_at を過ぎたら run_queue が投入し直す
+    (待ち時間の間プールのスレッドを占有しない)。
+    """
+    if STOP.is_set():
+        return
+    with slots:
+        job.start()
+        path = download_http(job.source, args.connections, args.chunk_size * 1024, job=job,
+                             checksum=job.checksum, dedup=args.dedup, hashing=args.hash)
+        job.rate = 0
+    if path:
+        job.finish()
+    else:
+        job.fail(job.error or "中断されました", args.retries)
+
+def run_torrent_jobs(jobs, args, slots):
+    """全てのTorrentジョブを1つのセッションでまとめて実行
+
+    ハンドルごとにポーリングせず、セッションのアラートでまとめて状態を受け取る。
+    """
+    ses = get_session(args.profile)
+    pending = list(jobs)
+    active = {}  # handle -> job
+    finished = []  # 完了したハンドル
+    failed = []  # (ハンドル, エラーメッセージ)
+
+    def on_alert(a):
+        if isinstance(a, lt.state_update_alert):
+            for s in a.status:
+                job = active.get(s.handle)
+                if job is None:
+                    continue
+                update_job_from_status(job, s)
+                if s.has_metadata and s.is_seeding:
+                    finished.append(s.handle)
+        elif isinstance(a, lt.metadata_received_alert) and a.handle in active:
+            active[a.handle].has_metadata = True
+        elif isinstance(a, lt.torrent_finished_alert) and a.handle in active:
+            finished.append(a.handle)
+        elif isinstance(a, lt.torrent_error_alert) and a.handle in active:
+            failed.append((a.handle, a.message()))
+
+    def remove(handle):
+        job = active.pop(handle)
+        save_resume_data(ses, [handle], on_alert)
+        ses.remove_torrent(handle)
+        job.rate = 0
+        slots.release()
+        return job
+
+    last_save = next_update = time.monotonic()
+
+    while (pending or active) and not STOP.is_set():
+        now = time.monotonic()
+
+        for job in [j for j in pending if j.retry_at <= now]:
+            # HTTPジョブと合わせた同時実行数の上限を守る
+            if not slots.acquire(blocking=False):
+                break
+            pending.remove(job)
+            job.start()
             try:
-                # User-Agentを追加して拒否を防ぐ
-                headers = {'User-Agent': 'Mozilla/5.0'}
-                r = requests.get(input_str, headers=headers)
-                temp_file = "temp_auto.torrent"
-                with open(temp_file, 'wb') as f:
-                    f.write(r.content)
-                download_torrent('file', temp_file)
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
+                handle = add_torrent(ses, job.source_type, job.source, log=quiet)
+                job.added = now
+                job.has_metadata = handle.has_metadata()
+                active[handle] = job
             except Exception as e:
-                print(f"❌ .torrent取得エラー: {e}")
+                slots.release()
+                if job.fail(e, args.retries):
+                    pending.append(job)
+
+        if now >= next_update:
+            ses.post_torrent_updates()
+            next_update = now + args.interval
+
+        for handle, job in active.items():
+            if not job.has_metadata and now - job.added > args.metadata_timeout:
+                failed.append((handle, "メタデータの取得がタイムアウトしました"))
+
+        if now - last_save >= RESUME_SAVE_INTERVAL:
+            save_resume_data(ses, list(active), on_alert)
+            last_save = now
+
+        # 次の更新時刻まで、アラートが来るのを待つ
+        ses.wait_for_alert(int(max(next_update - time.monotonic(), 0) * 1000))
+        handle_alerts(ses, on_alert)
+
+        while finished:
+            handle = finished.pop()
+            if handle in active:
+                remove(handle).finish()
+        while failed:
+            handle, error = failed.pop()
+            if handle in active:
+                job = remove(handle)
+                if job.fail(error, args.retries):
+                    pending.append(job)
+
+    for handle in list(active):
+        remove(handle).fail("中断されました", retries=0)
+    close_session()
+
+def print_queue_status(jobs):
+    running = [j for j in jobs if j.state == 'running']
+    finished = sum(1 for j in jobs if j.state in ('done', 'failed'))
+    rate = sum(j.rate for j in running)
+    sys.stdout.write(
+        f"\r[キュー] 完了 {finished}/{len(jobs)} | 実行中 {len(running)} | "
+        f"↓{get_size_format(rate)}/s   "
+    )
+    sys.stdout.flush()
+
+def print_summary(jobs):
+    """ジョブごとの結果とスループットを表で表示"""
+    print("\n\n📊 結果")
+    print(f"{'#':>3}  {'状態':<6} {'サイズ':>10} {'時間':>8} {'速度':>12} {'試行':>4}  名前")
+    for i, job in enumerate(jobs, 1):
+        rate = job.received / job.elapsed if job.elapsed > 0 else 0
+        size = get_size_format(job.total or job.done) if job.total or job.done else '-'
+        print(
+            f"{i:>3}  {JOB_STATE_LABELS[job.state]:<6} {size:>10} {job.elapsed:>7.1f}s "
+            f"{get_size_format(rate) + '/s':>12} {job.attempts:>4}  {job.name}"
+        )
+        if job.state == 'failed' and job.error:
+            print(f"{'':>5}❌ {job.error}")
+    done = sum(1 for j in jobs if j.state == 'done')
+    print(f"\n✅ 完了: {done} 件 / ❌ 失敗: {len(jobs) - done} 件")
+
+def run_queue(args):
+    """キューファイルのURL・Magnet・.torrentをまとめてダウンロード"""
+    jobs = read_queue(args.queue)
+    if not jobs:
+        print("❌ エラー: キューが空です。")
+        return
+
+    http_jobs = []
+    torrent_jobs = []
+    for job in jobs:
+        if job.state == 'failed':
+            continue
+        if job.source_type == 'http':
+            http_jobs.append(job)
+        elif job.is_torrent:
+            torrent_jobs.append(job)
         else:
-            download_http(input_str)
+            job.attempts = 1
+            job.fail("指定されたファイルまたはリンクが見つかりません", retries=0)
 
-    # 3. ローカルファイル
-    elif os.path.isfile(input_str):
-        download_torrent('file', input_str)
-    
-    else:
+    print(f"📋 キュー: HTTP {len(http_jobs)} 件, Torrent {len(torrent_jobs)} 件 (同時実行: {args.jobs})")
+
+    # HTTPとTorrentを合わせた同時実行数の上限
+    slots = threading.BoundedSemaphore(args.jobs)
+    pool = ThreadPoolExecutor(max_workers=args.jobs + 1)
+    futures = []
+    if torrent_jobs:
+        futures.append(pool.submit(run_torrent_jobs, torrent_jobs, args, slots))
+    http_futures = {job: pool.submit(run_http_job, job, args, slots) for job in http_jobs}
+    futures += http_futures.values()
+
+    with Reporter(jobs):
+        try:
+            while True:
+                # 再試行の待ち時間が過ぎたHTTPジョブを投入し直す
+                now = time.monotonic()
+                for job, future in http_futures.items():
+                    if future.done() and job.state == 'retrying' and job.retry_at <= now and not STOP.is_set():
+                        http_futures[job] = pool.submit(run_http_job, job, args, slots)
+                        futures.append(http_futures[job])
+                waiting = not STOP.is_set() and any(job.state == 'retrying' for job in http_jobs)
+                if not waiting and all(f.done() for f in futures):
+                    break
+                print_queue_status(jobs)
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("\n⏸ 中断しています...")
+            STOP.set()
+        pool.shutdown(wait=True)
+    for future in futures:
+        if future.exception() is not None:
+            print(f"\n❌ エラー: {future.exception()}")
+
+    print_summary(jobs)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="HTTP/HTTPS, Magnetリンク, Torrentファイルのダウンローダー",
+        usage='python downloader.py "<リンク または ファイルパス>" [オプション]\n'
+              '       python downloader.py --queue <キューファイル または -> [オプション]',
+    )
+    parser.add_argument('source', nargs='?', help="URL, Magnetリンク, または .torrent ファイルのパス")
+    parser.add_argument('-c', '--connections', type=int, default=DEFAULT_CONNECTIONS,
+                        help=f"HTTPダウンロード1件あたりの同時接続数 (既定: {DEFAULT_CONNECTIONS}, 1で分割なし)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE // 1024, metavar='KB',
+                        help=f"HTTPダウンロードで1回に読み込むサイズ (KB, 既定: {DEFAULT_CHUNK_SIZE // 1024})")
+    parser.add_argument('-q', '--queue', metavar='FILE',
+                        help="1行1件のリンクを書いたファイルからまとめてダウンロード ('-' で標準入力)")
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS,
+                        help=f"キューモードで同時に実行するジョブ数 (既定: {DEFAULT_JOBS})")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help=f"キューモードで失敗したジョブを再試行する回数 (既定: {DEFAULT_RETRIES})")
+    parser.add_argument('-p', '--profile', choices=sorted(TORRENT_PROFILES), default=DEFAULT_PROFILE,
+                        help=f"Torrentの性能プロファイル (既定: {DEFAULT_PROFILE})")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, metavar='SEC',
+                        help=f"Torrentの進捗を更新する間隔 (秒, 既定: {DEFAULT_INTERVAL})")
+    parser.add_argument('--metadata-timeout', type=int, default=METADATA_TIMEOUT, metavar='SEC',
+                        help=f"Torrentのメタデータ取得を諦めるまでの時間 (秒, 既定: {METADATA_TIMEOUT})")
+    parser.add_argument('--checksum', metavar='ALGO:HEX',
+                        help="HTTPダウンロードしたファイルを検証するチェックサム (sha256:... または md5:...)")
+    parser.add_argument('--dedup', choices=DEDUP_MODES, default='off',
+                        help="同じ内容のファイルが既にある場合の動作 (skip: 保存しない, link: ハードリンクにする, 既定: off)")
+    parser.add_argument('--no-hash', dest='hash', action='store_false',
+                        help="HTTPダウンロード中に SHA-256 を計算して索引に登録しない")
+    args = parser.parse_args()
+    if not args.source and not args.queue:
+        parser.print_usage()
+        sys.exit(1)
+    if args.checksum:
+        try:
+            args.checksum = parse_checksum(args.checksum)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.dedup != 'off' and not args.hash and not (args.checksum and args.checksum[0] == 'sha256'):
+        parser.error("--dedup には SHA-256 が必要です (--no-hash を外すか --checksum sha256:... を指定してください)")
+    args.jobs = max(args.jobs, 1)
+    return args
+
+def main():
+    args = parse_args()
+    if args.queue:
+        run_queue(args)
+        return
+
+    input_str = args.source
+    source_type = detect_source(input_str)
+    if source_type is None:
         print("❌ エラー: 指定されたファイルまたはリンクが見つかりません。")
+        return
+
+    # 1件だけの場合も、Web画面に表示できるようにジョブとして登録する
+    job = Job(input_str, args.checksum)
+    with Reporter([job]):
+        job.start()
+
+        # 1. マグネットリンク / Web上の.torrent / ローカルの.torrent
+        if job.is_torrent:
+            download_torrent(source_type, input_str, args.profile, args.interval, args.metadata_timeout, job=job)
+
+        # 2. Web上のURL (http/https)
+        else:
+            path = download_http(input_str, connections=args.connections, chunk_size=args.chunk_size * 1024,
+                                 job=job, verbose=True, checksum=args.checksum, dedup=args.dedup, hashing=args.hash)
+            if path:
+                job.finish()
+            else:
+                job.fail(job.error or "中断されました", retries=0)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,438 @@
+"""downloads / extracted 全体のファイル索引 (SQLite)
+
+バックグラウンドのスレッドがフォルダを走査して索引を作り、その後は
+mtimeが変わったフォルダだけを読み直して最新に保つ。
+watchdog がインストールされていれば、ファイルシステムの変更通知で即座に更新する。
+フォルダごとの合計サイズ (配下すべて) も、変更の差分だけを親フォルダへ足し込んで保持する。
+"""
+import os
+import time
+import sqlite3
+import threading
+from collections import defaultdict
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+SCAN_INTERVAL = 60  # 変更されたフォルダを探す間隔 (秒)
+FULL_SCAN_INTERVAL = 3600  # 全ファイルのサイズ・日時を確認し直す間隔 (秒)
+DIRTY_DELAY = 2.0  # 変更通知をまとめて処理するまでの待ち時間 (秒)
+FTS_MIN_QUERY = 3  # trigram索引は3文字以上の検索語でのみ使える
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    UNIQUE (root, path)
+);
+CREATE INDEX IF NOT EXISTS files_parent ON files (root, parent);
+CREATE INDEX IF NOT EXISTS files_ext ON files (ext);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime);
+CREATE TABLE IF NOT EXISTS dirs (
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (root, path)
+);
+CREATE TABLE IF NOT EXISTS dir_sizes (
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    parent TEXT,
+    depth INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    files INTEGER NOT NULL,
+    PRIMARY KEY (root, path)
+);
+CREATE INDEX IF NOT EXISTS dir_sizes_parent ON dir_sizes (root, parent);
+CREATE INDEX IF NOT EXISTS dir_sizes_size ON dir_sizes (root, size);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+    name, content='files', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+    INSERT INTO files_fts (rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+    INSERT INTO files_fts (files_fts, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+"""
+
+
+def parent_of(path):
+    return path.rsplit('/', 1)[0] if '/' in path else ''
+
+
+def ancestors(path):
+    """path 自身から root ('') までのフォルダ"""
+    while True:
+        yield path
+        if not path:
+            return
+        path = parent_of(path)
+
+
+def depth_of(path):
+    return path.count('/') + 1 if path else 0
+
+
+def escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class FileIndex:
+    """ファイル索引。書き込みは索引スレッドだけが行い、検索は各スレッドから行う"""
+
+    def __init__(self, db_path, roots, ignore_prefixes=()):
+        self.db_path = db_path
+        self.roots = {name: os.path.abspath(path) for name, path in roots.items()}
+        self.ignore_prefixes = tuple(ignore_prefixes)  # この名前で始まるファイル・フォルダは索引に入れない
+        self.fts = False
+        self.ready = False  # 最初の走査が終わったか
+        self.listeners = []  # 変更されたフォルダを受け取る関数 (root, フォルダの相対パス)
+        self.dirty = {}  # 読み直すフォルダの絶対パス -> 配下も読み直すか
+        self.cond = threading.Condition()
+        self.local = threading.local()
+        self.thread = None
+        self.observer = None
+
+    # --- 接続 ---
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def reader(self):
+        """検索用の接続 (スレッドごと)"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = self.connect()
+        return conn
+
+    def init_db(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = self.connect()
+        conn.executescript(SCHEMA)
+        try:
+            conn.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # trigram に対応していない古いSQLiteでは LIKE で検索する
+            self.fts = False
+        conn.commit()
+        conn.close()
+
+    # --- 起動 ---
+    def start(self):
+        if self.thread is not None:
+            return
+        self.init_db()
+        self.thread = threading.Thread(target=self.run, name="file-index", daemon=True)
+        self.thread.start()
+        if Observer is not None:
+            self.observer = Observer()
+            handler = _EventHandler(self)
+            for path in self.roots.values():
+                self.observer.schedule(handler, path, recursive=True)
+            self.observer.daemon = True
+            self.observer.start()
+
+    def mark_dirty(self, path, recursive=False):
+        """フォルダを読み直すよう索引スレッドに伝える"""
+        path = os.path.abspath(path)
+        if self.locate(path) is None:
+            return
+        with self.cond:
+            self.dirty[path] = self.dirty.get(path, False) or recursive
+            self.cond.notify()
+
+    def locate(self, path):
+        """絶対パスから (root名, 相対パス) を求める (管理外なら None)"""
+        for name, base in self.roots.items():
+            if path == base:
+                return name, ''
+            if path.startswith(base + os.sep):
+                rel = os.path.relpath(path, base).replace(os.sep, '/')
+                if self.ignore_prefixes and any(p.startswith(self.ignore_prefixes) for p in rel.split('/')):
+                    return None
+                return name, rel
+        return None
+
+    # --- 索引スレッド ---
+    def run(self):
+        conn = self.connect()
+        last_scan = last_full = time.monotonic()
+        # サイズ集計を持たない索引 (古い形式) なら、最初に集計し直す
+        if (conn.execute("SELECT COUNT(*) FROM dir_sizes").fetchone()[0] == 0
+                and conn.execute("SELECT COUNT(*) FROM files").fetchone()[0] > 0):
+            self.rebuild_sizes(conn)
+        self.sync_all(conn, deep=False)
+        self.ready = True
+
+        while True:
+            with self.cond:
+                timeout = max(0, last_scan + SCAN_INTERVAL - time.monotonic())
+                if not self.dirty:
+                    self.cond.wait(timeout)
+            if self.dirty:
+                # 立て続けに来る変更通知をまとめる
+                time.sleep(DIRTY_DELAY)
+                with self.cond:
+                    dirty, self.dirty = self.dirty, {}
+                for path, recursive in dirty.items():
+                    self.sync_path(conn, path, recursive)
+
+            now = time.monotonic()
+            if now - last_scan >= SCAN_INTERVAL:
+                deep = now - last_full >= FULL_SCAN_INTERVAL
+                self.sync_all(conn, deep=deep)
+                last_scan = now
+                if deep:
+                    last_full = now
+
+    def sync_all(self, conn, deep):
+        for name, base in self.roots.items():
+            try:
+                self.sync_tree(conn, name, base, '', deep)
+            except Exception as e:
+                print(f"Error indexing {base}: {e}")
+
+    def sync_path(self, conn, path, recursive):
+        located = self.locate(path)
+        if located is None:
+            return
+        root, rel = located
+        # 通知されたフォルダ自体は mtime が変わっていなくても読み直す
+        # (ファイルの上書き・追記ではフォルダの mtime は変わらない)
+        try:
+            if os.path.isdir(path):
+                self.sync_tree(conn, root, self.roots[root], rel, deep=recursive, force_top=True)
+            else:
+                # 消えたフォルダは親フォルダを読み直して索引から外す
+                self.sync_tree(conn, root, self.roots[root], parent_of(rel), deep=False, force_top=True)
+        except Exception as e:
+            print(f"Error indexing {path}: {e}")
+
+    def sync_tree(self, conn, root, base, top, deep, force_top=False):
+        """top 以下のフォルダを走査し、mtimeが変わったフォルダ (deepなら全て) を読み直す
+
+        force_top なら top 自体は mtime に関係なく読み直す。"""
+        stack = [top]
+        while stack:
+            rel = stack.pop()
+            path = os.path.join(base, rel) if rel else base
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            row = conn.execute("SELECT mtime_ns FROM dirs WHERE root = ? AND path = ?", (root, rel)).fetchone()
+            if deep or (force_top and rel == top) or row is None or row[0] != mtime_ns:
+                stack.extend(self.sync_dir(conn, root, base, rel, mtime_ns))
+            else:
+                stack.extend(r[0] for r in conn.execute(
+                    "SELECT path FROM files WHERE root = ? AND parent = ? AND is_dir = 1", (root, rel)))
+
+    def sync_dir(self, conn, root, base, rel, mtime_ns):
+        """1つのフォルダの内容を索引と突き合わせて更新し、サブフォルダの相対パスを返す"""
+        path = os.path.join(base, rel) if rel else base
+        found = {}
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if self.ignore_prefixes and entry.name.startswith(self.ignore_prefixes):
+                        continue
+                    try:
+                        st = entry.stat()
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        continue
+                    found[entry.name] = (int(is_dir), 0 if is_dir else st.st_size, st.st_mtime)
+        except OSError:
+            return []
+
+        prefix = rel + '/' if rel else ''
+        known = {
+            r[0]: (r[1], r[2], r[3]) for r in conn.execute(
+                "SELECT name, is_dir, size, mtime FROM files WHERE root = ? AND parent = ?", (root, rel))
+        }
+        changed = False
+        delta_size = delta_files = 0
+        for name, info in known.items():
+            if name not in found or found[name][0] != info[0]:
+                removed_size, removed_files = self.remove(conn, root, prefix + name)
+                delta_size -= removed_size
+                delta_files -= removed_files
+                changed = True
+        rows = []
+        for name, (is_dir, size, mtime) in found.items():
+            old = known.get(name)
+            if old != (is_dir, size, mtime):
+                ext = '' if is_dir else os.path.splitext(name)[1].lower()
+                rows.append((root, prefix + name, rel, name, ext, is_dir, size, mtime))
+                if not is_dir:
+                    if old is not None and old[0] == is_dir:
+                        delta_size += size - old[1]
+                    else:
+                        delta_size += size
+                        delta_files += 1
+        if delta_size or delta_files:
+            self.add_size(conn, root, rel, delta_size, delta_files)
+        elif rel and conn.execute("SELECT 1 FROM dir_sizes WHERE root = ? AND path = ?", (root, rel)).fetchone() is None:
+            # 空のフォルダも一覧に出せるように行を作っておく
+            self.add_size(conn, root, rel, 0, 0)
+        if rows:
+            conn.executemany(
+                "INSERT INTO files (root, path, parent, name, ext, is_dir, size, mtime) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (root, path) DO UPDATE SET "
+                "is_dir = excluded.is_dir, size = excluded.size, mtime = excluded.mtime", rows)
+            changed = True
+        conn.execute("INSERT OR REPLACE INTO dirs (root, path, mtime_ns) VALUES (?, ?, ?)", (root, rel, mtime_ns))
+        conn.commit()
+
+        if changed:
+            for listener in self.listeners:
+                try:
+                    listener(root, rel)
+                except Exception as e:
+                    print(f"Error in index listener: {e}")
+        return [prefix + name for name, info in found.items() if info[0]]
+
+    def remove(self, conn, root, path):
+        """ファイル (フォルダなら配下も) を索引から外し、外したファイルの合計サイズと数を返す"""
+        like = escape_like(path) + '/%'
+        where = "root = ? AND (path = ? OR path LIKE ? ESCAPE '\\')"
+        size, files = conn.execute(
+            f"SELECT COALESCE(SUM(size), 0), COUNT(*) FROM files WHERE {where} AND is_dir = 0", (root, path, like)
+        ).fetchone()
+        conn.execute(f"DELETE FROM files WHERE {where}", (root, path, like))
+        conn.execute(f"DELETE FROM dirs WHERE {where}", (root, path, like))
+        conn.execute(f"DELETE FROM dir_sizes WHERE {where}", (root, path, like))
+        return size, files
+
+    # --- フォルダの合計サイズ ---
+    def add_size(self, conn, root, rel, delta_size, delta_files):
+        """rel とその上のフォルダ全ての合計サイズに差分を足す"""
+        conn.executemany(
+            "INSERT INTO dir_sizes (root, path, parent, depth, size, files) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (root, path) DO UPDATE SET "
+            "size = size + excluded.size, files = files + excluded.files",
+            [(root, p, parent_of(p) if p else None, depth_of(p), delta_size, delta_files) for p in ancestors(rel)])
+
+    def rebuild_sizes(self, conn):
+        """索引の全ファイルからフォルダごとの合計サイズを集計し直す"""
+        totals = defaultdict(lambda: [0, 0])
+        for root, path, is_dir, size in conn.execute("SELECT root, path, is_dir, size FROM files"):
+            for p in ancestors(path if is_dir else parent_of(path)):
+                total = totals[(root, p)]
+                if not is_dir:
+                    total[0] += size
+                    total[1] += 1
+        conn.execute("DELETE FROM dir_sizes")
+        conn.executemany(
+            "INSERT INTO dir_sizes (root, path, parent, depth, size, files) VALUES (?, ?, ?, ?, ?, ?)",
+            [(root, p, parent_of(p) if p else None, depth_of(p), size, files)
+             for (root, p), (size, files) in totals.items()])
+        conn.commit()
+
+    def child_dir_sizes(self, root, rel):
+        """rel の直下のフォルダごとの合計サイズ (名前 -> バイト数)"""
+        rows = self.reader().execute(
+            "SELECT path, size FROM dir_sizes WHERE root = ? AND parent = ?", (root, rel))
+        return {path.rsplit('/', 1)[-1]: size for path, size in rows}
+
+    def dir_size(self, root, rel):
+        row = self.reader().execute(
+            "SELECT size, files FROM dir_sizes WHERE root = ? AND path = ?", (root, rel)).fetchone()
+        return row if row else (0, 0)
+
+    def largest_dirs(self, root=None, rel='', limit=10, max_depth=None):
+        """rel の配下で合計サイズの大きいフォルダ (max_depth は rel からの深さ)"""
+        where = ["depth > ?"]
+        params = [depth_of(rel)]
+        if rel:
+            where.append("path LIKE ? ESCAPE '\\'")
+            params.append(escape_like(rel) + '/%')
+        if root:
+            where.append("root = ?")
+            params.append(root)
+        if max_depth:
+            where.append("depth <= ?")
+            params.append(depth_of(rel) + max_depth)
+        rows = self.reader().execute(
+            "SELECT root, path, size, files FROM dir_sizes WHERE " + " AND ".join(where) +
+            " ORDER BY size DESC LIMIT ?", params + [limit])
+        return [{"root": r[0], "path": r[1], "size": r[2], "files": r[3]} for r in rows]
+
+    # --- 検索 ---
+    def search(self, q='', ext='', min_size=None, max_size=None, root=None, kind=None, limit=100, offset=0):
+        """名前の部分一致・拡張子・サイズで検索し、新しい順に返す"""
+        where = []
+        params = []
+        if q:
+            if self.fts and len(q) >= FTS_MIN_QUERY:
+                where.append("id IN (SELECT rowid FROM files_fts WHERE files_fts MATCH ?)")
+                params.append('"' + q.replace('"', '""') + '"')
+            else:
+                where.append("name LIKE ? ESCAPE '\\'")
+                params.append('%' + escape_like(q) + '%')
+        if ext:
+            where.append("ext = ?")
+            params.append(ext.lower() if ext.startswith('.') else '.' + ext.lower())
+        if min_size is not None:
+            where.append("size >= ?")
+            params.append(min_size)
+        if max_size is not None:
+            where.append("size <= ?")
+            params.append(max_size)
+        if root:
+            where.append("root = ?")
+            params.append(root)
+        if kind in ('file', 'dir'):
+            where.append("is_dir = ?")
+            params.append(int(kind == 'dir'))
+
+        sql = "SELECT root, path, name, is_dir, size, mtime FROM files"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY mtime DESC LIMIT ? OFFSET ?"
+        rows = self.reader().execute(sql, params + [limit, offset]).fetchall()
+        return [
+            {"root": r[0], "path": r[1], "name": r[2], "type": "dir" if r[3] else "file", "size": r[4], "mtime": r[5]}
+            for r in rows
+        ]
+
+
+class _EventHandler(FileSystemEventHandler):
+    """watchdog の変更通知を、読み直すフォルダとして索引に伝える"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def on_any_event(self, event):
+        if event.event_type in ('opened', 'closed', 'closed_no_write'):
+            return
+        src = os.path.abspath(event.src_path)
+        self.index.mark_dirty(os.path.dirname(src))
+        if event.is_directory and event.event_type == 'created':
+            self.index.mark_dirty(src, recursive=True)
+        dest = getattr(event, 'dest_path', '')
+        if dest:
+            dest = os.path.abspath(dest)
+            self.index.mark_dirty(os.path.dirname(dest))
+            if event.is_directory:
+                self.index.mark_dirty(dest, recursive=True)
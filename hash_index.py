@@ -0,0 +1,260 @@
+"""downloads 内のファイルの内容ハッシュ (SHA-256) の索引 (SQLite)
+
+downloader.py はダウンロードしながら計算したハッシュを登録し、同じ内容のファイルが
+既にあるかどうかの確認に使う。app.py はバックグラウンドで、まだ登録されていないファイルと
+サイズ・更新日時が変わったファイルだけを計算して索引を最新に保ち、重複の表示に使う。
+"""
+import os
+import hashlib
+import sqlite3
+import threading
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# ダウンロード途中のファイルは計算しない
+IGNORE_SUFFIXES = ('.part', '.part.json', '.tmp')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode TEXT NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hashes_sha256 ON hashes (sha256);
+CREATE INDEX IF NOT EXISTS hashes_parent ON hashes (parent);
+CREATE INDEX IF NOT EXISTS hashes_inode ON hashes (inode);
+"""
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(HASH_CHUNK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def link_file(src, dst):
+    """dst を src へのハードリンクに置き換える (dst が無ければ作る)"""
+    tmp_path = dst + '.tmp'
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    os.link(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def parent_of(path):
+    return path.rsplit('/', 1)[0] if '/' in path else ''
+
+
+def escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class HashIndex:
+    """内容ハッシュの索引。パスは base からの相対パス ('/' 区切り) で持つ"""
+
+    def __init__(self, db_path, base):
+        self.db_path = db_path
+        self.base = os.path.abspath(base)
+        self.conn = None
+        self.lock = threading.Lock()
+        self.dirty = set()  # 計算し直すフォルダ (相対パス)
+        self.cond = threading.Condition()
+        self.thread = None
+        self.ready = False
+        self.listeners = []  # ハッシュを登録したフォルダを受け取る関数 (フォルダの相対パス)
+
+    # --- 接続 ---
+    def connect(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self.conn = conn
+        return self.conn
+
+    def rel(self, path):
+        """絶対パスから相対パスを求める (base の外なら None)"""
+        path = os.path.abspath(path)
+        if not path.startswith(self.base + os.sep):
+            return None
+        return os.path.relpath(path, self.base).replace(os.sep, '/')
+
+    # --- 登録・検索 ---
+    def record(self, path, sha256, st=None):
+        """計算済みのハッシュを登録する"""
+        rel = self.rel(path)
+        if rel is None:
+            return
+        st = st or os.stat(path)
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO hashes (path, parent, size, mtime_ns, inode, sha256) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (rel, parent_of(rel), st.st_size, st.st_mtime_ns, f"{st.st_dev}:{st.st_ino}", sha256))
+
+    def lookup(self, sha256, exclude=None):
+        """同じ内容のファイルの絶対パス (登録後に変更・削除されたものは除く)"""
+        with self.lock:
+            rows = self.connect().execute(
+                "SELECT path, size, mtime_ns FROM hashes WHERE sha256 = ?", (sha256,)).fetchall()
+        found = []
+        for rel, size, mtime_ns in rows:
+            path = os.path.join(self.base, rel)
+            if exclude and os.path.abspath(path) == os.path.abspath(exclude):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if st.st_size == size and st.st_mtime_ns == mtime_ns:
+                found.append(path)
+        return found
+
+    def known_inode(self, st):
+        """同じ実体 (inode・サイズ・更新日時が同じ) のファイルの計算済みのハッシュ"""
+        with self.lock:
+            row = self.connect().execute(
+                "SELECT sha256 FROM hashes WHERE inode = ? AND size = ? AND mtime_ns = ? LIMIT 1",
+                (f"{st.st_dev}:{st.st_ino}", st.st_size, st.st_mtime_ns)).fetchone()
+        return row[0] if row else None
+
+    def duplicates_in(self, rel_dir):
+        """フォルダ内の各ファイルについて、同じ内容の別のファイル (ハードリンクは除く) の数"""
+        with self.lock:
+            rows = self.connect().execute(
+                "SELECT h.path, (SELECT COUNT(DISTINCT d.inode) FROM hashes d "
+                "WHERE d.sha256 = h.sha256 AND d.inode != h.inode) "
+                "FROM hashes h WHERE h.parent = ?", (rel_dir,)).fetchall()
+        return {path.rsplit('/', 1)[-1]: count for path, count in rows if count}
+
+    def duplicate_groups(self, limit=100):
+        """同じ内容のファイルのまとまり (無駄になっている容量の大きい順)"""
+        with self.lock:
+            conn = self.connect()
+            groups = conn.execute(
+                "SELECT sha256, MAX(size), COUNT(DISTINCT inode) AS copies FROM hashes "
+                "GROUP BY sha256 HAVING copies > 1 ORDER BY MAX(size) * (copies - 1) DESC LIMIT ?",
+                (limit,)).fetchall()
+            result = []
+            for sha256, size, copies in groups:
+                paths = [r[0] for r in conn.execute(
+                    "SELECT path FROM hashes WHERE sha256 = ? ORDER BY path", (sha256,))]
+                result.append({"sha256": sha256, "size": size, "copies": copies,
+                               "wasted": size * (copies - 1), "paths": paths})
+        return result
+
+    # --- バックグラウンドでの計算 ---
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, name="hash-index", daemon=True)
+        self.thread.start()
+
+    def mark_dirty(self, rel_dir):
+        """フォルダのファイルを確認し直すよう伝える"""
+        with self.cond:
+            self.dirty.add(rel_dir)
+            self.cond.notify()
+
+    def run(self):
+        self.sync_all()
+        self.ready = True
+        while True:
+            with self.cond:
+                while not self.dirty:
+                    self.cond.wait()
+                dirty, self.dirty = self.dirty, set()
+            for rel_dir in sorted(dirty):
+                try:
+                    self.sync_dir(rel_dir)
+                except Exception as e:
+                    print(f"Error hashing {rel_dir}: {e}")
+
+    def sync_all(self):
+        seen = set()
+        for dirpath, dirnames, _ in os.walk(self.base):
+            rel_dir = self.rel(dirpath) if dirpath != self.base else ''
+            seen.add(rel_dir)
+            try:
+                self.sync_dir(rel_dir)
+            except Exception as e:
+                print(f"Error hashing {dirpath}: {e}")
+        # 無くなったフォルダの分を消す
+        with self.lock:
+            conn = self.connect()
+            parents = [r[0] for r in conn.execute("SELECT DISTINCT parent FROM hashes")]
+            with conn:
+                conn.executemany("DELETE FROM hashes WHERE parent = ?",
+                                 [(p,) for p in parents if p not in seen])
+
+    def sync_dir(self, rel_dir):
+        """フォルダ内の新しいファイル・変更されたファイルだけを計算し、消えたファイルを索引から外す"""
+        path = os.path.join(self.base, rel_dir) if rel_dir else self.base
+        with self.lock:
+            known = {
+                r[0].rsplit('/', 1)[-1]: (r[1], r[2]) for r in self.connect().execute(
+                    "SELECT path, size, mtime_ns FROM hashes WHERE parent = ?", (rel_dir,))
+            }
+        found = set()
+        subdirs = set()
+        recorded = False
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            entries = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.add(entry.name)
+                    continue
+                if not entry.is_file(follow_symlinks=False) or entry.name.endswith(IGNORE_SUFFIXES):
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            found.add(entry.name)
+            if known.get(entry.name) == (st.st_size, st.st_mtime_ns):
+                continue
+            try:
+                # ハードリンクなら同じ実体の計算済みの値を使う
+                sha256 = self.known_inode(st) or file_sha256(entry.path)
+                # 計算中に書き換えられていたら、次の変更通知のときに計算し直す
+                if os.stat(entry.path).st_mtime_ns == st.st_mtime_ns:
+                    self.record(entry.path, sha256, st)
+                    recorded = True
+            except OSError:
+                continue
+
+        prefix = rel_dir + '/' if rel_dir else ''
+        removed = [name for name in known if name not in found]
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.executemany("DELETE FROM hashes WHERE path = ?", [(prefix + n,) for n in removed])
+                # 無くなったサブフォルダの配下
+                rows = conn.execute(
+                    "SELECT DISTINCT parent FROM hashes WHERE parent LIKE ? ESCAPE '\\'",
+                    (escape_like(prefix) + '%',)).fetchall() if prefix else conn.execute(
+                    "SELECT DISTINCT parent FROM hashes WHERE parent != ''").fetchall()
+                for (parent,) in rows:
+                    top = parent[len(prefix):].split('/', 1)[0]
+                    if top not in subdirs:
+                        conn.execute("DELETE FROM hashes WHERE parent = ?", (parent,))
+
+        if recorded and self.ready:
+            for listener in self.listeners:
+                try:
+                    listener(rel_dir)
+                except Exception as e:
+                    print(f"Error in hash index listener: {e}")
@@ -0,0 +1,101 @@
+"""downloader.py のジョブの状態を app.py と共有する登録簿 (SQLite)
+
+downloader.py は一定間隔でまとめて書き込み、app.py はそれを読むだけ。
+別々のプロセス・ターミナルで動いていても、同じ .state/downloads.db を見る。
+"""
+import os
+import time
+import sqlite3
+import threading
+
+STALE_AFTER = 30  # この時間更新が無く、プロセスも終了している実行中のジョブは 'lost' とみなす (秒)
+KEEP_FINISHED = 7 * 24 * 3600  # 終了したジョブを残しておく期間 (秒)
+ACTIVE_STATES = ('queued', 'running', 'retrying')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    source TEXT NOT NULL,
+    name TEXT NOT NULL,
+    state TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL,
+    rate REAL NOT NULL,
+    peers INTEGER NOT NULL,
+    eta REAL,
+    attempts INTEGER NOT NULL,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created);
+"""
+
+FIELDS = ('id', 'pid', 'kind', 'source', 'name', 'state', 'total', 'done', 'rate', 'peers',
+          'eta', 'attempts', 'error', 'created', 'updated')
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # 他のユーザーのプロセス
+    return True
+
+
+class JobRegistry:
+    """ジョブの登録簿。1つの接続を複数のスレッドで使うのでロックで守る"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self.conn = conn
+        return self.conn
+
+    def publish(self, records):
+        """ジョブの状態 (辞書のリスト) をまとめて1回で書き込む"""
+        now = time.time()
+        columns = ', '.join(FIELDS)
+        placeholders = ', '.join(':' + f for f in FIELDS)
+        updates = ', '.join(f"{f} = excluded.{f}" for f in FIELDS if f != 'id')
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO jobs ({columns}) VALUES ({placeholders}) "
+                    f"ON CONFLICT (id) DO UPDATE SET {updates}",
+                    [{**r, 'updated': now} for r in records])
+                conn.execute(
+                    "DELETE FROM jobs WHERE updated < ? AND state NOT IN ('queued', 'running', 'retrying')",
+                    (now - KEEP_FINISHED,))
+
+    def jobs(self, limit=100):
+        """新しい順のジョブ一覧 (更新が止まったまま終了したプロセスのジョブは 'lost' にする)"""
+        if not os.path.exists(self.db_path):
+            return []
+        with self.lock:
+            rows = self.connect().execute(
+                f"SELECT {', '.join(FIELDS)} FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        now = time.time()
+        jobs = []
+        for row in rows:
+            job = dict(zip(FIELDS, row))
+            if job['state'] in ACTIVE_STATES and now - job['updated'] > STALE_AFTER and not pid_alive(job['pid']):
+                job['state'] = 'lost'
+                job['rate'] = 0
+                job['eta'] = None
+            jobs.append(job)
+        return jobs
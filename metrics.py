@@ -0,0 +1,162 @@
+"""リクエストの計測 (/metrics): ルートごとの処理時間のヒストグラム・リクエスト数・送信バイト数
+
+WSGI のミドルウェアとして app.wsgi_app を包み、レスポンスを返し始めるまでの時間を計る。
+送ったバイト数は本文を送り終えた (close された) ときに数える。sendfile で送るファイル
+(wsgi.file_wrapper) は包むと sendfile が使えなくなるので、そのまま返して Content-Length で数える。
+複数ワーカーのときは、各ワーカーの値 (snapshot) を共有状態に書き出し、merge して合計する。
+"""
+import time
+import threading
+
+# 処理時間のヒストグラムの区切り (秒)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROUTE_KEY = 'file_manager.route'  # before_request でルート ('/api/list/<root_name>' など) を入れる environ のキー
+UNKNOWN_ROUTE = 'other'  # どのルートにも当たらなかったリクエスト (404 など)
+
+
+class Metrics:
+    """このプロセスの計測値。複数のスレッドから記録するのでロックで守る"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}  # "ルート メソッド ステータス" -> 回数
+        self.latency = {}  # ルート -> [区切りごとの回数..., 合計秒, 回数]
+        self.sent = {}  # ルート -> 送ったバイト数
+
+    def observe(self, route, method, status, seconds):
+        key = f"{route} {method} {status}"
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            hist = self.latency.get(route)
+            if hist is None:
+                hist = self.latency[route] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    hist[i] += 1
+                    break
+            hist[-2] += seconds
+            hist[-1] += 1
+
+    def add_bytes(self, route, size):
+        if size:
+            with self.lock:
+                self.sent[route] = self.sent.get(route, 0) + size
+
+    def snapshot(self):
+        """JSON にできる形の計測値 (共有状態への書き出し・merge 用)"""
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "latency": {route: list(hist) for route, hist in self.latency.items()},
+                "sent": dict(self.sent),
+            }
+
+
+def merge(snapshots):
+    """複数のワーカーの snapshot を合計する"""
+    total = {"requests": {}, "latency": {}, "sent": {}}
+    for snap in snapshots:
+        for key, count in snap["requests"].items():
+            total["requests"][key] = total["requests"].get(key, 0) + count
+        for route, hist in snap["latency"].items():
+            current = total["latency"].get(route)
+            total["latency"][route] = hist[:] if current is None else [a + b for a, b in zip(current, hist)]
+        for route, size in snap["sent"].items():
+            total["sent"][route] = total["sent"].get(route, 0) + size
+    return total
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_bound(bound):
+    return f"{bound:g}"
+
+
+def render(snap):
+    """Prometheus のテキスト形式にする"""
+    lines = [
+        "# HELP file_manager_requests_total Requests handled, by route, method and status.",
+        "# TYPE file_manager_requests_total counter",
+    ]
+    for key in sorted(snap["requests"]):
+        route, method, status = key.rsplit(' ', 2)
+        lines.append(f'file_manager_requests_total{{route="{label(route)}",method="{method}",status="{status}"}} '
+                     f'{snap["requests"][key]}')
+
+    lines += [
+        "# HELP file_manager_request_duration_seconds Time until the response starts, by route.",
+        "# TYPE file_manager_request_duration_seconds histogram",
+    ]
+    for route in sorted(snap["latency"]):
+        hist = snap["latency"][route]
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, hist):
+            cumulative += count
+            lines.append(f'file_manager_request_duration_seconds_bucket{{route="{label(route)}",'
+                         f'le="{format_bound(bound)}"}} {cumulative}')
+        lines.append(f'file_manager_request_duration_seconds_bucket{{route="{label(route)}",le="+Inf"}} {hist[-1]}')
+        lines.append(f'file_manager_request_duration_seconds_sum{{route="{label(route)}"}} {hist[-2]:.6f}')
+        lines.append(f'file_manager_request_duration_seconds_count{{route="{label(route)}"}} {hist[-1]}')
+
+    lines += [
+        "# HELP file_manager_response_bytes_total Response body bytes sent, by route.",
+        "# TYPE file_manager_response_bytes_total counter",
+    ]
+    for route in sorted(snap["sent"]):
+        lines.append(f'file_manager_response_bytes_total{{route="{label(route)}"}} {snap["sent"][route]}')
+    return "\n".join(lines) + "\n"
+
+
+class CountingBody:
+    """本文を送りながらバイト数を数え、送り終えたら (close) 記録する"""
+
+    def __init__(self, body, metrics, route):
+        self.body = body
+        self.metrics = metrics
+        self.route = route
+        self.size = 0
+
+    def __iter__(self):
+        for data in self.body:
+            self.size += len(data)
+            yield data
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.metrics.add_bytes(self.route, self.size)
+
+
+class MetricsMiddleware:
+    """app.wsgi_app を包んで、リクエストごとに Metrics へ記録する"""
+
+    def __init__(self, wsgi_app, metrics):
+        self.wsgi_app = wsgi_app
+        self.metrics = metrics
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        response = {}
+
+        def counting_start_response(status, headers, exc_info=None):
+            response["status"] = status.split(' ', 1)[0]
+            response["headers"] = headers
+            return start_response(status, headers, exc_info)
+
+        body = self.wsgi_app(environ, counting_start_response)
+        route = environ.get(ROUTE_KEY, UNKNOWN_ROUTE)
+        self.metrics.observe(route, environ.get('REQUEST_METHOD', ''), response.get("status", '500'),
+                             time.perf_counter() - start)
+
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+            # sendfile で送られるので包まない (途中で切断されても全体を送ったものとして数える)
+            for name, value in response.get("headers", ()):
+                if name.lower() == 'content-length':
+                    self.metrics.add_bytes(route, int(value))
+            return body
+        return CountingBody(body, self.metrics, route)
@@ -0,0 +1,93 @@
+"""本番用の起動スクリプト: app.py の app を gunicorn の複数ワーカー × 複数スレッドで動かす
+
+    python serve.py --workers 4 --threads 16
+
+開発用の `python app.py` (Flask の開発サーバー) と違い、大きなファイルのダウンロード・
+アップロードが同時にいくつ続いても他のリクエストが詰まらない。
+設定は引数か環境変数 (FILE_MANAGER_BIND / _WORKERS / _THREADS / _TIMEOUT) で変えられる。
+
+- ファイルは wsgi.file_wrapper を通して sendfile で送る (ワーカーのメモリを通らない)
+- 分割アップロードのチャンクは受け取りながら .part に書き込むので、本文全体をメモリに載せない
+- 解凍ジョブ・イベントは .state/shared.db で、索引の更新は1つのワーカーだけが行う
+"""
+import os
+import sys
+import argparse
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    print("❌ エラー: gunicorn が見つかりません。")
+    print("以下のコマンドでインストールしてください:")
+    print("pip install gunicorn")
+    sys.exit(1)
+
+DEFAULT_BIND = '0.0.0.0:5000'
+DEFAULT_WORKERS = min(os.cpu_count() or 1, 4)
+# /api/events (自動更新) は開いている画面1つにつき1スレッドを使い続けるので、多めにしておく
+DEFAULT_THREADS = 16
+DEFAULT_TIMEOUT = 120  # ワーカーが応答しなくなってから再起動するまでの時間 (秒)
+GRACEFUL_TIMEOUT = 30  # 終了時に実行中のリクエストを待つ時間 (秒)
+KEEPALIVE = 5  # Keep-Alive の接続を待つ時間 (秒)
+
+
+class Server(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # 各ワーカーがフォークした後に読み込む (索引・イベントのスレッドはワーカーごとに起動する)
+        from app import app
+        return app
+
+
+def parse_args():
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description="File Manager を本番用のサーバーで起動します")
+    parser.add_argument('-b', '--bind', default=env('FILE_MANAGER_BIND', DEFAULT_BIND),
+                        help=f"待ち受けるアドレス (既定: {DEFAULT_BIND})")
+    parser.add_argument('-w', '--workers', type=int, default=int(env('FILE_MANAGER_WORKERS', DEFAULT_WORKERS)),
+                        help=f"ワーカープロセスの数 (既定: CPU数, 最大4 → {DEFAULT_WORKERS})")
+    parser.add_argument('-t', '--threads', type=int, default=int(env('FILE_MANAGER_THREADS', DEFAULT_THREADS)),
+                        help=f"ワーカー1つあたりのスレッド数 = 同時に処理するリクエスト数 (既定: {DEFAULT_THREADS})")
+    parser.add_argument('--timeout', type=int, default=int(env('FILE_MANAGER_TIMEOUT', DEFAULT_TIMEOUT)),
+                        help=f"応答しなくなったワーカーを再起動するまでの時間 (秒, 既定: {DEFAULT_TIMEOUT})")
+    parser.add_argument('--access-log', action='store_true', help="アクセスログを標準出力に表示する")
+    args = parser.parse_args()
+    args.workers = max(args.workers, 1)
+    args.threads = max(args.threads, 1)
+    return args
+
+
+def main():
+    args = parse_args()
+    # ワーカーは環境変数を引き継ぐので、解凍の同時実行数をワーカー数で分け合える
+    os.environ['FILE_MANAGER_WORKERS'] = str(args.workers)
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        # スレッドで処理するワーカー: 長いダウンロードやイベントの接続があっても、ワーカーの生存確認は止まらない
+        'worker_class': 'gthread',
+        'timeout': args.timeout,
+        'graceful_timeout': GRACEFUL_TIMEOUT,
+        'keepalive': KEEPALIVE,
+        'sendfile': True,
+        # 起動前に app を読み込むと、フォークしたワーカーに索引のスレッドが引き継がれないので読み込まない
+        'preload_app': False,
+        'accesslog': '-' if args.access_log else None,
+    }
+    # 生存確認用のファイルはメモリ上に置く (ディスクが遅いとワーカーが止まったと誤判定されるため)
+    if os.path.isdir('/dev/shm'):
+        options['worker_tmp_dir'] = '/dev/shm'
+    print(f"🚀 {args.bind} で起動します (ワーカー {args.workers} × スレッド {args.threads})")
+    Server(options).run()
+
+
+if __name__ == '__main__':
+    main()
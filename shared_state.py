@@ -0,0 +1,212 @@
+"""app.py を複数のワーカープロセスで動かすとき (serve.py) に共有する状態 (SQLite とファイルロック)
+
+- 解凍ジョブの状態と中止の依頼 (どのワーカーに来たリクエストからでも見える・止められる)
+- ワーカー間で配るイベント (フォルダの変更、索引の読み直しの依頼)
+- 索引を更新するプロセスを1つに決めるためのロックと、索引の状態
+- 各ワーカーのリクエストの計測値 (/metrics で合計する)
+1プロセスで動かす場合も同じ仕組みを使う。
+"""
+import os
+import json
+import time
+import fcntl
+import sqlite3
+import threading
+from job_registry import pid_alive
+
+EVENT_KEEP = 60  # イベントを残しておく時間 (秒)
+JOB_HISTORY = 100  # 終了したジョブを残しておく件数
+ACTIVE_STATES = ('queued', 'running')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    data TEXT NOT NULL,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS flags (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    pid INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+class FileLock:
+    """プロセス間 (flock) とスレッド間 (Lock) の両方で排他するロック"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fd = None
+
+    def acquire(self, blocking=True):
+        if not self.lock.acquire(blocking):
+            return False
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            self.lock.release()
+            return False
+        self.fd = fd
+        return True
+
+    def release(self):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SharedState:
+    """ワーカー間で共有する状態。1つの接続を複数のスレッドで使うのでロックで守る"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = None
+        self.lock = threading.Lock()
+        self.last_prune = 0
+
+    def connect(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self.conn = conn
+        return self.conn
+
+    # --- ジョブ ---
+    def save_jobs(self, records):
+        """このプロセスのジョブの状態 (job_to_dict の結果のリスト) を書き込む。中止の依頼は消さない"""
+        now = time.time()
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO jobs (id, pid, state, data, created, updated) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                    "updated = excluded.updated",
+                    [(r["id"], os.getpid(), r["state"], json.dumps(r), r["created"], now) for r in records])
+                conn.execute(
+                    "DELETE FROM jobs WHERE state NOT IN ('queued', 'running') AND id NOT IN ("
+                    "SELECT id FROM jobs WHERE state NOT IN ('queued', 'running') ORDER BY created DESC LIMIT ?)",
+                    (JOB_HISTORY,))
+
+    def jobs(self, job_id=None):
+        """全ワーカーのジョブ (新しい順)。終了したワーカーに残っていたジョブはエラーにする"""
+        with self.lock:
+            conn = self.connect()
+            if job_id is None:
+                rows = conn.execute("SELECT pid, data, cancel FROM jobs ORDER BY created DESC").fetchall()
+            else:
+                rows = conn.execute("SELECT pid, data, cancel FROM jobs WHERE id = ?", (job_id,)).fetchall()
+        jobs = []
+        for pid, data, cancel in rows:
+            job = json.loads(data)
+            job["cancel_requested"] = job["cancel_requested"] or bool(cancel)
+            if job["state"] in ACTIVE_STATES and pid != os.getpid() and not pid_alive(pid):
+                job["state"] = "error"
+                job["error"] = "ジョブを実行していたワーカーが終了しました"
+            jobs.append(job)
+        return jobs
+
+    def request_cancel(self, job_id):
+        """中止を依頼する (ジョブを持っているワーカーが次に確認したときに止める)。ジョブが無ければ False"""
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                return conn.execute("UPDATE jobs SET cancel = 1 WHERE id = ?", (job_id,)).rowcount > 0
+
+    def cancel_requests(self, job_ids):
+        """job_ids のうち中止を依頼されたもの"""
+        if not job_ids:
+            return set()
+        job_ids = list(job_ids)
+        with self.lock:
+            rows = self.connect().execute(
+                f"SELECT id FROM jobs WHERE cancel = 1 AND id IN ({', '.join('?' * len(job_ids))})",
+                job_ids).fetchall()
+        return {r[0] for r in rows}
+
+    # --- イベント ---
+    def publish(self, event, data):
+        """全ワーカーにイベントを配る (各ワーカーが events_since で受け取る)"""
+        now = time.time()
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.execute("INSERT INTO events (type, data, created) VALUES (?, ?, ?)",
+                             (event, json.dumps(data), now))
+                if now - self.last_prune >= EVENT_KEEP:
+                    self.last_prune = now
+                    conn.execute("DELETE FROM events WHERE created < ?", (now - EVENT_KEEP,))
+
+    def last_event_id(self):
+        with self.lock:
+            return self.connect().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def events_since(self, last_id):
+        """last_id より後のイベント [(id, 種類, データ), ...]"""
+        with self.lock:
+            rows = self.connect().execute(
+                "SELECT id, type, data FROM events WHERE id > ? ORDER BY id", (last_id,)).fetchall()
+        return [(event_id, event, json.loads(data)) for event_id, event, data in rows]
+
+    # --- フラグ ---
+    def set_flag(self, name, value):
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO flags (name, value) VALUES (?, ?)", (name, str(value)))
+
+    def get_flag(self, name, default=None):
+        with self.lock:
+            row = self.connect().execute("SELECT value FROM flags WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    # --- 計測値 ---
+    def save_metrics(self, snapshot):
+        """このプロセスの計測値 (metrics.Metrics.snapshot の結果) を書き込む"""
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO metrics (pid, data, updated) VALUES (?, ?, ?)",
+                             (os.getpid(), json.dumps(snapshot), time.time()))
+
+    def metrics(self):
+        """動いている全ワーカーの計測値。終了したワーカーの分は消す"""
+        with self.lock:
+            conn = self.connect()
+            rows = conn.execute("SELECT pid, data FROM metrics").fetchall()
+            dead = [(pid,) for pid, _ in rows if pid != os.getpid() and not pid_alive(pid)]
+            if dead:
+                with conn:
+                    conn.executemany("DELETE FROM metrics WHERE pid = ?", dead)
+        dead = {pid for pid, in dead}
+        return [json.loads(data) for pid, data in rows if pid not in dead]
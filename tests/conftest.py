@@ -0,0 +1,134 @@
+import os
+import sys
+import gzip
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """テスト用のファイルサーバー。server.files[パス] の内容を返す (単一範囲の Range / If-Range に対応)
+
+    server.options で動きを変える:
+      ranges: False なら Accept-Ranges を返さず、Range も無視する
+      validators: False なら ETag / Last-Modified を返さない
+      etag: 返す ETag (If-Range と一致しなければ 200 で全体を返す)
+      stale_if_range: True なら If-Range 付きの要求には常に 200 で全体を返す (途中でファイルが変わった)
+      gate / gate_after: gate_after バイト送ったところで gate が set されるまで待つ
+      truncate: このバイト数だけ送って接続を切る (Content-Length は全体のまま)
+      gzip: True なら Content-Encoding: gzip で圧縮して送る (Content-Length は圧縮後)
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        content = self.server.files.get(self.path.split('?', 1)[0])
+        if content is None:
+            self.send_error(404)
+            return
+        opts = self.server.options
+        if opts.get('gzip'):
+            content = gzip.compress(content)
+        self.server.requests.append(dict(self.headers))
+        etag = opts.get('etag', '"v1"')
+        ranges = opts.get('ranges', True)
+        start, end = 0, len(content) - 1
+        header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if opts.get('stale_if_range') and if_range:
+            if_range = None
+            header = None
+        if ranges and header and (if_range is None or if_range == etag):
+            first, _, last = header[len('bytes='):].partition('-')
+            start = int(first)
+            end = min(int(last), end) if last else end
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{len(content)}")
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        if ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if opts.get('gzip'):
+            self.send_header('Content-Encoding', 'gzip')
+        if opts.get('validators', True):
+            self.send_header('ETag', etag)
+        self.end_headers()
+        body = content[start:end + 1]
+        if 'truncate' in opts:
+            body = body[:opts['truncate']]
+            self.close_connection = True
+        try:
+            if 'gate' in opts:
+                self.wfile.write(body[:opts['gate_after']])
+                self.wfile.flush()
+                opts['gate'].wait(10)
+                body = body[opts['gate_after']:]
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    """FileHandler で動くサーバー (server.url にベースURL)"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+    server.daemon_threads = True
+    server.files = {}
+    server.options = {}
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def downloader(tmp_path, monkeypatch):
+    """保存先・状態を tmp_path に向けた downloader モジュール (libtorrent が無ければ skip)"""
+    pytest.importorskip('libtorrent')
+    import downloader
+    monkeypatch.setattr(downloader, 'SAVE_PATH', str(tmp_path / 'downloads'))
+    monkeypatch.setattr(downloader, 'HASH_INDEX_FILE', str(tmp_path / '.state' / 'hashes.db'))
+    monkeypatch.setattr(downloader, '_hash_index', None)
+    downloader.STOP.clear()
+    yield downloader
+    downloader.STOP.clear()
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """一時フォルダで起動した app モジュール (downloads / extracted / .state はその中に作られる)"""
+    workdir = tmp_path_factory.mktemp('app')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    wait_until(app.index_ready)
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def wait_until(condition, timeout=10, interval=0.05):
+    """condition() が真になるまで待つ (バックグラウンドの索引・ジョブ用)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = condition()
+        if value:
+            return value
+        time.sleep(interval)
+    raise AssertionError(f"{timeout} 秒待っても条件を満たしませんでした")
@@ -0,0 +1,157 @@
+import io
+import zipfile
+import tarfile
+import pytest
+import os
+from conftest import wait_until
+
+
+def usage_total(client, path):
+    r = client.get('/api/usage', query_string={"root": "downloads", "path": path}).get_json()
+    return r["total"]
+
+
+def test_usage_follows_upload_overwrite(app_module, client):
+    """アップロードで同じ名前のファイルを上書きしても (フォルダの mtime は変わらない) 合計サイズが変わる"""
+    folder = os.path.join(app_module.DOWNLOAD_DIR, "u13")
+    os.makedirs(folder)
+    with open(os.path.join(folder, "report.txt"), 'wb') as f:
+        f.write(b"x" * 100)
+    app_module.notify_change(folder)
+    wait_until(lambda: usage_total(client, "u13") == 100)
+
+    r = client.post('/api/upload', data={"target_path": "u13", "files": (io.BytesIO(b"y" * 5100), "report.txt")})
+    assert r.get_json()["status"] == "ok"
+
+    wait_until(lambda: usage_total(client, "u13") == 5100)
+
+
+def test_list_etag_is_stable_across_rescans_and_workers(app_module, client, monkeypatch):
+    folder = os.path.join(app_module.DOWNLOAD_DIR, "u10")
+    os.makedirs(folder)
+    with open(os.path.join(folder, "a.txt"), 'wb') as f:
+        f.write(b"a" * 10)
+    url = '/api/list/downloads?path=u10'
+    etag = client.get(url).headers['ETag']
+
+    # LIST_CACHE_TTL が過ぎて読み直した場合・キャッシュを持たない別のワーカーが返す場合
+    monkeypatch.setattr(app_module, 'LIST_CACHE_TTL', 0)
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    app_module.list_cache.clear()
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    # 上書きでサイズが変われば (フォルダの mtime は同じでも) 送り直す
+    with open(os.path.join(folder, "a.txt"), 'wb') as f:
+        f.write(b"a" * 20)
+    r = client.get(url, headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert r.headers['ETag'] != etag
+
+
+def test_safe_join_rejects_sibling_with_same_prefix(app_module, tmp_path):
+    base = str(tmp_path / ".extracting-1-name")
+    assert app_module.safe_join(base, "a/b.txt") == os.path.join(base, "a", "b.txt")
+    for name in ("../.extracting-1-nameX/f", "../x", "/etc/passwd"):
+        with pytest.raises(ValueError):
+            app_module.safe_join(base, name)
+
+
+def test_member_path_rejects_escapes(app_module, tmp_path):
+    dst = tmp_path / "dst"
+    dst.mkdir()
+    (dst / "up").symlink_to(tmp_path)
+    (dst / "outside.txt").symlink_to(tmp_path / "target.txt")
+    assert app_module.member_path(str(dst), "dir/file.txt") == str(dst / "dir" / "file.txt")
+    for name in ("../evil", "a/../../evil", "/abs/evil", "up/evil", "outside.txt"):
+        with pytest.raises(ValueError):
+            app_module.member_path(str(dst), name)
+
+
+def test_member_path_accepts_root_entry_only_as_directory(app_module, tmp_path):
+    dst = str(tmp_path)
+    for name in (".", "./"):
+        assert app_module.member_path(dst, name, is_dir=True) == dst
+        with pytest.raises(ValueError):
+            app_module.member_path(dst, name)
+    assert app_module.member_path(dst, "./a/b.txt") == os.path.join(dst, "a", "b.txt")
+
+
+def run_extract(client, path):
+    job_id = client.post('/api/extract', query_string={"path": path}).get_json()["job_id"]
+    return wait_until(lambda: (lambda j: j if j["state"] not in ("queued", "running") else None)(
+        client.get(f'/api/jobs/{job_id}').get_json()["job"]))
+
+
+def test_extract_rejects_traversing_zip_member(app_module, client):
+    with zipfile.ZipFile(os.path.join(app_module.DOWNLOAD_DIR, "evil.zip"), 'w') as zf:
+        zf.writestr("ok.txt", "ok")
+        zf.writestr("../outside-zip.txt", "evil")
+
+    job = run_extract(client, "evil.zip")
+
+    assert job["state"] == "error"
+    assert not os.path.exists(os.path.join(app_module.EXTRACT_DIR, "outside-zip.txt"))
+    assert not os.path.exists(os.path.join(app_module.BASE_DIR, "outside-zip.txt"))
+
+
+def test_extract_tar_does_not_follow_links_outside(app_module, client):
+    path = os.path.join(app_module.DOWNLOAD_DIR, "links.tar")
+    with tarfile.open(path, 'w') as tar:
+        link = tarfile.TarInfo("up")
+        link.type = tarfile.SYMTYPE
+        link.linkname = ".."
+        tar.addfile(link)
+        data = b"evil"
+        member = tarfile.TarInfo("up/outside-tar.txt")
+        member.size = len(data)
+        tar.addfile(member, io.BytesIO(data))
+
+    run_extract(client, "links.tar")
+
+    assert not os.path.exists(os.path.join(app_module.EXTRACT_DIR, "outside-tar.txt"))
+    assert not os.path.islink(os.path.join(app_module.EXTRACT_DIR, "links", "up"))
+
+
+def test_extract_tar_with_dot_root_entry(app_module, client, tmp_path):
+    """tar -C dir -czf x.tgz . で作った (先頭に './' のエントリがある) アーカイブ"""
+    src = tmp_path / "dot-src"
+    (src / "sub").mkdir(parents=True)
+    (src / "a.txt").write_bytes(b"a" * 10)
+    (src / "sub" / "b.txt").write_bytes(b"b" * 20)
+    with tarfile.open(os.path.join(app_module.DOWNLOAD_DIR, "dotroot.tar.gz"), 'w:gz') as tar:
+        tar.add(str(src), arcname='.')
+        assert tar.getnames()[0] == '.'
+
+    job = run_extract(client, "dotroot.tar.gz")
+
+    assert job["state"] == "done", job["error"]
+    out = os.path.join(app_module.EXTRACT_DIR, app_module.archive_folder_name("dotroot.tar.gz"))
+    with open(os.path.join(out, "a.txt"), 'rb') as f:
+        assert f.read() == b"a" * 10
+    with open(os.path.join(out, "sub", "b.txt"), 'rb') as f:
+        assert f.read() == b"b" * 20
+
+
+def test_event_pump_survives_disk_usage_error(app_module, monkeypatch):
+    """ディスク容量の取得で例外が出ても、イベントの配信は止まらない"""
+    import queue
+    calls = []
+    real_disk_usage = app_module.get_disk_usage
+
+    def flaky_disk_usage():
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError("disk_usage failed")
+        return real_disk_usage()
+
+    monkeypatch.setattr(app_module, 'get_disk_usage', flaky_disk_usage)
+    monkeypatch.setattr(app_module, 'DISK_EVENT_INTERVAL', 0)
+    q = queue.Queue()
+    with app_module.subscribers_lock:
+        app_module.subscribers.add(q)
+    try:
+        wait_until(lambda: len(calls) >= 2)
+        wait_until(lambda: any("event: disk" in m for m in list(q.queue)))
+    finally:
+        with app_module.subscribers_lock:
+            app_module.subscribers.discard(q)
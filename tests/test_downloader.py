@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+import hashlib
+
+
+def test_stop_does_not_finish_unranged_download(downloader, http_server):
+    """Range 非対応のサーバーから受信中に STOP されたら、途中のファイルを完了扱いにしない"""
+    content = os.urandom(512 * 1024)
+    gate = threading.Event()
+    http_server.files['/file.bin'] = content
+    http_server.options.update(ranges=False, gate=gate, gate_after=64 * 1024)
+    result = {}
+
+    def run():
+        result['path'] = downloader.download_http(f"{http_server.url}/file.bin", connections=1,
+                                                  chunk_size=16 * 1024, verbose=False)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    part_path = os.path.join(downloader.SAVE_PATH, 'file.bin.part')
+    deadline = time.monotonic() + 5
+    while not (os.path.exists(part_path) and os.path.getsize(part_path) > 0) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    downloader.STOP.set()
+    gate.set()
+    thread.join(10)
+
+    assert result['path'] is None
+    assert not os.path.exists(os.path.join(downloader.SAVE_PATH, 'file.bin'))
+    assert downloader.get_hash_index().lookup(hashlib.sha256(content).hexdigest()) == []
+
+
+def test_truncated_unranged_download_is_not_renamed(downloader, http_server):
+    content = os.urandom(256 * 1024)
+    http_server.files['/short.bin'] = content
+    http_server.options.update(ranges=False, truncate=100 * 1024)
+
+    assert downloader.download_http(f"{http_server.url}/short.bin", connections=1, verbose=False) is None
+    assert not os.path.exists(os.path.join(downloader.SAVE_PATH, 'short.bin'))
+
+
+def test_gzip_encoded_download_is_saved(downloader, http_server):
+    """Content-Length は圧縮後のサイズなので、展開後に書き込んだサイズとは比べない"""
+    content = b"compressible line\n" * 8000
+    http_server.files['/file.txt'] = content
+    http_server.options.update(gzip=True)
+
+    path = downloader.download_http(f"{http_server.url}/file.txt", connections=4, verbose=False)
+
+    assert path == os.path.join(downloader.SAVE_PATH, 'file.txt')
+    with open(path, 'rb') as f:
+        assert f.read() == content
+    assert not os.path.exists(path + '.part')
+
+
+def test_gzip_encoded_progress_shows_bytes(downloader, http_server, capsys):
+    content = b"compressible line\n" * 8000
+    http_server.files['/log.txt'] = content
+    http_server.options.update(gzip=True)
+
+    assert downloader.download_http(f"{http_server.url}/log.txt", connections=1, verbose=True)
+
+    out = capsys.readouterr().out
+    assert '受信' in out
+    assert '=' * 51 not in out
+
+
+def test_progress_bar_is_clamped(downloader, capsys):
+    progress = downloader.Progress(100, show=True)
+    progress.add(1000)
+    progress.draw()
+    out = capsys.readouterr().out
+    assert '=' * 51 not in out
+    assert '100.00%' in out
+
+
+def test_truncated_gzip_download_is_not_renamed(downloader, http_server):
+    content = os.urandom(256 * 1024)
+    http_server.files['/short.txt'] = content
+    http_server.options.update(gzip=True, truncate=100 * 1024)
+
+    assert downloader.download_http(f"{http_server.url}/short.txt", connections=1, verbose=False) is None
+    assert not os.path.exists(os.path.join(downloader.SAVE_PATH, 'short.txt'))
+
+
+def test_segmented_download_matches(downloader, http_server):
+    content = os.urandom(5 * 1024 * 1024)
+    http_server.files['/big.bin'] = content
+
+    path = downloader.download_http(f"{http_server.url}/big.bin", connections=4, verbose=False)
+
+    with open(path, 'rb') as f:
+        assert f.read() == content
+    assert downloader.get_hash_index().lookup(hashlib.sha256(content).hexdigest()) == [os.path.abspath(path)]
+
+
+def interrupt_download(downloader, http_server, name, content, **options):
+    """1接続でダウンロードを始め、途中で STOP して .part と再開用の情報を残す"""
+    gate = threading.Event()
+    http_server.files[f'/{name}'] = content
+    http_server.options.update(gate=gate, gate_after=len(content) // 4, **options)
+    thread = threading.Thread(target=downloader.download_http, args=(f"{http_server.url}/{name}",),
+                              kwargs={'connections': 1, 'chunk_size': 16 * 1024, 'verbose': False})
+    thread.start()
+    part_path = os.path.join(downloader.SAVE_PATH, name + '.part')
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if os.path.exists(part_path + '.json') or downloader.STOP.is_set():
+            break
+        time.sleep(0.01)
+    time.sleep(0.2)
+    downloader.STOP.set()
+    gate.set()
+    thread.join(10)
+    downloader.STOP.clear()
+    http_server.options.clear()
+    assert os.path.exists(part_path)
+
+
+def test_resume_without_validators_restarts(downloader, http_server):
+    """ETag も Last-Modified も無いサーバーでは、別の内容に変わっていてもつなぎ合わせない"""
+    old, new = os.urandom(2 * 1024 * 1024), os.urandom(2 * 1024 * 1024)
+    interrupt_download(downloader, http_server, 'plain.bin', old, validators=False)
+
+    http_server.files['/plain.bin'] = new
+    http_server.options.update(validators=False)
+    path = downloader.download_http(f"{http_server.url}/plain.bin", connections=2, verbose=False)
+
+    with open(path, 'rb') as f:
+        assert f.read() == new
+
+
+def test_resume_sends_if_range(downloader, http_server):
+    content = os.urandom(2 * 1024 * 1024)
+    interrupt_download(downloader, http_server, 'resume.bin', content)
+
+    http_server.requests.clear()
+    path = downloader.download_http(f"{http_server.url}/resume.bin", connections=1, verbose=False)
+
+    with open(path, 'rb') as f:
+        assert f.read() == content
+    ranged = [h for h in http_server.requests if 'Range' in h]
+    assert ranged and all(h.get('If-Range') == '"v1"' for h in ranged)
+    assert int(ranged[0]['Range'].split('=')[1].split('-')[0]) > 0
+
+
+def test_if_range_mismatch_restarts_from_scratch(downloader, http_server):
+    """再開中に If-Range が一致せず 200 が返ったら、途中のファイルを捨てて全体を取り直す"""
+    old, new = os.urandom(2 * 1024 * 1024), os.urandom(2 * 1024 * 1024)
+    interrupt_download(downloader, http_server, 'changed.bin', old)
+
+    http_server.files['/changed.bin'] = new
+    http_server.options.update(stale_if_range=True)
+    path = downloader.download_http(f"{http_server.url}/changed.bin", connections=1, verbose=False)
+
+    with open(path, 'rb') as f:
+        assert f.read() == new
+    assert not os.path.exists(path + '.part.json')
+
+
+def test_segmented_hash_is_not_read_by_writer_threads(downloader, http_server, monkeypatch):
+    """分割ダウンロードのハッシュ計算で、書き込むスレッドがファイルを読み直して待たされない"""
+    content = os.urandom(6 * 1024 * 1024)
+    http_server.files['/seg.bin'] = content
+    readers = set()
+    read_until = downloader.StreamHasher.read_until
+
+    def recording_read_until(self, limit):
+        readers.add(threading.current_thread().name)
+        return read_until(self, limit)
+
+    monkeypatch.setattr(downloader.StreamHasher, 'read_until', recording_read_until)
+    path = downloader.download_http(f"{http_server.url}/seg.bin", connections=4, verbose=False)
+
+    assert downloader.get_hash_index().lookup(hashlib.sha256(content).hexdigest()) == [os.path.abspath(path)]
+    assert not any(name.startswith('ThreadPoolExecutor') for name in readers)
+
+
+def test_resumed_download_records_correct_hash(downloader, http_server):
+    content = os.urandom(3 * 1024 * 1024)
+    interrupt_download(downloader, http_server, 'again.bin', content)
+
+    path = downloader.download_http(f"{http_server.url}/again.bin", connections=3, verbose=False)
+
+    assert downloader.get_hash_index().lookup(hashlib.sha256(content).hexdigest()) == [os.path.abspath(path)]
+
+
+def test_skip_dedup_keeps_unrelated_file(downloader, http_server):
+    """dedup='skip' で同じ内容のファイルがあるとき、保存先にある別の内容のファイルを消さない"""
+    content = os.urandom(64 * 1024)
+    sha256 = hashlib.sha256(content).hexdigest()
+    os.makedirs(downloader.SAVE_PATH)
+    original = os.path.join(downloader.SAVE_PATH, 'original.bin')
+    with open(original, 'wb') as f:
+        f.write(content)
+    downloader.get_hash_index().record(original, sha256)
+    unrelated = os.path.join(downloader.SAVE_PATH, 'dup.bin')
+    with open(unrelated, 'wb') as f:
+        f.write(b'unrelated')
+    http_server.files['/dup.bin'] = content
+    url = f"{http_server.url}/dup.bin"
+
+    # ダウンロードしてから重複に気づく場合と、チェックサムで事前に気づく場合
+    assert downloader.download_http(url, connections=1, dedup='skip', verbose=False) == original
+    assert downloader.download_http(url, connections=1, dedup='skip', checksum=('sha256', sha256),
+                                    verbose=False) == original
+    with open(unrelated, 'rb') as f:
+        assert f.read() == b'unrelated'
+    assert not os.path.exists(unrelated + '.part')
+
+
+def test_queue_backoff_does_not_block_other_jobs(downloader, tmp_path, monkeypatch):
+    """再試行の待ち時間中のジョブが、ほかのジョブの実行を止めない"""
+    queue = tmp_path / 'queue.txt'
+    queue.write_text("http://example.invalid/a\nhttp://example.invalid/b\nhttp://example.invalid/c\n")
+    monkeypatch.setattr(downloader, 'REGISTRY_FILE', str(tmp_path / '.state' / 'downloads.db'))
+    monkeypatch.setattr(downloader, 'RETRY_BACKOFF', 3)
+    monkeypatch.setattr('sys.argv', ['downloader.py', '--queue', str(queue), '--jobs', '1', '--retries', '1'])
+    started = time.monotonic()
+    calls = []
+
+    def fake_download(source, *args, job=None, **kwargs):
+        calls.append((source.rsplit('/', 1)[1], time.monotonic() - started))
+        if source[-1] in 'ab' and job.attempts == 1:
+            job.error = "接続できません"
+            return None
+        return os.path.join(downloader.SAVE_PATH, source[-1])
+
+    monkeypatch.setattr(downloader, 'download_http', fake_download)
+    downloader.run_queue(downloader.parse_args())
+
+    first_c = next(t for name, t in calls if name == 'c')
+    assert first_c < 1
+    assert sorted(name for name, _ in calls) == ['a', 'a', 'b', 'b', 'c']
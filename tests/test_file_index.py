@@ -0,0 +1,64 @@
+import os
+import pytest
+from file_index import FileIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    roots = {"downloads": tmp_path / "downloads", "extracted": tmp_path / "extracted"}
+    for path in roots.values():
+        path.mkdir()
+    index = FileIndex(str(tmp_path / ".state" / "index.db"), {k: str(v) for k, v in roots.items()})
+    index.init_db()
+    return index
+
+
+@pytest.fixture
+def conn(index):
+    """索引スレッドの代わりに書き込む接続 (最初の走査は済ませておく)"""
+    conn = index.connect()
+    index.sync_all(conn, deep=False)
+    yield conn
+    conn.close()
+
+
+def rewrite_in_place(path, data):
+    """フォルダの mtime を変えずにファイルの内容だけを書き換える"""
+    folder = os.path.dirname(path)
+    st = os.stat(folder)
+    with open(path, 'wb') as f:
+        f.write(data)
+    os.utime(folder, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def test_marked_dir_is_reread_when_file_grows_in_place(index, conn, tmp_path):
+    folder = tmp_path / "downloads" / "videos"
+    folder.mkdir()
+    target = folder / "clip.mp4"
+    target.write_bytes(b"x" * 100)
+    index.sync_path(conn, str(folder), False)
+    assert [r["size"] for r in index.search(q="clip")] == [100]
+
+    rewrite_in_place(str(target), b"x" * 5100)
+    index.sync_path(conn, str(folder), False)
+
+    assert [r["size"] for r in index.search(q="clip")] == [5100]
+    assert index.search(min_size=5000)[0]["name"] == "clip.mp4"
+
+
+def test_rolled_up_sizes_follow_in_place_rewrites(index, conn, tmp_path):
+    """上書きでファイルが大きく・小さくなったら、上のフォルダの合計サイズも変わる"""
+    folder = tmp_path / "downloads" / "a" / "b"
+    folder.mkdir(parents=True)
+    target = folder / "data.bin"
+    target.write_bytes(b"x" * 100)
+    index.sync_path(conn, str(tmp_path / "downloads" / "a"), True)
+    assert index.dir_size("downloads", "a") == (100, 1)
+
+    for size in (5100, 10):
+        rewrite_in_place(str(target), b"x" * size)
+        index.sync_path(conn, str(folder), False)
+        assert index.dir_size("downloads", "a/b") == (size, 1)
+        assert index.dir_size("downloads", "a") == (size, 1)
+        assert index.dir_size("downloads", "") == (size, 1)
+        assert index.child_dir_sizes("downloads", "a") == {"b": size}
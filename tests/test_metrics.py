@@ -0,0 +1,83 @@
+import os
+import re
+import multiprocessing
+
+from metrics import Metrics, merge, render
+from shared_state import SharedState
+
+fork = multiprocessing.get_context('fork')
+
+
+def sample(text, name, **labels):
+    """Prometheus のテキストから1つの値を取り出す (無ければ 0)"""
+    want = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    for line in text.splitlines():
+        m = re.fullmatch(r'(\w+)\{(.*)\} (\S+)', line)
+        if m and m.group(1) == name and all(part in m.group(2).split(',') for part in want.split(',')):
+            return float(m.group(3))
+    return 0
+
+
+def test_requests_are_counted_by_route(app_module, client):
+    path = os.path.join(app_module.DOWNLOAD_DIR, 'm23.bin')
+    with open(path, 'wb') as f:
+        f.write(b'x' * 3000)
+    route = '/api/download/<root_name>'
+    before = client.get('/metrics').get_data(as_text=True)
+
+    # 送ったバイト数は本文を送り終えて close されたときに数える
+    with client.get('/api/download/downloads', query_string={"path": "m23.bin"}) as r:
+        assert r.status_code == 200
+        assert len(r.get_data()) == 3000
+    assert client.get('/no-such-page').status_code == 404
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert (sample(text, 'file_manager_requests_total', route=route, method='GET', status='200')
+            - sample(before, 'file_manager_requests_total', route=route, method='GET', status='200')) == 1
+    assert sample(text, 'file_manager_requests_total', route='other', status='404') >= 1
+    assert (sample(text, 'file_manager_request_duration_seconds_count', route=route)
+            - sample(before, 'file_manager_request_duration_seconds_count', route=route)) == 1
+    assert (sample(text, 'file_manager_response_bytes_total', route=route)
+            - sample(before, 'file_manager_response_bytes_total', route=route)) == 3000
+
+
+def test_histogram_is_cumulative():
+    metrics = Metrics()
+    metrics.observe('/', 'GET', '200', 0.002)
+    metrics.observe('/', 'GET', '200', 0.3)
+    metrics.observe('/', 'GET', '200', 60)
+    text = render(metrics.snapshot())
+    assert sample(text, 'file_manager_request_duration_seconds_bucket', route='/', le='0.005') == 1
+    assert sample(text, 'file_manager_request_duration_seconds_bucket', route='/', le='0.5') == 2
+    assert sample(text, 'file_manager_request_duration_seconds_bucket', route='/', le='10') == 2
+    assert sample(text, 'file_manager_request_duration_seconds_bucket', route='/', le='+Inf') == 3
+
+
+def test_merge_adds_up_workers():
+    first, second = Metrics(), Metrics()
+    first.observe('/', 'GET', '200', 0.002)
+    second.observe('/', 'GET', '200', 0.3)
+    second.add_bytes('/', 10)
+    total = merge([first.snapshot(), second.snapshot()])
+    assert total["requests"] == {'/ GET 200': 2}
+    assert total["latency"]['/'][-1] == 2
+    assert total["sent"] == {'/': 10}
+
+
+def save_metrics(db_path):
+    metrics = Metrics()
+    metrics.observe('/api/list/<root_name>', 'GET', '200', 0.02)
+    SharedState(db_path).save_metrics(metrics.snapshot())
+
+
+def test_metrics_of_exited_workers_are_dropped(tmp_path):
+    db_path = str(tmp_path / 'shared.db')
+    proc = fork.Process(target=save_metrics, args=(db_path,))
+    proc.start()
+    proc.join(10)
+
+    state = SharedState(db_path)
+    metrics = Metrics()
+    metrics.observe('/', 'GET', '200', 0.2)
+    state.save_metrics(metrics.snapshot())
+    assert merge(state.metrics())["requests"] == {'/ GET 200': 1}
@@ -0,0 +1,88 @@
+import multiprocessing
+
+import pytest
+
+from shared_state import SharedState, FileLock
+
+fork = multiprocessing.get_context('fork')
+
+
+def job(job_id, state='running', created=1.0):
+    return {"id": job_id, "state": state, "created": created, "cancel_requested": False, "error": None}
+
+
+def worker(db_path, records, ready, release, result):
+    """別のワーカープロセスとしてジョブを書き込み、release まで待って中止の依頼を返す"""
+    state = SharedState(db_path)
+    state.save_jobs(records)
+    ready.set()
+    release.wait(10)
+    result.put(sorted(state.cancel_requests([r["id"] for r in records])))
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'shared.db')
+
+
+def test_jobs_and_cancel_cross_workers(db_path):
+    ready, release, result = fork.Event(), fork.Event(), fork.Queue()
+    proc = fork.Process(target=worker, args=(db_path, [job('a'), job('b')], ready, release, result))
+    proc.start()
+    try:
+        assert ready.wait(10)
+        state = SharedState(db_path)
+        assert {j["id"]: j["state"] for j in state.jobs()} == {'a': 'running', 'b': 'running'}
+
+        assert state.request_cancel('b')
+        assert not state.request_cancel('missing')
+        assert state.jobs('b')[0]["cancel_requested"]
+        release.set()
+        assert result.get(timeout=10) == ['b']
+    finally:
+        release.set()
+        proc.join(10)
+
+    # ジョブを持っていたワーカーが終了したら、実行中のままにせずエラーとして見せる
+    jobs = {j["id"]: j for j in SharedState(db_path).jobs()}
+    assert jobs['a']["state"] == 'error'
+    assert jobs['a']["error"]
+
+
+def test_save_jobs_keeps_cancel_request(db_path):
+    state = SharedState(db_path)
+    state.save_jobs([job('a')])
+    state.request_cancel('a')
+    state.save_jobs([job('a')])
+    assert state.cancel_requests(['a']) == {'a'}
+
+
+def test_finished_jobs_are_pruned(db_path, monkeypatch):
+    monkeypatch.setattr('shared_state.JOB_HISTORY', 2)
+    state = SharedState(db_path)
+    state.save_jobs([job(str(i), 'done', created=float(i)) for i in range(5)] + [job('live', created=0.0)])
+    assert [j["id"] for j in state.jobs()] == ['4', '3', 'live']
+
+
+def hold_lock(path, locked, release):
+    with FileLock(path):
+        locked.set()
+        release.wait(10)
+
+
+def test_file_lock_excludes_other_processes(tmp_path):
+    path = str(tmp_path / 'indexer.lock')
+    locked, release = fork.Event(), fork.Event()
+    proc = fork.Process(target=hold_lock, args=(path, locked, release))
+    proc.start()
+    try:
+        assert locked.wait(10)
+        lock = FileLock(path)
+        assert not lock.acquire(blocking=False)
+        release.set()
+        proc.join(10)
+        assert lock.acquire(blocking=False)
+        lock.release()
+    finally:
+        release.set()
+        proc.join(10)